@@ -0,0 +1,414 @@
+"""
+AI 廚師顧問 - 異步模組
+AI Chef Advisor - Async Module
+
+asyncio 原生的 AI 廚師顧問：異步 OpenAI/Gemini 客戶端、有界並發和取消支持，
+讓單個工作進程能同時服務多個用戶
+"""
+
+import os
+import weakref
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from ai_chef_functions import AIChefAdvisor, detect_service, hedge_options
+from ai_chef_backends import Backend, describe_error
+from ai_chef_parsing import parse_structured, is_complete_result
+from ai_chef_images import prepare_image_bytes
+from ai_chef_nutrition import analyze_ingredients
+from ai_chef_ingredients import normalize_ingredients
+from ai_chef_singleflight import AsyncSingleFlight
+from ai_chef_hedging import DEFAULT_HEDGE_ENABLED
+from ai_chef_metrics import traced, note, note_service, note_fallback
+
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("AI_CHEF_MAX_CONCURRENCY", "8"))
+
+
+class AsyncAIChefAdvisor:
+    """
+    異步 AI 廚師顧問
+
+    公開方法與 AIChefAdvisor 相同，但都是協程。提示詞構建、響應緩存、
+    客戶端池和模型路由與同步版本共用同一套實現。
+    """
+
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 use_service: str = "openai",
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 timeout: Optional[float] = None,
+                 **advisor_options):
+        """
+        初始化異步 AI 廚師顧問
+
+        Parameters:
+        -----------
+        api_key : str, optional
+            API 金鑰
+        use_service : str
+            使用的 AI 服務：後端註冊表中的名稱（"openai", "gemini", "local_server", "llama_cpp"），或 "local"
+        max_concurrency : int
+            同時進行中的上游請求數上限
+        timeout : float, optional
+            單次上游請求的超時時間（秒）
+        **advisor_options
+            傳給 AIChefAdvisor 的其他參數（cache, pool, router 等）
+        """
+        self._advisor = AIChefAdvisor(api_key=api_key, use_service=use_service, **advisor_options)
+        self.use_service = use_service
+        self.api_key = self._advisor.api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+        # 每個事件循環一個並發信號量（見 _limiter）
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+        self._tasks: Set[asyncio.Task] = set()
+        # 同時進行的相同請求只發出一次（合併後的請求只佔一個並發名額）
+        self.flights = AsyncSingleFlight()
+        self._hedge: Optional["AsyncAIChefAdvisor"] = None
+        self.metrics = self._advisor.metrics
+
+    @property
+    def conversation_history(self) -> List[Dict]:
+        return self._advisor.conversation_history
+
+    def _limiter(self) -> asyncio.Semaphore:
+        # 同一顧問可能先後在多個事件循環中使用（例如多次 asyncio.run）；
+        # 信號量持有循環的強引用，已關閉循環的信號量在這裡丟棄
+        loop = asyncio.get_running_loop()
+        for closed in [l for l in self._semaphores if l.is_closed()]:
+            del self._semaphores[closed]
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _bounded(self, make_call: Callable[[], Awaitable]):
+        """
+        在並發上限和超時限制內執行上游請求，並登記以便取消
+
+        傳入的是構造協程的函數，取得並發名額後才真正發出請求。
+        """
+        async with self._limiter():
+            task = asyncio.ensure_future(make_call())
+            self._tasks.add(task)
+            try:
+                if self.timeout:
+                    return await asyncio.wait_for(task, self.timeout)
+                return await task
+            finally:
+                self._tasks.discard(task)
+
+    def cancel_all(self):
+        """取消所有進行中的上游請求"""
+        for task in list(self._tasks):
+            task.cancel()
+
+    # ==================== 菜譜生成 ====================
+
+    @traced("recipe")
+    async def generate_recipe(self,
+                              dish_name: str,
+                              difficulty: str = "medium",
+                              servings: int = 2,
+                              available_ingredients: List[str] = None,
+                              cooking_time_limit: int = None) -> Dict:
+        """使用 AI 生成菜譜（參數同 AIChefAdvisor.generate_recipe）"""
+        advisor = self._advisor
+        ingredient_keys = normalize_ingredients(available_ingredients)
+        cache_key = advisor._recipe_cache_key(
+            dish_name, difficulty, servings,
+            ingredient_keys, cooking_time_limit
+        )
+        if cache_key:
+            cached = advisor.cache.get(cache_key)
+            note(cache="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+        semantic_namespace = advisor._recipe_semantic_namespace(
+            difficulty, servings, ingredient_keys, cooking_time_limit
+        )
+        cached = advisor._semantic_get(semantic_namespace, dish_name)
+        if cached is not None:
+            return cached
+
+        prompt = advisor._build_recipe_prompt(
+            dish_name, difficulty, servings,
+            available_ingredients, cooking_time_limit
+        )
+        result = await self._generate(prompt, "recipe")
+
+        if cache_key and is_complete_result(result):
+            advisor.cache.set(cache_key, result)
+        advisor._semantic_set(semantic_namespace, dish_name, result)
+        advisor._store_recipe(
+            result, dish_name, difficulty, servings,
+            ingredient_keys, cooking_time_limit
+        )
+
+        return result
+
+    async def _generate(self, prompt: str, task_type: str) -> Dict:
+        """用當前服務生成內容；啟用對沖時慢請求會被備用後端的結果取代，落敗的請求被取消"""
+        advisor = self._advisor
+        target = advisor._hedge_target(task_type)
+        if target is None:
+            return await self._generate_direct(prompt, task_type)
+        primary_name, backup_name, backup, candidates = target
+        backup = self if backup is advisor else self._hedge_advisor(backup)
+        return await advisor.hedger.run_async(
+            (primary_name, partial(self._generate_direct, prompt, task_type)),
+            (backup_name, partial(backup._generate_direct, prompt, task_type, candidates)),
+            is_complete_result
+        )
+
+    async def _generate_direct(self, prompt: str, task_type: str, candidates: Optional[List[str]] = None) -> Dict:
+        backend = self._advisor._backend()
+        if backend is None:
+            return self._advisor._generate_with_local(prompt, task_type)
+        return await self._generate_with(backend, prompt, task_type, candidates)
+
+    def _hedge_advisor(self, backup: AIChefAdvisor) -> "AsyncAIChefAdvisor":
+        """備用服務的異步顧問（使用各自的並發名額）"""
+        if self._hedge is None:
+            self._hedge = AsyncAIChefAdvisor(
+                api_key=backup.api_key, use_service=backup.use_service,
+                max_concurrency=self.max_concurrency, timeout=self.timeout, use_cache=False
+            )
+        return self._hedge
+
+    @traced("generate")
+    async def _generate_with(self,
+                             backend: Backend,
+                             prompt: str,
+                             task_type: str,
+                             candidates: Optional[List[str]] = None) -> Dict:
+        """使用指定後端的異步接口生成內容"""
+        note_service(backend.name)
+        try:
+            content = await backend.complete_async(self, self._advisor._generation_request(prompt, task_type, candidates))
+        except Exception as e:
+            # 服務中斷時改用本地模型（降級結果不緩存）
+            fallback = self._advisor._local_backend(exclude=backend)
+            if fallback is not None:
+                note_fallback()
+                return dict(await self._generate_with(fallback, prompt, task_type), degraded=fallback.name)
+            return {"error": f"❌ 生成出錯: {describe_error(backend, e)}"}
+
+        return parse_structured(content, task_type)
+
+    # ==================== 圖片識別 ====================
+
+    @traced("identify")
+    async def identify_dish_from_image(self, image_path: str) -> Dict:
+        """從圖片識別菜品（參數同 AIChefAdvisor.identify_dish_from_image）"""
+        if not os.path.exists(image_path):
+            return {"error": "圖片文件不存在"}
+
+        # 解碼、縮放和特徵提取是 CPU 密集操作，放到線程中避免阻塞事件循環
+        backend = self._advisor._vision_backend()
+        if backend is None:
+            features = await asyncio.to_thread(self._advisor._extract_image_features, image_path)
+            return self._advisor._identify_with_local(features)
+
+        # 先用縮略圖的感知雜湊查重複圖片，命中時不必再編碼上傳用的完整圖片
+        image_hash = await asyncio.to_thread(self._advisor._image_hash, image_path)
+        cached = self._advisor._cached_identification(image_hash)
+        if cached is not None:
+            return cached
+
+        try:
+            image = await asyncio.to_thread(prepare_image_bytes, image_path)
+        except Exception as e:
+            return {"error": f"圖片識別失敗: {str(e)}"}
+        result = await self._identify_with(backend, image)
+        self._advisor._remember_identification(image_hash, result)
+        return result
+
+    @traced("identify")
+    async def identify_prepared_image(self, prepared: Dict) -> Dict:
+        """
+        識別已經預處理好的圖片
+
+        讓調用方（如批量處理）在其他進程中完成解碼和編碼，這裡只負責上傳。
+
+        Parameters:
+        -----------
+        prepared : dict
+            遠程服務: {"data": 圖片字節, "media_type": MIME 類型, "phash": 感知雜湊（可選）}；
+            本地識別: {"thumbnail": RGB 縮略圖陣列}
+
+        Returns:
+        --------
+        dict
+            識別結果
+        """
+        backend = self._advisor._vision_backend()
+        if backend is not None:
+            image_hash = prepared.get("phash")
+            cached = self._advisor._cached_identification(image_hash)
+            if cached is not None:
+                return cached
+
+            result = await self._identify_with(backend, (prepared["data"], prepared["media_type"]))
+            self._advisor._remember_identification(image_hash, result)
+            return result
+
+        features = self._advisor._features_from_thumbnail(prepared["thumbnail"])
+        return self._advisor._identify_with_local(features)
+
+    @traced("identify")
+    async def _identify_with(self, backend: Backend, image: Tuple[bytes, str]) -> Dict:
+        """使用指定後端的異步接口識別圖片"""
+        note_service(backend.name)
+        try:
+            content = await backend.complete_async(self, self._advisor._vision_request(image))
+        except Exception as e:
+            return {"error": f"圖片識別失敗: {describe_error(backend, e)}"}
+
+        return parse_structured(content, "vision")
+
+    # ==================== 烹飪建議 / 營養分析 ====================
+
+    @traced("advice")
+    async def get_cooking_advice(self,
+                                 dish_name: str,
+                                 skill_level: str = "intermediate",
+                                 dietary_restrictions: List[str] = None) -> Dict:
+        """獲取個性化烹飪建議（參數同 AIChefAdvisor.get_cooking_advice）"""
+        prompt = self._advisor._build_advice_prompt(dish_name, skill_level, dietary_restrictions)
+        return await self._generate(prompt, "advice")
+
+    @traced("nutrition")
+    async def analyze_nutrition(self,
+                                ingredients: Dict[str, str],
+                                servings: int = 1) -> Dict:
+        """分析菜譜的營養成分（參數同 AIChefAdvisor.analyze_nutrition）"""
+        # 本地計算只需幾十微秒，不必放到線程中
+        result = analyze_ingredients(ingredients, servings)
+        if self._advisor._active_service() == "local":
+            return self._advisor._merge_health_advice(result, {})
+        prompt = self._advisor._build_health_advice_prompt(ingredients, result)
+        return self._advisor._merge_health_advice(result, await self._generate(prompt, "health_advice"))
+
+    async def generate_recipe_with_insights(self,
+                                            dish_name: str,
+                                            difficulty: str = "medium",
+                                            servings: int = 2,
+                                            available_ingredients: List[str] = None,
+                                            cooking_time_limit: int = None,
+                                            skill_level: str = "intermediate",
+                                            dietary_restrictions: List[str] = None) -> Dict:
+        """
+        生成菜譜，並同時獲取烹飪建議和營養分析
+
+        烹飪建議不依賴菜譜內容，與菜譜生成並行；營養分析在菜譜的材料
+        生成後立即開始，與尚未完成的烹飪建議重疊執行。
+
+        Returns:
+        --------
+        dict
+            {"菜譜": ..., "烹飪建議": ..., "營養分析": ...}
+        """
+        advice_task = asyncio.ensure_future(
+            self.get_cooking_advice(dish_name, skill_level, dietary_restrictions)
+        )
+        try:
+            recipe = await self.generate_recipe(
+                dish_name, difficulty, servings,
+                available_ingredients, cooking_time_limit
+            )
+
+            ingredients = recipe.get("材料")
+            if isinstance(ingredients, dict) and ingredients:
+                nutrition, advice = await asyncio.gather(
+                    self.analyze_nutrition(ingredients, servings), advice_task
+                )
+            else:
+                nutrition = {"error": "菜譜中沒有可分析的材料"}
+                advice = await advice_task
+        except BaseException:
+            advice_task.cancel()
+            raise
+
+        return {"菜譜": recipe, "烹飪建議": advice, "營養分析": nutrition}
+
+    # ==================== 對話功能 ====================
+
+    @traced("chat")
+    async def chat(self, user_message: str) -> str:
+        """與 AI 廚師進行對話（參數同 AIChefAdvisor.chat）"""
+        advisor = self._advisor
+        semantic_namespace = advisor._chat_semantic_namespace()
+        cached = advisor._semantic_get(semantic_namespace, user_message, exact=True)
+        if cached is not None:
+            advisor._remember_turn(user_message, cached["content"])
+            return cached["content"]
+
+        backend = advisor._backend()
+        note(service=advisor._active_service())
+        if backend is None:
+            return advisor._chat_with_local()
+        # 只有成功的回應才和用戶消息一起寫入記憶（見 AIChefAdvisor.chat）
+        request = advisor._chat_request(advisor.memory.with_message("user", user_message))
+        try:
+            assistant_message = await backend.complete_async(self, request)
+        except Exception as e:
+            # 服務中斷時用本地模型回答（不進入語義緩存）
+            fallback = advisor._local_backend(exclude=backend)
+            if fallback is None:
+                return f"❌ 對話出錯: {describe_error(backend, e)}"
+            note_fallback()
+            try:
+                assistant_message = await fallback.complete_async(self, request)
+            except Exception as fallback_error:
+                return f"❌ 對話出錯: {describe_error(fallback, fallback_error)}"
+            advisor._remember_turn(user_message, assistant_message)
+            return assistant_message
+
+        advisor._remember_turn(user_message, assistant_message)
+        advisor._semantic_set(semantic_namespace, user_message, {"content": assistant_message})
+        return assistant_message
+
+    def clear_conversation(self):
+        """清除對話歷史"""
+        self._advisor.clear_conversation()
+
+    def model_health(self) -> Dict[str, Dict]:
+        """查看各模型的健康狀況"""
+        return self._advisor.model_health()
+
+
+# ==================== 便利函數 ====================
+
+def init_async_ai_chef(api_key: Optional[str] = None,
+                       service: str = "auto",
+                       hedge: bool = DEFAULT_HEDGE_ENABLED,
+                       **options) -> AsyncAIChefAdvisor:
+    """
+    初始化異步 AI 廚師顧問
+
+    Parameters:
+    -----------
+    api_key : str, optional
+        API 金鑰
+    service : str
+        服務選擇: "auto", "openai", "gemini", "local_server", "llama_cpp", "local"
+    hedge : bool
+        是否啟用對沖請求（預設讀取 AI_CHEF_HEDGE，見 init_ai_chef）
+    **options
+        傳給 AsyncAIChefAdvisor 的其他參數
+
+    Returns:
+    --------
+    AsyncAIChefAdvisor
+        異步 AI 廚師顧問實例
+    """
+    if service == "auto":
+        service = detect_service()
+
+    options = dict(hedge_options(service, hedge), **options)
+    return AsyncAIChefAdvisor(api_key=api_key, use_service=service, **options)
@@ -0,0 +1,902 @@
+"""
+AI 廚師顧問 - 後端模組
+AI Chef Advisor - Backends Module
+
+各 AI 服務實現同一個後端接口（單次生成、流式生成、異步生成），並在註冊表中登記
+能力（文本、視覺、流式、JSON 模式）和各模型的費用、延遲元數據；
+顧問只通過註冊表分派請求，緩存、合併、限速、對沖等通用層只需實現一次
+"""
+
+import os
+import time
+import asyncio
+import threading
+from functools import partial
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from ai_chef_pool import ClientPool
+from ai_chef_router import ModelRouter, classify_error
+from ai_chef_images import to_data_url, to_gemini_part
+from ai_chef_singleflight import flight_key
+from ai_chef_ratelimit import estimate_request_tokens, RETRYABLE_ERRORS
+from ai_chef_metrics import MODEL_PRICES, estimate_cost, note, note_usage, note_fallback
+from ai_chef_prompts import TEMPLATES, PROMPT_CACHE_ENABLED, GEMINI_CACHE_TTL, gemini_context_cacheable
+
+
+# 後端能力
+TEXT = "text"
+VISION = "vision"
+STREAMING = "streaming"
+JSON_MODE = "json_mode"
+
+# 各服務使用的模型
+OPENAI_TEXT_MODEL = "gpt-3.5-turbo"
+OPENAI_VISION_MODEL = "gpt-4-vision-preview"
+GEMINI_TEXT_MODELS = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-pro']
+GEMINI_VISION_MODELS = ['gemini-2.5-flash', 'gemini-1.5-flash', 'gemini-pro-vision', 'gemini-pro']
+
+# 本地 OpenAI 兼容服務（llama.cpp server、Ollama、vLLM 等）；設置地址後自動選擇服務時也會考慮它
+DEFAULT_LOCAL_SERVER_URL = os.getenv("AI_CHEF_LOCAL_SERVER_URL", "")
+DEFAULT_LOCAL_SERVER_MODEL = os.getenv("AI_CHEF_LOCAL_SERVER_MODEL", "local-model")
+LOCAL_SERVER_FALLBACK_URL = "http://localhost:8080/v1"
+
+# 進程內的本地量化模型（GGUF）；設置路徑後在沒有雲端服務或雲端請求失敗時使用
+DEFAULT_LOCAL_MODEL_PATH = os.getenv("AI_CHEF_LOCAL_MODEL_PATH", "")
+DEFAULT_LOCAL_MODEL_THREADS = int(os.getenv("AI_CHEF_LOCAL_MODEL_THREADS", "0")) or os.cpu_count() or 4
+DEFAULT_LOCAL_MODEL_CTX = int(os.getenv("AI_CHEF_LOCAL_MODEL_CTX", "4096"))
+DEFAULT_LOCAL_MODEL_CACHE_MB = int(os.getenv("AI_CHEF_LOCAL_MODEL_CACHE_MB", "256"))
+
+
+# ==================== 模型元數據 ====================
+
+class ModelInfo:
+    """單個模型的能力、價格和典型延遲"""
+
+    __slots__ = ("name", "vision", "json_mode", "latency", "prices")
+
+    def __init__(self,
+                 name: str,
+                 vision: bool = False,
+                 json_mode: bool = False,
+                 latency: Optional[float] = None,
+                 prices: Optional[Tuple[float, float]] = None):
+        """
+        Parameters:
+        -----------
+        name : str
+            模型名稱
+        vision : bool
+            是否接受圖片輸入
+        json_mode : bool
+            是否支持原生 JSON 輸出模式
+        latency : float, optional
+            典型的單次生成延遲（秒），路由器還沒有實測數據時作為參考
+        prices : tuple, optional
+            每百萬 token 的 (輸入, 輸出) 美元價格，預設取 MODEL_PRICES
+        """
+        self.name = name
+        self.vision = vision
+        self.json_mode = json_mode
+        self.latency = latency
+        self.prices = prices if prices is not None else MODEL_PRICES.get(name)
+
+    def cost(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Optional[float]:
+        """估算一次調用的費用（美元）；價格未知時返回 None"""
+        if self.prices is None:
+            return estimate_cost(self.name, prompt_tokens, completion_tokens)
+        return ((prompt_tokens or 0) * self.prices[0] + (completion_tokens or 0) * self.prices[1]) / 1_000_000
+
+    def to_dict(self) -> Dict:
+        return {
+            "vision": self.vision,
+            "json_mode": self.json_mode,
+            "latency": self.latency,
+            "prices": self.prices,
+        }
+
+
+MODEL_CATALOG: Dict[str, ModelInfo] = {
+    info.name: info for info in [
+        ModelInfo("gpt-3.5-turbo", json_mode=True, latency=2.0),
+        ModelInfo("gpt-4-vision-preview", vision=True, latency=6.0),
+        ModelInfo("gemini-2.5-flash", vision=True, json_mode=True, latency=3.0),
+        ModelInfo("gemini-2.0-flash", vision=True, json_mode=True, latency=2.0),
+        ModelInfo("gemini-1.5-flash", vision=True, json_mode=True, latency=2.0),
+        ModelInfo("gemini-pro", latency=4.0),
+        ModelInfo("gemini-pro-vision", vision=True, latency=5.0),
+    ]
+}
+
+# 支持原生 JSON 輸出模式（response_mime_type）的 Gemini 模型
+GEMINI_JSON_MODE_MODELS = {
+    name for name, info in MODEL_CATALOG.items() if name.startswith("gemini") and info.json_mode
+}
+
+
+# ==================== 請求與錯誤 ====================
+
+class CompletionRequest:
+    """
+    一次模型調用需要的內容，各後端按自己的接口格式組裝
+
+    prompt 是單輪請求，memory 是多輪對話（二選一）；
+    image 為 (圖片字節, MIME 類型) 時是圖片識別請求。
+    cache_key 是提示詞模板名稱：同一模板的請求共用逐字相同的固定前綴（system），
+    後端據此使用服務端的前綴緩存。
+    """
+
+    __slots__ = ("prompt", "system", "memory", "image", "max_tokens", "json_mode", "temperature", "models",
+                 "cache_key")
+
+    def __init__(self,
+                 prompt: Optional[str] = None,
+                 system: Optional[str] = None,
+                 memory=None,
+                 image: Optional[Tuple[bytes, str]] = None,
+                 max_tokens: Optional[int] = None,
+                 json_mode: bool = False,
+                 temperature: Optional[float] = 0.7,
+                 models: Optional[List[str]] = None,
+                 cache_key: Optional[str] = None):
+        self.prompt = prompt
+        self.system = system
+        self.memory = memory
+        self.image = image
+        self.max_tokens = max_tokens
+        self.json_mode = json_mode
+        self.temperature = temperature
+        # 覆蓋後端的預設模型順序（對沖到同一服務的下一個模型時使用）
+        self.models = models
+        self.cache_key = cache_key
+
+    @property
+    def vision(self) -> bool:
+        return self.image is not None
+
+
+class BackendError(Exception):
+    """後端無法完成請求（信息可以直接顯示給用戶）"""
+
+
+def describe_error(backend: "Backend", error: BaseException) -> str:
+    """把後端拋出的異常轉為顯示給用戶的錯誤信息"""
+    if isinstance(error, BackendError):
+        return str(error)
+    if isinstance(error, asyncio.TimeoutError):
+        return "請求超時"
+    return f"{backend.label} API 錯誤: {str(error)}"
+
+
+# ==================== 後端接口 ====================
+
+class Backend:
+    """
+    AI 服務後端的基類
+
+    子類實現 complete / stream / complete_async。調用時傳入顧問本身，
+    後端使用顧問的連接池、限速器、請求合併器和路由器（異步方法傳入異步顧問）。
+    """
+
+    name = "base"
+    label = "AI"
+    # 保存 API 金鑰的環境變數；已設置時自動選擇服務會考慮此後端
+    key_env: Optional[str] = None
+    capabilities: FrozenSet[str] = frozenset()
+
+    def __init__(self,
+                 text_models: Iterable[str],
+                 vision_models: Iterable[str] = (),
+                 capabilities: Optional[Iterable[str]] = None,
+                 models: Optional[Dict[str, ModelInfo]] = None):
+        """
+        Parameters:
+        -----------
+        text_models, vision_models : list
+            按優先順序排列的文本和視覺模型
+        capabilities : iterable, optional
+            覆蓋類別預設的能力
+        models : dict, optional
+            覆蓋 MODEL_CATALOG 中的模型元數據
+        """
+        self.text_models = list(text_models)
+        self.vision_models = list(vision_models)
+        if capabilities is not None:
+            self.capabilities = frozenset(capabilities)
+        self.models: Dict[str, ModelInfo] = {}
+        for name in dict.fromkeys(self.text_models + self.vision_models):
+            self.models[name] = (models or {}).get(name) or MODEL_CATALOG.get(name) or ModelInfo(name)
+
+    def supports(self, capability: str) -> bool:
+        return capability in self.capabilities
+
+    def available(self, pool: ClientPool) -> bool:
+        """依賴已安裝（或已注入假客戶端）"""
+        raise NotImplementedError
+
+    def configured(self) -> bool:
+        """環境中是否配置了此服務"""
+        return bool(self.key_env and os.getenv(self.key_env))
+
+    def prepare(self, advisor):
+        """顧問創建時預先建立客戶端（可選）"""
+
+    def api_key(self, advisor) -> Optional[str]:
+        return advisor.api_key
+
+    def models_for(self, request: CompletionRequest) -> List[str]:
+        """請求使用的模型（按優先順序）"""
+        return request.models or (self.vision_models if request.vision else self.text_models)
+
+    def model_key(self, vision: bool = False) -> str:
+        """模型標識（用於緩存鍵和對沖統計）"""
+        return ",".join(self.vision_models if vision else self.text_models)
+
+    def alternate_models(self) -> Optional[List[str]]:
+        """同一服務內的備用模型順序（從下一個模型開始）；只有一個文本模型時為 None"""
+        if len(self.text_models) < 2:
+            return None
+        return self.text_models[1:] + self.text_models[:1]
+
+    def json_mode(self, model: str) -> bool:
+        """模型是否可以使用原生 JSON 輸出模式"""
+        info = self.models.get(model)
+        return self.supports(JSON_MODE) and info is not None and info.json_mode
+
+    def complete(self, advisor, request: CompletionRequest) -> str:
+        """生成並返回完整的回應文本"""
+        raise NotImplementedError
+
+    def stream(self, advisor, request: CompletionRequest) -> Iterator[str]:
+        """流式生成，逐段返回回應文本"""
+        raise NotImplementedError
+
+    async def complete_async(self, advisor, request: CompletionRequest) -> str:
+        """complete 的異步版本（advisor 為 AsyncAIChefAdvisor）"""
+        raise NotImplementedError
+
+    def describe(self, router: Optional[ModelRouter] = None) -> Dict:
+        """能力和模型元數據；提供路由器時附上實測的延遲和健康狀況"""
+        health = router.snapshot() if router is not None else {}
+        return {
+            "label": self.label,
+            "capabilities": sorted(self.capabilities),
+            "text_models": list(self.text_models),
+            "vision_models": list(self.vision_models),
+            "models": {
+                name: dict(info.to_dict(), observed=health.get(name))
+                for name, info in self.models.items()
+            },
+        }
+
+
+# ==================== OpenAI ====================
+
+class OpenAIBackend(Backend):
+    """OpenAI Chat Completions 接口（base_url 指向其他地址時也可用於 OpenAI 兼容服務）"""
+
+    name = "openai"
+    label = "OpenAI"
+    key_env = "OPENAI_API_KEY"
+    capabilities = frozenset({TEXT, VISION, STREAMING, JSON_MODE})
+    # 發送 prompt_cache_key，讓同一模板的請求路由到持有其前綴緩存的服務器
+    prompt_cache_routing = True
+    # 流式請求附帶 stream_options.include_usage：最後一個片段帶有 usage（其 choices 為空）
+    stream_usage = True
+
+    def __init__(self,
+                 text_model: str = OPENAI_TEXT_MODEL,
+                 vision_model: Optional[str] = OPENAI_VISION_MODEL,
+                 base_url: Optional[str] = None,
+                 capabilities: Optional[Iterable[str]] = None,
+                 models: Optional[Dict[str, ModelInfo]] = None):
+        super().__init__([text_model], [vision_model] if vision_model else [], capabilities, models)
+        self.base_url = base_url
+
+    def available(self, pool: ClientPool) -> bool:
+        return pool.available("openai")
+
+    def prepare(self, advisor):
+        self._client(advisor)
+
+    def _client(self, advisor):
+        return advisor.pool.openai_client(self.api_key(advisor), base_url=self.base_url)
+
+    def build_request(self, request: CompletionRequest) -> Dict:
+        """組裝 chat.completions.create 的參數"""
+        model = self.models_for(request)[0]
+        if request.vision:
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": request.prompt},
+                        {"type": "image_url", "image_url": {"url": to_data_url(*request.image)}}
+                    ]
+                }
+            ]
+        elif request.memory is not None:
+            messages = request.memory.build_messages(request.system)
+        else:
+            messages = [
+                {"role": "system", "content": request.system},
+                {"role": "user", "content": request.prompt}
+            ]
+
+        body = {"model": model, "messages": messages}
+        if request.temperature is not None:
+            body["temperature"] = request.temperature
+        if request.max_tokens:
+            body["max_tokens"] = request.max_tokens
+        if request.json_mode and self.json_mode(model):
+            body["response_format"] = {"type": "json_object"}
+        if request.cache_key and self.prompt_cache_routing and PROMPT_CACHE_ENABLED:
+            body["extra_body"] = {"prompt_cache_key": request.cache_key}
+        return body
+
+    def _flight_key(self, advisor, body: Dict) -> str:
+        return flight_key(self.name, self.api_key(advisor), self.base_url, body)
+
+    def complete(self, advisor, request: CompletionRequest) -> str:
+        """
+        調用接口並返回回應文本；同時進行的相同請求只發出一次
+
+        請求在速率限制內排隊，429 和 5xx 按 Retry-After 或指數退避重試。
+        """
+        body = self.build_request(request)
+        limiter = advisor.rate_limiter
+        model = body["model"]
+        tokens = estimate_request_tokens(body["messages"], body.get("max_tokens"))
+
+        def complete():
+            response = self._create(advisor, body)
+            self._record_usage(limiter, model, tokens, response)
+            return response.choices[0].message.content
+
+        note(model=model)
+        return advisor.flights.do(
+            self._flight_key(advisor, body),
+            lambda: limiter.call(self.name, model, tokens, complete)
+        )
+
+    def _create(self, advisor, body: Dict):
+        """發出請求，並用響應頭中的 x-ratelimit-* 校正限速器"""
+        completions = self._client(advisor).chat.completions
+        raw_api = getattr(completions, "with_raw_response", None)
+        if raw_api is None:
+            return completions.create(**body)
+        raw = raw_api.create(**body)
+        advisor.rate_limiter.update_from_headers(self.name, body["model"], raw.headers)
+        return raw.parse()
+
+    def _record_usage(self, limiter, model: str, estimated: int, response):
+        """用回應中的 usage 校正 TPM 令牌桶並記錄到調用指標"""
+        usage = getattr(response, "usage", None)
+        limiter.record_usage(self.name, model, estimated, getattr(usage, "total_tokens", None))
+        note_usage(
+            getattr(response, "model", None) or model,
+            getattr(usage, "prompt_tokens", None),
+            getattr(usage, "completion_tokens", None),
+            getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+        )
+
+    def stream(self, advisor, request: CompletionRequest) -> Iterator[str]:
+        """流式生成；同時進行的相同請求共享一個上游流"""
+        body = dict(self.build_request(request), stream=True)
+        if self.stream_usage:
+            body["stream_options"] = {"include_usage": True}
+        limiter = advisor.rate_limiter
+        model = body["model"]
+        tokens = estimate_request_tokens(body["messages"], body.get("max_tokens"))
+        note(model=model)
+
+        def deltas():
+            # 429 在建立流時拋出，此時還沒有輸出任何內容，可以安全重試
+            stream = limiter.call(self.name, model, tokens, lambda: self._create(advisor, body))
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    self._record_usage(limiter, model, tokens, chunk)
+
+        return advisor.flights.stream(self._flight_key(advisor, body), deltas)
+
+    async def complete_async(self, advisor, request: CompletionRequest) -> str:
+        """
+        使用 AsyncOpenAI 調用接口；同時進行的相同請求只發出一次
+
+        先在速率限制內排隊再佔用並發名額，排隊中的請求不會擋住其他請求。
+        """
+        shared = advisor._advisor
+        client = shared.pool.async_openai_client(self.api_key(shared), base_url=self.base_url)
+        limiter = shared.rate_limiter
+        body = self.build_request(request)
+        model = body["model"]
+        tokens = estimate_request_tokens(body["messages"], body.get("max_tokens"))
+
+        async def complete():
+            completions = client.chat.completions
+            raw_api = getattr(completions, "with_raw_response", None)
+            if raw_api is None:
+                response = await advisor._bounded(partial(completions.create, **body))
+            else:
+                raw = await advisor._bounded(partial(raw_api.create, **body))
+                limiter.update_from_headers(self.name, model, raw.headers)
+                response = raw.parse()
+            self._record_usage(limiter, model, tokens, response)
+            return response.choices[0].message.content
+
+        note(model=model)
+        return await advisor.flights.do(
+            self._flight_key(shared, body),
+            partial(limiter.call_async, self.name, model, tokens, complete)
+        )
+
+
+class LocalServerBackend(OpenAIBackend):
+    """
+    本地的 OpenAI 兼容服務（如 llama.cpp server）
+
+    沒有網路往返、配額和費用，但模型較小；預設不接受圖片輸入。
+    """
+
+    name = "local_server"
+    label = "本地模型服務"
+    key_env = "AI_CHEF_LOCAL_SERVER_KEY"
+    capabilities = frozenset({TEXT, STREAMING, JSON_MODE})
+    # 本地服務自己復用上一次請求的前綴，不認識 prompt_cache_key
+    prompt_cache_routing = False
+    # 不是所有兼容服務都接受 stream_options；本地模型沒有配額和費用，流式用量不影響限速
+    stream_usage = False
+
+    def __init__(self,
+                 base_url: Optional[str] = None,
+                 model: str = DEFAULT_LOCAL_SERVER_MODEL,
+                 vision_model: Optional[str] = None,
+                 api_key: Optional[str] = None):
+        """
+        Parameters:
+        -----------
+        base_url : str, optional
+            服務地址，預設讀取 AI_CHEF_LOCAL_SERVER_URL（未設置時為 http://localhost:8080/v1）
+        model : str
+            服務加載的模型名稱
+        vision_model : str, optional
+            支持圖片輸入的模型（如加載了 mmproj 的多模態模型）
+        api_key : str, optional
+            服務要求的金鑰，預設讀取 AI_CHEF_LOCAL_SERVER_KEY
+        """
+        models = {name: ModelInfo(name, vision=name == vision_model, json_mode=True, prices=(0.0, 0.0))
+                  for name in filter(None, [model, vision_model])}
+        capabilities = self.capabilities | {VISION} if vision_model else None
+        super().__init__(
+            text_model=model,
+            vision_model=vision_model,
+            base_url=base_url or DEFAULT_LOCAL_SERVER_URL or LOCAL_SERVER_FALLBACK_URL,
+            capabilities=capabilities,
+            models=models,
+        )
+        self._explicit_url = bool(base_url or DEFAULT_LOCAL_SERVER_URL)
+        self._api_key = api_key
+
+    def configured(self) -> bool:
+        return self._explicit_url
+
+    def api_key(self, advisor) -> Optional[str]:
+        # 不把雲端服務的金鑰發給本地服務；SDK 要求金鑰非空，服務通常不驗證
+        return self._api_key or os.getenv(self.key_env) or "not-needed"
+
+
+# ==================== Gemini ====================
+
+class GeminiBackend(Backend):
+    """Google Gemini；按路由器給出的順序嘗試多個模型"""
+
+    name = "gemini"
+    label = "Gemini"
+    key_env = "GEMINI_API_KEY"
+    capabilities = frozenset({TEXT, VISION, STREAMING, JSON_MODE})
+
+    def __init__(self,
+                 text_models: Iterable[str] = GEMINI_TEXT_MODELS,
+                 vision_models: Iterable[str] = GEMINI_VISION_MODELS,
+                 models: Optional[Dict[str, ModelInfo]] = None):
+        super().__init__(text_models, vision_models, models=models)
+
+    def available(self, pool: ClientPool) -> bool:
+        return pool.available("gemini")
+
+    def prepare(self, advisor):
+        advisor.pool.configure_gemini(advisor.api_key)
+
+    @staticmethod
+    def contents(request: CompletionRequest):
+        """組裝 generate_content 的內容"""
+        if request.vision:
+            return [request.prompt, to_gemini_part(*request.image)]
+        if request.memory is not None:
+            return request.memory.gemini_contents(request.system)
+        # 固定前綴作為第一部分發送（部分舊模型不支持 system_instruction），相同前綴可以命中隱式緩存
+        if request.system:
+            return [request.system, request.prompt]
+        return request.prompt
+
+    def _model(self, pool: ClientPool, api_key: Optional[str], model_name: str, request: CompletionRequest):
+        """
+        模型句柄和本次要發送的內容
+
+        單輪請求的固定前綴足夠長並開啟了上下文緩存時，前綴以 CachedContent 保存在服務端，
+        每次只發送可變部分；否則前綴和可變部分一起發送。
+        """
+        options = self._options(model_name, request.json_mode)
+        if self._context_cached(request):
+            model = pool.gemini_cached_model(api_key, model_name, request.system, GEMINI_CACHE_TTL, **options)
+            if model is not None:
+                return model, request.prompt
+        return pool.gemini_model(api_key, model_name, **options), self.contents(request)
+
+    @staticmethod
+    def _context_cached(request: CompletionRequest) -> bool:
+        """請求的固定前綴是否使用 CachedContent（模板的 token 數在導入時已計算）"""
+        template = TEMPLATES.get(request.cache_key) if request.cache_key else None
+        return (template is not None and request.memory is None and not request.vision
+                and gemini_context_cacheable(template.prefix_tokens))
+
+    def _options(self, model_name: str, json_mode: bool) -> Dict:
+        """模型句柄的參數；支持的模型直接輸出 JSON，無需再從文本中提取"""
+        if json_mode and self.json_mode(model_name):
+            return {"generation_config": {"response_mime_type": "application/json"}}
+        return {}
+
+    @staticmethod
+    def _require_key(advisor):
+        if not advisor.api_key:
+            raise BackendError(
+                "未設置 GEMINI_API_KEY\n\n請在 .env 文件中添加：\nGEMINI_API_KEY=your_api_key_here"
+                "\n\n獲取 API Key: https://ai.google.dev"
+            )
+
+    @staticmethod
+    def _unavailable(request: CompletionRequest) -> BackendError:
+        if request.vision:
+            return BackendError("所有 Gemini Vision 模型都不可用")
+        return BackendError("所有 Gemini 模型都不可用\n請檢查：\n1. API Key 是否正確\n2. 網路連接\n3. 服務狀態")
+
+    def complete(self, advisor, request: CompletionRequest) -> str:
+        """按路由器給出的順序調用模型；同時進行的相同請求只發出一次"""
+        self._require_key(advisor)
+        candidates = self.models_for(request)
+        contents = self.contents(request)
+        model_name, content = advisor.flights.do(
+            flight_key(self.name, advisor.api_key, candidates, contents, request.json_mode),
+            lambda: self._call(advisor, candidates, request)
+        )
+        if content is None:
+            raise self._unavailable(request)
+        note(model=model_name)
+        return content
+
+    def _call(self, advisor, candidates: List[str], request: CompletionRequest) -> Tuple[Optional[str], Optional[str]]:
+        tokens = estimate_request_tokens(self.contents(request))
+        for model_name in advisor.router.plan(candidates):
+            try:
+                model, contents = self._model(advisor.pool, advisor.api_key, model_name, request)
+
+                def attempt(model=model, contents=contents):
+                    # 只計上游耗時，排隊和退避等待不算入模型延遲
+                    started = time.perf_counter()
+                    return model.generate_content(contents), time.perf_counter() - started
+
+                # 429 先在同一模型上退避重試，重試用盡才換下一個模型
+                response, latency = advisor.rate_limiter.call(self.name, model_name, tokens, attempt)
+                content = response.text
+            except Exception as model_error:
+                # 記錄錯誤類型並嘗試下一個模型
+                advisor.router.record_failure(model_name, model_error)
+                note_fallback()
+                continue
+
+            self._record_usage(advisor.rate_limiter, model_name, tokens, response)
+            advisor.router.record_success(model_name, latency)
+            return model_name, content
+
+        return None, None
+
+    def _record_usage(self, limiter, model_name: str, estimated: int, response):
+        """用回應的 usage_metadata 校正 TPM 令牌桶並記錄到調用指標"""
+        usage = getattr(response, "usage_metadata", None)
+        limiter.record_usage(self.name, model_name, estimated, getattr(usage, "total_token_count", None))
+        note_usage(
+            model_name,
+            getattr(usage, "prompt_token_count", None),
+            getattr(usage, "candidates_token_count", None),
+            getattr(usage, "cached_content_token_count", None)
+        )
+
+    def stream(self, advisor, request: CompletionRequest) -> Iterator[str]:
+        """
+        流式生成；同時進行的相同請求共享一個上游流
+
+        在收到第一個片段之前失敗時換下一個模型；輸出開始後失敗則直接拋出，
+        避免重複輸出已發送的內容。
+        """
+        self._require_key(advisor)
+        candidates = self.models_for(request)
+        contents = self.contents(request)
+        return advisor.flights.stream(
+            flight_key(self.name, advisor.api_key, candidates, contents, request.json_mode, "stream"),
+            lambda: self._stream_direct(advisor, candidates, request)
+        )
+
+    def _stream_direct(self, advisor, candidates: List[str], request: CompletionRequest) -> Iterator[str]:
+        tokens = estimate_request_tokens(self.contents(request))
+        limiter = advisor.rate_limiter
+        for model_name in advisor.router.plan(candidates):
+            for attempt in range(limiter.max_retries + 1):
+                limiter.acquire(self.name, model_name, tokens)
+                started = time.perf_counter()
+                emitted = False
+                chunk = None
+                try:
+                    model, contents = self._model(advisor.pool, advisor.api_key, model_name, request)
+                    for chunk in model.generate_content(contents, stream=True):
+                        text = chunk.text
+                        if text:
+                            emitted = True
+                            yield text
+                except Exception as model_error:
+                    retryable = classify_error(model_error) in RETRYABLE_ERRORS
+                    if not emitted and retryable and attempt < limiter.max_retries:
+                        # 還沒有輸出時在同一模型上退避重試
+                        time.sleep(limiter.backoff(self.name, model_name, model_error, attempt))
+                        continue
+                    advisor.router.record_failure(model_name, model_error)
+                    if emitted:
+                        raise
+                    note_fallback()
+                    break
+
+                # 流式回應的 usage_metadata 在最後一個片段上
+                self._record_usage(limiter, model_name, tokens, chunk)
+                advisor.router.record_success(model_name, time.perf_counter() - started)
+                note(model=model_name)
+                return
+
+        raise BackendError("所有 Gemini 模型都不可用，請檢查 API Key 和網路連接")
+
+    async def complete_async(self, advisor, request: CompletionRequest) -> str:
+        """按路由器給出的順序異步調用模型；相同請求會合併"""
+        shared = advisor._advisor
+        self._require_key(shared)
+        candidates = self.models_for(request)
+        contents = self.contents(request)
+        model_name, content = await advisor.flights.do(
+            flight_key(self.name, shared.api_key, candidates, contents, request.json_mode),
+            partial(self._call_async, advisor, candidates, request)
+        )
+        if content is None:
+            raise self._unavailable(request)
+        note(model=model_name)
+        return content
+
+    async def _call_async(self, advisor, candidates: List[str], request: CompletionRequest):
+        shared = advisor._advisor
+        router = shared.router
+        limiter = shared.rate_limiter
+        tokens = estimate_request_tokens(self.contents(request))
+        for model_name in router.plan(candidates):
+            try:
+                if self._context_cached(request):
+                    # 創建上下文緩存是一次網路請求，放到線程中
+                    model, contents = await asyncio.to_thread(
+                        self._model, shared.pool, shared.api_key, model_name, request
+                    )
+                else:
+                    model, contents = self._model(shared.pool, shared.api_key, model_name, request)
+
+                async def attempt(model=model, contents=contents):
+                    started = time.perf_counter()
+                    response = await advisor._bounded(partial(model.generate_content_async, contents))
+                    return response, time.perf_counter() - started
+
+                response, latency = await limiter.call_async(self.name, model_name, tokens, attempt)
+                content = response.text
+            except asyncio.CancelledError:
+                # 被取消的請求不反映模型健康狀況
+                router.release(model_name)
+                raise
+            except Exception as model_error:
+                router.record_failure(model_name, model_error)
+                note_fallback()
+                continue
+
+            self._record_usage(limiter, model_name, tokens, response)
+            router.record_success(model_name, latency)
+            return model_name, content
+
+        return None, None
+
+
+# ==================== 本地模型 ====================
+
+class LlamaCppBackend(Backend):
+    """
+    進程內的本地量化模型（llama.cpp，GGUF 格式）
+
+    模型文件以 mmap 方式映射，啟動時不讀入整個文件；推理在 CPU 線程上進行。
+    llama.cpp 上下文不是線程安全的，同一模型的調用串行執行。提示詞 KV 緩存
+    按最長前綴命中，共用系統提示詞（和之前對話輪次）的請求只需計算新增部分。
+    沒有網路往返、配額和費用，質量較低，作為雲端服務不可用時的降級回退。
+    """
+
+    name = "llama_cpp"
+    label = "本地模型"
+    capabilities = frozenset({TEXT, STREAMING, JSON_MODE})
+
+    def __init__(self,
+                 model_path: Optional[str] = None,
+                 n_threads: int = DEFAULT_LOCAL_MODEL_THREADS,
+                 n_ctx: int = DEFAULT_LOCAL_MODEL_CTX,
+                 cache_mb: int = DEFAULT_LOCAL_MODEL_CACHE_MB):
+        """
+        Parameters:
+        -----------
+        model_path : str, optional
+            GGUF 模型文件路徑，預設讀取 AI_CHEF_LOCAL_MODEL_PATH
+        n_threads : int
+            推理使用的 CPU 線程數，預設讀取 AI_CHEF_LOCAL_MODEL_THREADS（未設置時為 CPU 核數）
+        n_ctx : int
+            上下文長度（token）
+        cache_mb : int
+            提示詞 KV 緩存的容量（MB），0 表示只復用上一次請求的前綴
+        """
+        self.model_path = model_path or DEFAULT_LOCAL_MODEL_PATH
+        model = os.path.basename(self.model_path) or "local-gguf"
+        super().__init__([model], models={model: ModelInfo(model, json_mode=True, prices=(0.0, 0.0))})
+        self.cache_bytes = cache_mb * 1024 * 1024
+        self.load_options = {"n_ctx": n_ctx, "n_threads": n_threads, "use_mmap": True, "verbose": False}
+        self._lock = threading.Lock()
+
+    def available(self, pool: ClientPool) -> bool:
+        return pool.available("llama_cpp")
+
+    def configured(self) -> bool:
+        return bool(self.model_path) and os.path.isfile(self.model_path)
+
+    def prepare(self, advisor):
+        # mmap 加載只建立映射，代價很小；模型文件不存在時留到請求時報錯
+        if self.configured():
+            self._model(advisor)
+
+    def _model(self, advisor):
+        if not self.configured():
+            raise BackendError("未找到本地模型文件，請設置 AI_CHEF_LOCAL_MODEL_PATH")
+        return advisor.pool.llama_model(self.model_path, cache_bytes=self.cache_bytes, **self.load_options)
+
+    def build_request(self, request: CompletionRequest, stream: bool = False) -> Dict:
+        """組裝 create_chat_completion 的參數"""
+        if request.vision:
+            raise BackendError("本地模型不支持圖片識別")
+        if request.memory is not None:
+            messages = request.memory.build_messages(request.system)
+        else:
+            messages = [
+                {"role": "system", "content": request.system},
+                {"role": "user", "content": request.prompt}
+            ]
+
+        body = {"messages": messages, "stream": stream}
+        if request.temperature is not None:
+            body["temperature"] = request.temperature
+        if request.max_tokens:
+            body["max_tokens"] = request.max_tokens
+        if request.json_mode and self.json_mode(self.text_models[0]):
+            # llama.cpp 用語法約束採樣保證輸出是合法 JSON
+            body["response_format"] = {"type": "json_object"}
+        return body
+
+    def complete(self, advisor, request: CompletionRequest) -> str:
+        """在本地模型上生成；同時進行的相同請求只計算一次"""
+        body = self.build_request(request)
+        model_name = self.text_models[0]
+
+        def complete():
+            model = self._model(advisor)
+            with self._lock:
+                started = time.perf_counter()
+                try:
+                    response = model.create_chat_completion(**body)
+                except Exception as e:
+                    advisor.router.record_failure(model_name, e)
+                    raise
+                advisor.router.record_success(model_name, time.perf_counter() - started)
+            usage = response.get("usage") or {}
+            note_usage(model_name, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+            return response["choices"][0]["message"]["content"]
+
+        note(model=model_name)
+        return advisor.flights.do(flight_key(self.name, self.model_path, body), complete)
+
+    def stream(self, advisor, request: CompletionRequest) -> Iterator[str]:
+        """流式生成；生成期間佔用模型，其他請求排隊"""
+        body = self.build_request(request, stream=True)
+        note(model=self.text_models[0])
+
+        def deltas():
+            model = self._model(advisor)
+            with self._lock:
+                for chunk in model.create_chat_completion(**body):
+                    content = chunk["choices"][0]["delta"].get("content")
+                    if content:
+                        yield content
+
+        return advisor.flights.stream(flight_key(self.name, self.model_path, body), deltas)
+
+    async def complete_async(self, advisor, request: CompletionRequest) -> str:
+        """在線程中執行 complete，推理期間不阻塞事件循環"""
+        return await advisor._bounded(partial(asyncio.to_thread, self.complete, advisor._advisor, request))
+
+
+# ==================== 註冊表 ====================
+
+class BackendRegistry:
+    """按服務名稱登記的後端；自動選擇服務時按登記順序優先"""
+
+    def __init__(self, backends: Optional[Iterable[Backend]] = None):
+        self._backends: Dict[str, Backend] = {}
+        self._lock = threading.Lock()
+        for backend in backends or []:
+            self.register(backend)
+
+    def register(self, backend: Backend):
+        """登記後端（同名的舊後端被替換）"""
+        with self._lock:
+            self._backends[backend.name] = backend
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._backends.pop(name, None)
+
+    def get(self, name: str) -> Optional[Backend]:
+        return self._backends.get(name)
+
+    def backends(self) -> List[Backend]:
+        with self._lock:
+            return list(self._backends.values())
+
+    def resolve(self, service: str, pool: ClientPool) -> Optional[Backend]:
+        """服務對應的可用後端；未登記或依賴未安裝時為 None（由顧問使用本地回退）"""
+        backend = self._backends.get(service)
+        if backend is None or not backend.available(pool):
+            return None
+        return backend
+
+    def detect(self, pool: ClientPool) -> str:
+        """自動選擇服務：第一個已配置且可用的後端，都沒有時為 "local" """
+        for backend in self.backends():
+            if backend.configured() and backend.available(pool):
+                return backend.name
+        return "local"
+
+    def describe(self, router: Optional[ModelRouter] = None) -> Dict[str, Dict]:
+        """各後端的能力和模型元數據"""
+        return {backend.name: backend.describe(router) for backend in self.backends()}
+
+
+def default_backends() -> List[Backend]:
+    """預設登記的後端"""
+    return [OpenAIBackend(), GeminiBackend(), LocalServerBackend(), LlamaCppBackend()]
+
+
+# ==================== 進程級共享實例 ====================
+
+_default_registry: Optional[BackendRegistry] = None
+_default_registry_lock = threading.Lock()
+
+
+def get_backend_registry() -> BackendRegistry:
+    """獲取進程內共享的後端註冊表"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = BackendRegistry(default_backends())
+        return _default_registry
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 廚師顧問 - 批量處理模組
+AI Chef Advisor - Batch Processing Module
+
+批量預生成菜譜、批量識別菜品圖片：按可配置的並行度和各服務的速率限制執行，
+結果逐條寫入 JSONL，重跑時自動跳過已完成的條目
+
+用法:
+    python ai_chef_batch.py recipes dishes.csv -o recipes.jsonl --parallelism 8
+    python ai_chef_batch.py images photos/ -o dishes.jsonl --workers 4 --parallelism 8
+"""
+
+import os
+import csv
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ai_chef_cache import make_cache_key
+from ai_chef_parsing import is_complete_result
+from ai_chef_images import prepare_image_bytes
+from ai_chef_vision import IMAGE_EXTENSIONS, load_thumbnail
+from ai_chef_phash import phash
+from ai_chef_ingredients import split_ingredient_text, normalize_ingredients
+from ai_chef_backends import get_backend_registry
+
+
+# 菜品清單欄位的別名
+SPEC_FIELDS = {
+    "dish_name": ["dish_name", "菜名", "name"],
+    "difficulty": ["difficulty", "難度"],
+    "servings": ["servings", "份量"],
+    "available_ingredients": ["available_ingredients", "ingredients", "可用食材"],
+    "cooking_time_limit": ["cooking_time_limit", "cooking_time", "烹飪時間"],
+}
+
+
+# ==================== 讀取菜品清單 ====================
+
+def _normalize_spec(raw: Dict) -> Dict:
+    """把 CSV/JSONL 行轉換為 generate_recipe 的參數"""
+    spec = {}
+    for field, aliases in SPEC_FIELDS.items():
+        for alias in aliases:
+            value = raw.get(alias)
+            if value not in (None, ""):
+                spec[field] = value
+                break
+
+    if "servings" in spec:
+        spec["servings"] = int(spec["servings"])
+    if "cooking_time_limit" in spec:
+        spec["cooking_time_limit"] = int(spec["cooking_time_limit"])
+    ingredients = spec.get("available_ingredients")
+    if isinstance(ingredients, str):
+        spec["available_ingredients"] = split_ingredient_text(ingredients)
+
+    # 食材保留用戶的寫法傳給模型；默認 id 按規整後的食材計算，等價寫法得到同一 id
+    key_fields = dict(spec)
+    if key_fields.get("available_ingredients"):
+        key_fields["available_ingredients"] = normalize_ingredients(key_fields["available_ingredients"])
+    spec["id"] = str(raw.get("id") or make_cache_key("batch", "", "", **key_fields)[:16])
+    return spec
+
+
+def load_dish_specs(path: str) -> List[Dict]:
+    """
+    讀取菜品清單
+
+    Parameters:
+    -----------
+    path : str
+        .csv 或 .jsonl 文件；至少包含 dish_name（或 菜名）欄位
+
+    Returns:
+    --------
+    list
+        菜品規格，每項含 id 和 generate_recipe 的參數
+    """
+    specs = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if Path(path).suffix.lower() == ".csv":
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            spec = _normalize_spec(row)
+            if spec.get("dish_name"):
+                specs.append(spec)
+    return specs
+
+
+def load_image_paths(source: str) -> List[str]:
+    """
+    讀取待識別的圖片路徑
+
+    Parameters:
+    -----------
+    source : str
+        圖片目錄（遞歸查找圖片文件），或每行一個路徑的清單文件
+
+    Returns:
+    --------
+    list
+        圖片路徑
+    """
+    root = Path(source)
+    if root.is_dir():
+        return sorted(str(p) for p in root.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    with open(source, encoding="utf-8-sig") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_completed_ids(output_path: str) -> set:
+    """從已有的輸出文件中讀取成功完成的條目 id（斷點續跑）"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 上次中斷時可能留下半行
+                continue
+            if record.get("ok"):
+                completed.add(record.get("id"))
+    return completed
+
+
+# ==================== 統計 ====================
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _build_report(kind: str, service: str, total: int, skipped: int,
+                  latencies: List[float], failures: int, errors: Dict[str, int],
+                  elapsed: float, parallelism: int) -> Dict:
+    processed = len(latencies)
+    return {
+        "kind": kind,
+        "service": service,
+        "total": total,
+        "skipped": skipped,
+        "processed": processed,
+        "succeeded": processed - failures,
+        "failed": failures,
+        "error_rate": failures / processed if processed else 0.0,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_minute": round(processed / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "latency_p50": _percentile(latencies, 0.50),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_max": max(latencies) if latencies else None,
+        "parallelism": parallelism,
+        "errors": errors,
+    }
+
+
+# ==================== 批量生成菜譜 ====================
+
+async def generate_recipes_batch_async(specs: List[Dict],
+                                       output_path: str,
+                                       advisor=None,
+                                       service: str = "auto",
+                                       parallelism: int = 4,
+                                       requests_per_minute: Optional[float] = None,
+                                       report_path: Optional[str] = None,
+                                       resume: bool = True) -> Dict:
+    """
+    批量生成菜譜（異步版本）
+
+    Parameters:
+    -----------
+    specs : list
+        菜品規格（見 load_dish_specs）
+    output_path : str
+        JSONL 輸出文件；每完成一條即追加寫入，兼作斷點記錄
+    advisor : AsyncAIChefAdvisor, optional
+        異步顧問實例，預設按 service 新建
+    service : str
+        服務選擇: "auto", "openai", "gemini", "local_server", "llama_cpp", "local"
+    parallelism : int
+        同時進行的請求數
+    requests_per_minute : float, optional
+        該服務所有模型合計的每分鐘請求數上限，預設只受各模型自身的限額約束
+    report_path : str, optional
+        吞吐量和錯誤率報告的輸出路徑，預設為 <output>.report.json
+    resume : bool
+        是否跳過輸出文件中已成功的條目
+
+    Returns:
+    --------
+    dict
+        運行報告
+    """
+    from ai_chef_async import init_async_ai_chef
+
+    if advisor is None:
+        advisor = init_async_ai_chef(service=service, max_concurrency=parallelism)
+    active_service = advisor._advisor._active_service()
+    # 限速和 429 重試由顧問的 RateLimiter 負責，這裡只設置服務級上限
+    limiter = advisor._advisor.rate_limiter
+    if requests_per_minute is not None:
+        limiter.configure(active_service, rpm=requests_per_minute)
+
+    completed = load_completed_ids(output_path) if resume else set()
+    pending = [spec for spec in specs if spec["id"] not in completed]
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    failures = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for spec in pending:
+        queue.put_nowait(spec)
+
+    started = time.perf_counter()
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+
+        async def worker():
+            nonlocal failures
+            while True:
+                try:
+                    spec = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                params = {k: v for k, v in spec.items() if k != "id"}
+
+                call_started = time.perf_counter()
+                try:
+                    recipe = await advisor.generate_recipe(**params)
+                except Exception as e:
+                    recipe = {"error": f"{type(e).__name__}: {str(e)}"}
+                latency = time.perf_counter() - call_started
+
+                ok = is_complete_result(recipe)
+                record = {"id": spec["id"], "spec": params, "ok": ok,
+                          "latency": round(latency, 3), "recipe": recipe}
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+
+                latencies.append(latency)
+                if not ok:
+                    failures += 1
+                    if "raw_response" in recipe:
+                        kind = "parse_error"
+                    elif "schema_errors" in recipe:
+                        kind = "schema_error"
+                    else:
+                        kind = str(recipe["error"])[:80]
+                    errors[kind] = errors.get(kind, 0) + 1
+
+        await asyncio.gather(*[worker() for _ in range(max(1, parallelism))])
+
+    report = _build_report(
+        "recipes", active_service, len(specs), len(specs) - len(pending),
+        latencies, failures, errors, time.perf_counter() - started, parallelism
+    )
+    report["requests_per_minute"] = requests_per_minute
+    report["rate_limits"] = limiter.stats()
+
+    report_path = report_path or f"{output_path}.report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return report
+
+
+def generate_recipes_batch(specs: List[Dict], output_path: str, **options) -> Dict:
+    """
+    批量生成菜譜
+
+    同步入口，參數見 generate_recipes_batch_async。
+    """
+    return asyncio.run(generate_recipes_batch_async(specs, output_path, **options))
+
+
+# ==================== 批量識別圖片 ====================
+
+def _preprocess_image(image_path: str, vision: bool) -> Dict:
+    """
+    在工作進程中解碼、縮放和編碼圖片
+
+    支持圖片輸入的後端需要上傳用的 JPEG 字節和用於去重的感知雜湊；
+    只支持文本的後端（local_server、llama_cpp）和本地識別只需要縮略圖。
+    """
+    thumbnail = load_thumbnail(image_path)
+    if not vision:
+        return {"thumbnail": thumbnail}
+    data, media_type = prepare_image_bytes(image_path)
+    return {"data": data, "media_type": media_type, "phash": phash(thumbnail)}
+
+
+async def identify_dishes_batch_async(image_paths: List[str],
+                                      output_path: str,
+                                      advisor=None,
+                                      service: str = "auto",
+                                      parallelism: int = 4,
+                                      workers: Optional[int] = None,
+                                      requests_per_minute: Optional[float] = None,
+                                      report_path: Optional[str] = None,
+                                      resume: bool = True) -> Dict:
+    """
+    批量識別菜品圖片（異步版本）
+
+    圖片的解碼、縮放和編碼在進程池中進行，上傳由有界的異步工作協程完成；
+    兩個階段之間用有界隊列連接，CPU 工作和網絡等待互相重疊。
+
+    Parameters:
+    -----------
+    image_paths : list
+        圖片路徑（見 load_image_paths）；路徑同時作為斷點記錄的 id
+    output_path : str
+        JSONL 輸出文件；每完成一張即追加寫入
+    advisor : AsyncAIChefAdvisor, optional
+        異步顧問實例，預設按 service 新建
+    service : str
+        服務選擇: "auto", "openai", "gemini", "local_server", "llama_cpp", "local"
+    parallelism : int
+        同時進行的上傳請求數
+    workers : int, optional
+        預處理進程數，預設為 CPU 核心數
+    requests_per_minute : float, optional
+        該服務所有模型合計的每分鐘請求數上限，預設只受各模型自身的限額約束
+    report_path : str, optional
+        報告輸出路徑，預設為 <output>.report.json
+    resume : bool
+        是否跳過輸出文件中已成功的條目
+
+    Returns:
+    --------
+    dict
+        運行報告
+    """
+    from ai_chef_async import init_async_ai_chef
+
+    if advisor is None:
+        advisor = init_async_ai_chef(service=service, max_concurrency=parallelism)
+    active_service = advisor._advisor._active_service()
+    # 與 identify_prepared_image 按同一條件決定上傳圖片還是只做縮略圖（本地特徵識別）
+    vision = advisor._advisor._vision_backend() is not None
+    # 限速和 429 重試由顧問的 RateLimiter 負責，這裡只設置服務級上限
+    limiter = advisor._advisor.rate_limiter
+    if requests_per_minute is not None:
+        limiter.configure(active_service, rpm=requests_per_minute)
+
+    completed = load_completed_ids(output_path) if resume else set()
+    pending = [path for path in image_paths if path not in completed]
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    failures = 0
+    upload_workers = max(1, parallelism)
+    workers = workers or os.cpu_count() or 1
+
+    paths: asyncio.Queue = asyncio.Queue()
+    for path in pending:
+        paths.put_nowait(path)
+    # 預處理結果的緩衝區有界，避免預處理遠快於上傳時把所有圖片堆在記憶體裡
+    prepared: asyncio.Queue = asyncio.Queue(maxsize=upload_workers * 2)
+
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+
+        async def preprocessor():
+            while True:
+                try:
+                    path = paths.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                stage_started = time.perf_counter()
+                try:
+                    item = await loop.run_in_executor(executor, _preprocess_image, path, vision)
+                except Exception as e:
+                    item = {"error": f"圖片預處理失敗: {type(e).__name__}: {str(e)}"}
+                await prepared.put((path, item, time.perf_counter() - stage_started))
+
+        async def uploader():
+            nonlocal failures
+            while True:
+                entry = await prepared.get()
+                if entry is None:
+                    return
+                path, item, preprocess_seconds = entry
+
+                call_started = time.perf_counter()
+                if "error" in item:
+                    result = item
+                else:
+                    call_started = time.perf_counter()
+                    try:
+                        result = await advisor.identify_prepared_image(item)
+                    except Exception as e:
+                        result = {"error": f"{type(e).__name__}: {str(e)}"}
+                latency = time.perf_counter() - call_started
+
+                ok = is_complete_result(result)
+                record = {"id": path, "ok": ok, "latency": round(latency, 3),
+                          "preprocess_seconds": round(preprocess_seconds, 3), "result": result}
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+
+                latencies.append(latency)
+                if not ok:
+                    failures += 1
+                    if "raw_response" in result:
+                        kind = "parse_error"
+                    elif "schema_errors" in result:
+                        kind = "schema_error"
+                    else:
+                        kind = str(result["error"])[:80]
+                    errors[kind] = errors.get(kind, 0) + 1
+
+        uploaders = [asyncio.create_task(uploader()) for _ in range(upload_workers)]
+        await asyncio.gather(*[preprocessor() for _ in range(workers)])
+        for _ in uploaders:
+            await prepared.put(None)
+        await asyncio.gather(*uploaders)
+
+    report = _build_report(
+        "images", active_service, len(image_paths), len(image_paths) - len(pending),
+        latencies, failures, errors, time.perf_counter() - started, parallelism
+    )
+    report["requests_per_minute"] = requests_per_minute
+    report["rate_limits"] = limiter.stats()
+    report["workers"] = workers
+
+    report_path = report_path or f"{output_path}.report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return report
+
+
+def identify_dishes_batch(image_paths: List[str], output_path: str, **options) -> Dict:
+    """
+    批量識別菜品圖片
+
+    同步入口，參數見 identify_dishes_batch_async。
+    """
+    return asyncio.run(identify_dishes_batch_async(image_paths, output_path, **options))
+
+
+# ==================== 命令行 ====================
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="AI Chef Assistant 批量處理工具")
+    services = ["auto"] + [backend.name for backend in get_backend_registry().backends()] + ["local"]
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    recipes = subparsers.add_parser("recipes", help="批量預生成菜譜")
+    recipes.add_argument("specs", help="菜品清單 (.csv 或 .jsonl)")
+    recipes.add_argument("-o", "--output", required=True, help="輸出的 JSONL 文件")
+    recipes.add_argument("--service", default="auto", choices=services)
+    recipes.add_argument("--parallelism", type=int, default=4, help="並行請求數")
+    recipes.add_argument("--rpm", type=float, default=None, help="每分鐘請求數上限")
+    recipes.add_argument("--report", default=None, help="報告輸出路徑")
+    recipes.add_argument("--no-resume", action="store_true", help="忽略已有輸出，從頭開始")
+
+    images = subparsers.add_parser("images", help="批量識別菜品圖片")
+    images.add_argument("source", help="圖片目錄，或每行一個路徑的清單文件")
+    images.add_argument("-o", "--output", required=True, help="輸出的 JSONL 文件")
+    images.add_argument("--service", default="auto", choices=services)
+    images.add_argument("--parallelism", type=int, default=4, help="並行上傳數")
+    images.add_argument("--workers", type=int, default=None, help="圖片預處理進程數")
+    images.add_argument("--rpm", type=float, default=None, help="每分鐘請求數上限")
+    images.add_argument("--report", default=None, help="報告輸出路徑")
+    images.add_argument("--no-resume", action="store_true", help="忽略已有輸出，從頭開始")
+
+    args = parser.parse_args(argv)
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    if args.command == "recipes":
+        specs = load_dish_specs(args.specs)
+        print(f"📋 讀取 {len(specs)} 道菜品")
+        report = generate_recipes_batch(
+            specs, args.output,
+            service=args.service,
+            parallelism=args.parallelism,
+            requests_per_minute=args.rpm,
+            report_path=args.report,
+            resume=not args.no_resume
+        )
+        print(f"✅ 完成 {report['succeeded']} / 失敗 {report['failed']} / 跳過 {report['skipped']}")
+        print(f"⏱️  吞吐量: {report['throughput_per_minute']} 道/分鐘, 錯誤率: {report['error_rate']:.1%}")
+    elif args.command == "images":
+        image_paths = load_image_paths(args.source)
+        print(f"🖼️  讀取 {len(image_paths)} 張圖片")
+        report = identify_dishes_batch(
+            image_paths, args.output,
+            service=args.service,
+            parallelism=args.parallelism,
+            workers=args.workers,
+            requests_per_minute=args.rpm,
+            report_path=args.report,
+            resume=not args.no_resume
+        )
+        print(f"✅ 完成 {report['succeeded']} / 失敗 {report['failed']} / 跳過 {report['skipped']}")
+        print(f"⏱️  吞吐量: {report['throughput_per_minute']} 張/分鐘, 錯誤率: {report['error_rate']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
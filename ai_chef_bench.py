@@ -0,0 +1,1015 @@
+"""
+AI 廚師顧問 - 離線基準測試模組
+AI Chef Advisor - Offline Benchmark Module
+
+用確定性的假 OpenAI / Gemini / llama.cpp 後端（可配置延遲分布、流式輸出速度、錯誤和 429）
+驅動真實的 AIChefAdvisor，不需要 API 金鑰也不產生費用；
+場景包括菜譜突發請求、長對話、圖片批量識別和混合負載，
+報告吞吐量、延遲分位數、記憶體峰值和分配次數，結果保存為 JSON 以便跨提交比較
+
+用法：
+    python ai_chef_bench.py run -o bench.json
+    python ai_chef_bench.py run --scenarios recipe_burst,long_chat --service gemini --time-scale 0.1
+    python ai_chef_bench.py compare baseline.json bench.json --threshold 0.1
+"""
+
+import os
+import re
+import sys
+import gc
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ai_chef_functions import AIChefAdvisor
+from ai_chef_backends import BackendRegistry, LlamaCppBackend, default_backends
+from ai_chef_pool import ClientPool, OPENAI_AVAILABLE
+from ai_chef_router import ModelRouter
+from ai_chef_cache import ResponseCache
+from ai_chef_phash import ImageDedupCache
+from ai_chef_recipes import RecipeStore
+from ai_chef_semantic import SemanticCache
+from ai_chef_singleflight import SingleFlight
+from ai_chef_ratelimit import RateLimiter
+from ai_chef_metrics import Metrics, InMemoryMetrics
+from ai_chef_memory import estimate_tokens
+from ai_chef_parsing import is_complete_result
+from ai_chef_ingredients import get_ingredient_index
+
+if OPENAI_AVAILABLE:
+    import httpx
+    import openai
+
+
+# 假後端的預設行為；延遲為對數正態分布，time_scale 同時縮放所有等待
+DEFAULT_PROFILE = {
+    "latency_median": 0.8,      # 首個 token 前的延遲中位數（秒）
+    "latency_sigma": 0.5,       # 對數正態分布的 sigma
+    "tokens_per_second": 80.0,  # 生成速度
+    "error_rate": 0.0,          # 5xx 錯誤比例
+    "rate_limit_rate": 0.0,     # 429 比例
+    "retry_after": 1.0,         # 429 響應攜帶的等待時間（秒）
+    "chat_tokens": 120,         # 對話回應的長度
+}
+ERROR_LATENCY = 0.05
+STREAM_CHUNK_CHARS = 4
+DEFAULT_RESULTS_PATH = "bench_results.json"
+DEFAULT_THRESHOLD = 0.1
+
+DISHES = [
+    "番茄炒蛋", "宮保雞丁", "麻婆豆腐", "紅燒肉", "魚香肉絲", "糖醋排骨", "蒜蓉西蘭花",
+    "酸辣湯", "水煮魚", "京醬肉絲", "回鍋肉", "乾煸四季豆", "蔥爆牛肉", "清蒸鱸魚",
+    "地三鮮", "可樂雞翅", "青椒土豆絲", "蛋炒飯", "牛肉麵", "三杯雞", "滷肉飯",
+    "蚵仔煎", "鹽酥雞", "鳳梨蝦球", "白切雞", "梅菜扣肉", "揚州炒飯", "韭菜盒子",
+    "獅子頭", "東坡肉",
+]
+
+CHAT_QUESTIONS = [
+    "炒青菜怎樣才能保持翠綠？",
+    "燉牛肉要燉多久才會軟爛？",
+    "做蛋糕時蛋白打發失敗是什麼原因？",
+    "煎魚總是黏鍋怎麼辦？",
+    "滷肉要放哪些香料？",
+    "怎樣讓炸物更酥脆？",
+    "米飯煮得太軟怎麼補救？",
+    "醃肉時加蛋白有什麼作用？",
+]
+
+_CHAT_PHRASES = [
+    "先把鍋燒熱再放油，", "火候要由大轉小，", "食材下鍋前盡量瀝乾水分，",
+    "調味可以分兩次進行，", "起鍋前再淋少許香油，", "肉類先醃製十五分鐘，",
+    "蔬菜切好後不要久放，", "燉煮時保持微滾即可，", "最後試一下味道再調整。",
+]
+
+# 模板中 "...", 形式的佔位元素和結尾多餘的逗號
+_ELLIPSIS_ITEM_RE = re.compile(r",\s*\.\.\.\s*(?=[\]}])")
+_TRAILING_COMMA_RE = re.compile(r",\s*(?=[\]}])")
+
+
+# ==================== 假 LLM ====================
+
+def _json_blocks(text: str) -> List[str]:
+    """提示詞中所有最外層的 {...} 片段"""
+    blocks, depth, start = [], 0, None
+    for index, char in enumerate(text):
+        if char == "{":
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                blocks.append(text[start:index + 1])
+    return blocks
+
+
+def _fill_template(prompt: str) -> Optional[str]:
+    """按提示詞固定前綴中的 JSON 模板生成一個格式正確的回應；沒有模板時返回 None"""
+    for block in _json_blocks(prompt):
+        cleaned = _TRAILING_COMMA_RE.sub("", _ELLIPSIS_ITEM_RE.sub("", block))
+        try:
+            return json.dumps(json.loads(cleaned), ensure_ascii=False)
+        except ValueError:
+            continue
+    return None
+
+
+def _message_text(messages: Any) -> str:
+    """從 OpenAI messages 或 Gemini contents 中取出文本部分（忽略圖片）"""
+    if isinstance(messages, str):
+        return messages
+    if isinstance(messages, dict):
+        if "content" in messages:
+            return _message_text(messages["content"])
+        if "parts" in messages:
+            return _message_text(messages["parts"])
+        return messages.get("text", "") if isinstance(messages.get("text"), str) else ""
+    if isinstance(messages, (list, tuple)):
+        return "\n".join(filter(None, (_message_text(item) for item in messages)))
+    return ""
+
+
+class FakeLLM:
+    """
+    確定性的假模型
+
+    相同的種子和相同的調用順序產生相同的延遲、錯誤和回應；
+    提示詞中帶 JSON 模板時按模板返回完整的 JSON，否則返回一段對話文本。
+    """
+
+    def __init__(self,
+                 profile: Optional[Dict] = None,
+                 seed: int = 0,
+                 time_scale: float = 1.0,
+                 model_profiles: Optional[Dict[str, Dict]] = None):
+        """
+        初始化假模型
+
+        Parameters:
+        -----------
+        profile : dict, optional
+            覆蓋 DEFAULT_PROFILE 中的參數
+        seed : int
+            隨機種子
+        time_scale : float
+            所有等待時間的縮放係數（0.1 表示以十倍速運行）
+        model_profiles : dict, optional
+            {模型名: 參數}，讓個別模型使用不同的延遲或錯誤率
+        """
+        self.profile = dict(DEFAULT_PROFILE, **(profile or {}))
+        self.model_profiles = model_profiles or {}
+        self.time_scale = time_scale
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def plan(self, prompt: str, model: Optional[str] = None) -> Dict:
+        """
+        決定一次調用的結果
+
+        Returns:
+        --------
+        dict
+            {"error": None/"rate_limit"/"server", "retry_after", "ttft", "text",
+             "chunks", "interval", "prompt_tokens", "completion_tokens"}
+        """
+        profile = dict(self.profile, **self.model_profiles.get(model or "", {}))
+        with self._lock:
+            self.calls += 1
+            ttft = self._random.lognormvariate(math.log(profile["latency_median"]), profile["latency_sigma"])
+            roll = self._random.random()
+            if roll < profile["rate_limit_rate"]:
+                error = "rate_limit"
+                self.rate_limited += 1
+            elif roll < profile["rate_limit_rate"] + profile["error_rate"]:
+                error = "server"
+                self.errors += 1
+            else:
+                error = None
+
+        if error is not None:
+            return {"error": error, "retry_after": profile["retry_after"], "ttft": ERROR_LATENCY}
+
+        text = _fill_template(prompt) or self._chat_text(prompt, profile["chat_tokens"])
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(text)
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        return {
+            "error": None,
+            "ttft": ttft,
+            "text": text,
+            "chunks": chunks,
+            "interval": completion_tokens / profile["tokens_per_second"] / max(1, len(chunks)),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        }
+
+    @staticmethod
+    def _chat_text(prompt: str, tokens: int) -> str:
+        """由提示詞決定的對話回應（同一問題總是得到同一回答）"""
+        seed = int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        picker = random.Random(seed)
+        text = ""
+        while estimate_tokens(text) < tokens:
+            text += picker.choice(_CHAT_PHRASES)
+        return text
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds * self.time_scale)
+
+    async def sleep_async(self, seconds: float):
+        await asyncio.sleep(seconds * self.time_scale)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "rate_limited": self.rate_limited,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+# ==================== 假 OpenAI 客戶端 ====================
+
+class FakeAPIError(Exception):
+    """未安裝 openai 時使用的錯誤，帶 status_code 和 retry-after 響應頭"""
+
+    def __init__(self, status_code: int, retry_after: float):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={"retry-after": f"{retry_after:.3f}"})
+
+
+def _openai_error(plan: Dict, time_scale: float) -> Exception:
+    """按計劃構造和真實 SDK 一致的錯誤（已安裝 openai 時使用其錯誤類型）"""
+    status = 429 if plan["error"] == "rate_limit" else 503
+    retry_after = plan["retry_after"] * time_scale
+    if not OPENAI_AVAILABLE:
+        return FakeAPIError(status, retry_after)
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, headers={"retry-after": f"{retry_after:.3f}"}, request=request)
+    error_class = openai.RateLimitError if status == 429 else openai.InternalServerError
+    return error_class(f"Error code: {status}", response=response, body=None)
+
+
+def _openai_response(model: str, plan: Dict):
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(message=SimpleNamespace(content=plan["text"]))],
+        usage=SimpleNamespace(
+            prompt_tokens=plan["prompt_tokens"],
+            completion_tokens=plan["completion_tokens"],
+            total_tokens=plan["prompt_tokens"] + plan["completion_tokens"],
+        ),
+    )
+
+
+def _openai_chunk(piece: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+def _openai_usage_chunk(model: str, plan: Dict):
+    """stream_options.include_usage 時的最後一個片段：choices 為空，只帶 usage"""
+    return SimpleNamespace(model=model, choices=[], usage=_openai_response(model, plan).usage)
+
+
+def _include_usage(options: Dict) -> bool:
+    return bool((options.get("stream_options") or {}).get("include_usage"))
+
+
+class _FakeCompletions:
+    def __init__(self, llm: FakeLLM):
+        self._llm = llm
+        self.with_raw_response = SimpleNamespace(create=self._create_raw)
+
+    def create(self, model: str, messages: List[Dict], stream: bool = False, **options):
+        plan = self._llm.plan(_message_text(messages), model)
+        self._llm.sleep(plan["ttft"])
+        if plan["error"]:
+            raise _openai_error(plan, self._llm.time_scale)
+        if stream:
+            return self._stream(model, plan, _include_usage(options))
+        self._llm.sleep(plan["interval"] * len(plan["chunks"]))
+        return _openai_response(model, plan)
+
+    def _create_raw(self, **request):
+        response = self.create(**request)
+        return SimpleNamespace(headers={}, parse=lambda: response)
+
+    def _stream(self, model: str, plan: Dict, include_usage: bool) -> Iterator:
+        for piece in plan["chunks"]:
+            yield _openai_chunk(piece)
+            self._llm.sleep(plan["interval"])
+        if include_usage:
+            yield _openai_usage_chunk(model, plan)
+
+
+class _FakeAsyncCompletions:
+    def __init__(self, llm: FakeLLM):
+        self._llm = llm
+        self.with_raw_response = SimpleNamespace(create=self._create_raw)
+
+    async def create(self, model: str, messages: List[Dict], stream: bool = False, **options):
+        plan = self._llm.plan(_message_text(messages), model)
+        await self._llm.sleep_async(plan["ttft"])
+        if plan["error"]:
+            raise _openai_error(plan, self._llm.time_scale)
+        if stream:
+            return self._stream(model, plan, _include_usage(options))
+        await self._llm.sleep_async(plan["interval"] * len(plan["chunks"]))
+        return _openai_response(model, plan)
+
+    async def _create_raw(self, **request):
+        response = await self.create(**request)
+        return SimpleNamespace(headers={}, parse=lambda: response)
+
+    async def _stream(self, model: str, plan: Dict, include_usage: bool):
+        for piece in plan["chunks"]:
+            yield _openai_chunk(piece)
+            await self._llm.sleep_async(plan["interval"])
+        if include_usage:
+            yield _openai_usage_chunk(model, plan)
+
+
+class FakeOpenAI:
+    """假的 OpenAI 客戶端（只實現 chat.completions）"""
+
+    def __init__(self, llm: FakeLLM):
+        self.chat = SimpleNamespace(completions=_FakeCompletions(llm))
+
+
+class FakeAsyncOpenAI:
+    """假的 AsyncOpenAI 客戶端"""
+
+    def __init__(self, llm: FakeLLM):
+        self.chat = SimpleNamespace(completions=_FakeAsyncCompletions(llm))
+
+
+# ==================== 假 Gemini 模型 ====================
+
+class ResourceExhausted(Exception):
+    """與 google.api_core 同名，錯誤信息格式也一致（路由器按名稱和信息分類）"""
+
+
+class ServiceUnavailable(Exception):
+    """與 google.api_core 同名的 503 錯誤"""
+
+
+def _gemini_error(plan: Dict, time_scale: float) -> Exception:
+    if plan["error"] == "rate_limit":
+        retry_after = plan["retry_after"] * time_scale
+        return ResourceExhausted(f"429 Resource has been exhausted. Please retry in {retry_after:.3f}s.")
+    return ServiceUnavailable("503 The service is currently unavailable.")
+
+
+def _gemini_response(plan: Dict):
+    return SimpleNamespace(
+        text=plan["text"],
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=plan["prompt_tokens"],
+            candidates_token_count=plan["completion_tokens"],
+            total_token_count=plan["prompt_tokens"] + plan["completion_tokens"],
+        ),
+    )
+
+
+class FakeGeminiModel:
+    """假的 genai.GenerativeModel"""
+
+    def __init__(self, llm: FakeLLM, model_name: str):
+        self._llm = llm
+        self.model_name = model_name
+
+    def generate_content(self, contents: Any, stream: bool = False, **options):
+        plan = self._llm.plan(_message_text(contents), self.model_name)
+        self._llm.sleep(plan["ttft"])
+        if plan["error"]:
+            raise _gemini_error(plan, self._llm.time_scale)
+        if stream:
+            return self._stream(plan)
+        self._llm.sleep(plan["interval"] * len(plan["chunks"]))
+        return _gemini_response(plan)
+
+    def _stream(self, plan: Dict) -> Iterator:
+        for piece in plan["chunks"]:
+            yield SimpleNamespace(text=piece)
+            self._llm.sleep(plan["interval"])
+
+    async def generate_content_async(self, contents: Any, **options):
+        plan = self._llm.plan(_message_text(contents), self.model_name)
+        await self._llm.sleep_async(plan["ttft"])
+        if plan["error"]:
+            raise _gemini_error(plan, self._llm.time_scale)
+        await self._llm.sleep_async(plan["interval"] * len(plan["chunks"]))
+        return _gemini_response(plan)
+
+
+# ==================== 假 llama.cpp 模型 ====================
+
+def _llama_response(model: str, plan: Dict) -> Dict:
+    return {
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": plan["text"]}}],
+        "usage": {
+            "prompt_tokens": plan["prompt_tokens"],
+            "completion_tokens": plan["completion_tokens"],
+            "total_tokens": plan["prompt_tokens"] + plan["completion_tokens"],
+        },
+    }
+
+
+class FakeLlamaModel:
+    """假的 llama_cpp.Llama（只實現 create_chat_completion；本地模型沒有 429，錯誤都是運行時錯誤）"""
+
+    def __init__(self, llm: FakeLLM, model_path: str):
+        self._llm = llm
+        self.model_path = model_path
+
+    def create_chat_completion(self, messages: List[Dict], stream: bool = False, **options):
+        model = os.path.basename(self.model_path)
+        plan = self._llm.plan(_message_text(messages), model)
+        self._llm.sleep(plan["ttft"])
+        if plan["error"]:
+            raise RuntimeError("llama_decode returned -1")
+        if stream:
+            return self._stream(plan)
+        self._llm.sleep(plan["interval"] * len(plan["chunks"]))
+        return _llama_response(model, plan)
+
+    def _stream(self, plan: Dict) -> Iterator:
+        for piece in plan["chunks"]:
+            yield {"choices": [{"index": 0, "delta": {"content": piece}}]}
+            self._llm.sleep(plan["interval"])
+
+
+# ==================== 測試環境 ====================
+
+class BenchEnvironment:
+    """
+    一個場景使用的獨立組件
+
+    緩存、連接池、路由器、限速器和指標都是新建的，場景之間互不影響，
+    也不會讀寫進程級共享實例或工作目錄下的緩存文件。
+    """
+
+    def __init__(self,
+                 llm: FakeLLM,
+                 workdir: str,
+                 service: str = "openai",
+                 use_cache: bool = True,
+                 rate_limits: Optional[Dict[str, Dict[str, Optional[float]]]] = None):
+        """
+        初始化測試環境
+
+        Parameters:
+        -----------
+        llm : FakeLLM
+            所有假客戶端共用的假模型
+        workdir : str
+            緩存文件所在的臨時目錄
+        service : str
+            "openai", "gemini" 或 "llama_cpp"
+        use_cache : bool
+            是否啟用響應緩存
+        rate_limits : dict, optional
+            {服務: {"rpm": ..., "tpm": ...}}；預設不限速，只測重試
+        """
+        self.llm = llm
+        self.service = service
+        self.use_cache = use_cache
+        self.workdir = Path(workdir)
+
+        self.pool = ClientPool()
+        self.pool.set_factory("openai", lambda api_key, base_url=None: FakeOpenAI(llm))
+        self.pool.set_factory("openai_async", lambda api_key, base_url=None: FakeAsyncOpenAI(llm))
+        self.pool.set_factory("gemini", lambda api_key, model_name, **options: FakeGeminiModel(llm, model_name))
+        self.pool.set_factory("llama_cpp", lambda model_path, **options: FakeLlamaModel(llm, model_path))
+        # 只在測本地模型時登記它，否則雲端服務的錯誤會被本地回退掩蓋；
+        # 本地模型後端只檢查文件是否存在，假模型不讀取內容
+        self.backends = BackendRegistry(default_backends())
+        self.backends.unregister(LlamaCppBackend.name)
+        if service == LlamaCppBackend.name:
+            model_path = self.workdir / "bench-local.gguf"
+            model_path.touch()
+            self.backends.register(LlamaCppBackend(model_path=str(model_path)))
+        self.router = ModelRouter()
+        self.cache = ResponseCache(path=str(self.workdir / "responses.sqlite3"))
+        self.image_cache = ImageDedupCache(path=str(self.workdir / "images.sqlite3"))
+        self.recipe_store = RecipeStore(path=str(self.workdir / "recipes.sqlite3"))
+        self.semantic_cache = SemanticCache()
+        self.flights = SingleFlight()
+        # 每個服務給一個空配置，避免回退到真實服務的預設限額
+        self.rate_limiter = RateLimiter(
+            model_limits=rate_limits or {"openai": {}, "gemini": {}},
+            base_delay=llm.time_scale,
+            max_delay=30.0 * llm.time_scale,
+        )
+        self.metrics = Metrics([InMemoryMetrics()])
+
+    def advisor(self) -> AIChefAdvisor:
+        """新建一個顧問（相當於一個新的用戶會話），共享本環境的組件"""
+        return AIChefAdvisor(
+            api_key="bench-key",
+            use_service=self.service,
+            use_cache=self.use_cache,
+            cache=self.cache,
+            pool=self.pool,
+            router=self.router,
+            image_cache=self.image_cache,
+            recipe_store=self.recipe_store,
+            semantic_cache=self.semantic_cache,
+            flights=self.flights,
+            rate_limiter=self.rate_limiter,
+            metrics=self.metrics,
+            backends=self.backends,
+        )
+
+
+# ==================== 場景 ====================
+
+# 場景函數返回 (任務列表, 並發數)；任務是無參數函數，返回 {"ok": bool, "ttft": 秒或 None}
+
+def _succeeded(result: Any) -> bool:
+    if isinstance(result, dict):
+        return "error" not in result and is_complete_result(result)
+    if isinstance(result, str):
+        return bool(result) and not result.startswith("❌")
+    return result is not None
+
+
+def _recipe_burst(env: BenchEnvironment, rng: random.Random,
+                  requests: int = 40, concurrency: int = 8, unique_dishes: int = 25) -> Tuple[List[Callable], int]:
+    """許多會話同時請求菜譜，其中一部分菜名重複（考驗合併和緩存）"""
+    dishes = [DISHES[i % min(unique_dishes, len(DISHES))] for i in range(requests)]
+    rng.shuffle(dishes)
+
+    def task(dish: str) -> Dict:
+        return {"ok": _succeeded(env.advisor().generate_recipe(dish, servings=2))}
+
+    return [lambda dish=dish: task(dish) for dish in dishes], concurrency
+
+
+def _long_chat(env: BenchEnvironment, rng: random.Random, turns: int = 30) -> Tuple[List[Callable], int]:
+    """單個會話的多輪流式對話（考驗對話記憶的裁剪和流式首字延遲）"""
+    advisor = env.advisor()
+
+    def task(turn: int) -> Dict:
+        question = f"{CHAT_QUESTIONS[turn % len(CHAT_QUESTIONS)]}（第 {turn + 1} 輪）"
+        started = time.perf_counter()
+        ttft = None
+        text = ""
+        for piece in advisor.chat_stream(question):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            text += piece
+        return {"ok": _succeeded(text), "ttft": ttft}
+
+    return [lambda turn=turn: task(turn) for turn in range(turns)], 1
+
+
+def _synthetic_image(path: Path, seed: int, size: Tuple[int, int] = (1600, 1200), quality: int = 90):
+    """由種子決定的平滑彩色圖片（模擬手機照片的尺寸）"""
+    state = np.random.RandomState(seed)
+    coarse = state.randint(0, 256, (6, 8, 3), dtype=np.uint8)
+    Image.fromarray(coarse).resize(size, Image.BILINEAR).save(path, "JPEG", quality=quality)
+
+
+def _image_batch(env: BenchEnvironment, rng: random.Random,
+                 images: int = 16, concurrency: int = 4, unique_images: int = 10) -> Tuple[List[Callable], int]:
+    """批量識別菜品照片，其中一部分是重新壓縮過的同一張照片（考驗感知雜湊去重）"""
+    unique_images = max(1, min(unique_images, images))
+    paths = []
+    for i in range(images):
+        path = env.workdir / f"dish_{i}.jpg"
+        # 超出 unique_images 的圖片是已有照片以較低品質重新保存的版本
+        _synthetic_image(path, seed=i % unique_images, quality=90 if i < unique_images else 70)
+        paths.append(str(path))
+    rng.shuffle(paths)
+
+    def task(path: str) -> Dict:
+        return {"ok": _succeeded(env.advisor().identify_dish_from_image(path))}
+
+    return [lambda path=path: task(path) for path in paths], concurrency
+
+
+def _mixed(env: BenchEnvironment, rng: random.Random,
+           operations: int = 60, concurrency: int = 8) -> Tuple[List[Callable], int]:
+    """菜譜、烹飪建議、營養分析和首輪對話的混合負載"""
+    image_path = env.workdir / "mixed.jpg"
+    _synthetic_image(image_path, seed=0)
+    weights = [("recipe", 4), ("advice", 2), ("nutrition", 2), ("chat", 3), ("identify", 1)]
+    kinds = rng.choices([k for k, _ in weights], weights=[w for _, w in weights], k=operations)
+    dishes = [rng.choice(DISHES) for _ in range(operations)]
+    questions = [rng.choice(CHAT_QUESTIONS) for _ in range(operations)]
+
+    def task(kind: str, dish: str, question: str) -> Dict:
+        advisor = env.advisor()
+        if kind == "recipe":
+            result = advisor.generate_recipe(dish)
+        elif kind == "advice":
+            result = advisor.get_cooking_advice(dish, "火候")
+        elif kind == "nutrition":
+            result = advisor.analyze_nutrition({"雞胸肉": "200g", "西蘭花": "150g", "米飯": "1碗"})
+        elif kind == "chat":
+            result = advisor.chat(question)
+        else:
+            result = advisor.identify_dish_from_image(str(image_path))
+        return {"ok": _succeeded(result)}
+
+    return [lambda a=a, b=b, c=c: task(a, b, c) for a, b, c in zip(kinds, dishes, questions)], concurrency
+
+
+SCENARIOS: Dict[str, Callable[..., Tuple[List[Callable], int]]] = {
+    "recipe_burst": _recipe_burst,
+    "long_chat": _long_chat,
+    "image_batch": _image_batch,
+    "mixed": _mixed,
+}
+
+
+# ==================== 執行與測量 ====================
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(math.ceil(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _distribution(values: List[float]) -> Optional[Dict]:
+    """平均值和 p50/p95/p99（秒）"""
+    if not values:
+        return None
+    return {
+        "mean": sum(values) / len(values),
+        "p50": _percentile(values, 0.50),
+        "p95": _percentile(values, 0.95),
+        "p99": _percentile(values, 0.99),
+        "max": max(values),
+    }
+
+
+def _execute(tasks: List[Callable], concurrency: int) -> List[Dict]:
+    """按並發數執行任務，記錄每個任務的延遲；任務拋出異常記為失敗"""
+    def timed(task: Callable) -> Dict:
+        started = time.perf_counter()
+        try:
+            outcome = task()
+        except Exception as e:
+            outcome = {"ok": False, "exception": type(e).__name__}
+        outcome["latency"] = time.perf_counter() - started
+        return outcome
+
+    if concurrency <= 1:
+        return [timed(task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(timed, tasks))
+
+
+def _allocation_report(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top: int = 5) -> Dict:
+    """場景期間新增的分配塊數和增長最多的分配位置"""
+    root = str(Path(__file__).resolve().parent)
+    stats = after.compare_to(before, "lineno")
+    growth = sorted((s for s in stats if s.size_diff > 0), key=lambda s: s.size_diff, reverse=True)
+    return {
+        "allocated_blocks": sum(s.count_diff for s in stats if s.count_diff > 0),
+        "top_allocations": [
+            {
+                "location": f"{os.path.relpath(s.traceback[0].filename, root)}:{s.traceback[0].lineno}",
+                "size_diff": s.size_diff,
+                "count_diff": s.count_diff,
+            }
+            for s in growth[:top]
+        ],
+    }
+
+
+def run_scenario(name: str,
+                 service: str = "openai",
+                 seed: int = 0,
+                 time_scale: float = 1.0,
+                 profile: Optional[Dict] = None,
+                 use_cache: bool = True,
+                 trace_memory: bool = True,
+                 **options) -> Dict:
+    """
+    在新建的環境中運行一個場景
+
+    Parameters:
+    -----------
+    name : str
+        SCENARIOS 中的場景名稱
+    service : str
+        "openai", "gemini" 或 "llama_cpp"
+    seed : int
+        隨機種子（決定假模型的延遲和錯誤，以及場景的請求順序）
+    time_scale : float
+        假模型等待時間的縮放係數
+    profile : dict, optional
+        覆蓋假模型的預設參數
+    use_cache : bool
+        是否啟用響應緩存
+    trace_memory : bool
+        是否用 tracemalloc 測量記憶體（會讓 Python 代碼本身變慢）
+    **options
+        傳給場景函數的參數（如 requests、concurrency）
+
+    Returns:
+    --------
+    dict
+        吞吐量、延遲分布、記憶體和上游調用統計
+    """
+    if name not in SCENARIOS:
+        raise ValueError(f"未知場景：{name}（可用：{', '.join(SCENARIOS)}）")
+
+    llm = FakeLLM(profile, seed=seed, time_scale=time_scale)
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory(prefix="ai_chef_bench_") as workdir:
+        env = BenchEnvironment(llm, workdir, service=service, use_cache=use_cache)
+        tasks, concurrency = SCENARIOS[name](env, rng, **options)
+
+        gc.collect()
+        tracing = trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        outcomes = _execute(tasks, concurrency)
+        elapsed = time.perf_counter() - started
+
+        memory = None
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            memory = {"peak_bytes": peak, "net_bytes": current, **_allocation_report(before, after)}
+
+        failures = sum(1 for o in outcomes if not o.get("ok"))
+        return {
+            "concurrency": concurrency,
+            "options": options,
+            "operations": len(outcomes),
+            "failures": failures,
+            "error_rate": failures / len(outcomes) if outcomes else 0.0,
+            "elapsed_seconds": elapsed,
+            "throughput_per_second": len(outcomes) / elapsed if elapsed > 0 else None,
+            "latency": _distribution([o["latency"] for o in outcomes]),
+            "ttft": _distribution([o["ttft"] for o in outcomes if o.get("ttft") is not None]),
+            "memory": memory,
+            "upstream": llm.stats(),
+            "coalesced": env.flights.stats()["coalesced"],
+            "rate_limits": env.rate_limiter.stats(),
+        }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, timeout=10,
+        )
+        return output.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(scenarios: Optional[List[str]] = None,
+                   service: str = "openai",
+                   seed: int = 0,
+                   time_scale: float = 1.0,
+                   profile: Optional[Dict] = None,
+                   use_cache: bool = True,
+                   trace_memory: bool = True) -> Dict:
+    """
+    依次運行多個場景
+
+    Returns:
+    --------
+    dict
+        {"meta": 運行環境和配置, "scenarios": {場景名: run_scenario 的結果}}
+    """
+    scenarios = scenarios or list(SCENARIOS)
+    # 食材庫只在首次使用時加載，提前加載以免計入第一個場景
+    get_ingredient_index()
+
+    results = {}
+    for name in scenarios:
+        results[name] = run_scenario(
+            name, service=service, seed=seed, time_scale=time_scale,
+            profile=profile, use_cache=use_cache, trace_memory=trace_memory,
+        )
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "service": service,
+            "seed": seed,
+            "time_scale": time_scale,
+            "use_cache": use_cache,
+            "trace_memory": trace_memory,
+            "profile": dict(DEFAULT_PROFILE, **(profile or {})),
+        },
+        "scenarios": results,
+    }
+
+
+# ==================== 結果比較 ====================
+
+# (指標路徑, 數值越大越好)
+COMPARED_METRICS = [
+    ("throughput_per_second", True),
+    ("latency.p50", False),
+    ("latency.p95", False),
+    ("latency.p99", False),
+    ("ttft.p95", False),
+    ("error_rate", False),
+    ("memory.peak_bytes", False),
+    ("memory.allocated_blocks", False),
+]
+
+
+def _lookup(data: Optional[Dict], path: str) -> Optional[float]:
+    for part in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data if isinstance(data, (int, float)) else None
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """
+    比較兩次運行的結果
+
+    Parameters:
+    -----------
+    baseline, current : dict
+        run_benchmarks 的結果
+    threshold : float
+        相對變差超過多少算作退化（0.1 即 10%）
+
+    Returns:
+    --------
+    list
+        每個 (場景, 指標) 一行：baseline、current、相對變化和是否退化
+    """
+    rows = []
+    for scenario, old in baseline.get("scenarios", {}).items():
+        new = current.get("scenarios", {}).get(scenario)
+        if new is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            before, after = _lookup(old, metric), _lookup(new, metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else None
+            worse = -change if higher_is_better and change is not None else change
+            if change is None:
+                regression = after > before if not higher_is_better else False
+            else:
+                regression = worse > threshold
+            rows.append({
+                "scenario": scenario,
+                "metric": metric,
+                "baseline": before,
+                "current": after,
+                "change": change,
+                "regression": regression,
+            })
+    return rows
+
+
+def _warn_mismatched(baseline: Dict, current: Dict):
+    """配置不同時的比較沒有意義，提醒一下"""
+    keys = ("service", "seed", "time_scale", "use_cache", "trace_memory", "profile")
+    old, new = baseline.get("meta", {}), current.get("meta", {})
+    differing = [key for key in keys if old.get(key) != new.get(key)]
+    if differing:
+        print(f"⚠️ 兩次運行的配置不同：{', '.join(differing)}", file=sys.stderr)
+
+
+# ==================== 命令行 ====================
+
+def _format_value(metric: str, value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if metric.startswith("memory."):
+        return f"{value / 1024:.0f} KiB" if metric.endswith("bytes") else f"{value:.0f}"
+    if metric.startswith(("latency", "ttft")):
+        return f"{value * 1000:.0f} ms"
+    if metric == "error_rate":
+        return f"{value:.1%}"
+    return f"{value:.2f}"
+
+
+def _print_summary(results: Dict):
+    meta = results["meta"]
+    print(f"服務: {meta['service']}  種子: {meta['seed']}  時間縮放: {meta['time_scale']}  提交: {meta['commit']}")
+    for name, result in results["scenarios"].items():
+        print(f"\n[{name}] {result['operations']} 個操作，並發 {result['concurrency']}，耗時 {result['elapsed_seconds']:.2f} 秒")
+        for metric, _ in COMPARED_METRICS:
+            value = _lookup(result, metric)
+            if value is not None:
+                print(f"  {metric:<26}{_format_value(metric, value)}")
+        upstream = result["upstream"]
+        print(f"  {'upstream.calls':<26}{upstream['calls']}（429: {upstream['rate_limited']}，5xx: {upstream['errors']}）")
+        print(f"  {'coalesced':<26}{result['coalesced']}")
+
+
+def _print_comparison(rows: List[Dict]):
+    for row in rows:
+        change = "-" if row["change"] is None else f"{row['change']:+.1%}"
+        flag = "  ❌ 退化" if row["regression"] else ""
+        print(
+            f"{row['scenario']:<14}{row['metric']:<26}"
+            f"{_format_value(row['metric'], row['baseline']):>12} → "
+            f"{_format_value(row['metric'], row['current']):>12}  {change:>8}{flag}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="AI 廚師顧問離線基準測試")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="運行基準測試")
+    run.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗號分隔的場景名稱")
+    run.add_argument("--service", choices=["openai", "gemini", "llama_cpp"], default="openai")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--time-scale", type=float, default=1.0, help="假後端等待時間的縮放係數")
+    run.add_argument("--latency-median", type=float, default=DEFAULT_PROFILE["latency_median"])
+    run.add_argument("--latency-sigma", type=float, default=DEFAULT_PROFILE["latency_sigma"])
+    run.add_argument("--tokens-per-second", type=float, default=DEFAULT_PROFILE["tokens_per_second"])
+    run.add_argument("--error-rate", type=float, default=DEFAULT_PROFILE["error_rate"])
+    run.add_argument("--rate-limit-rate", type=float, default=DEFAULT_PROFILE["rate_limit_rate"])
+    run.add_argument("--no-cache", action="store_true", help="關閉響應緩存")
+    run.add_argument("--no-memory", action="store_true", help="不測量記憶體")
+    run.add_argument("-o", "--output", default=DEFAULT_RESULTS_PATH, help="結果 JSON 路徑")
+
+    compare = commands.add_parser("compare", help="比較兩次運行的結果")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="算作退化的相對變差")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+        unknown = [name for name in scenarios if name not in SCENARIOS]
+        if unknown:
+            parser.error(f"未知場景：{', '.join(unknown)}")
+        profile = {
+            "latency_median": args.latency_median,
+            "latency_sigma": args.latency_sigma,
+            "tokens_per_second": args.tokens_per_second,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+        }
+        results = run_benchmarks(
+            scenarios, service=args.service, seed=args.seed, time_scale=args.time_scale,
+            profile=profile, use_cache=not args.no_cache, trace_memory=not args.no_memory,
+        )
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        _print_summary(results)
+        print(f"\n結果已保存到 {args.output}")
+        return 0
+
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+    _warn_mismatched(baseline, current)
+    rows = compare_results(baseline, current, args.threshold)
+    _print_comparison(rows)
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+AI 廚師顧問 - 響應緩存模組
+AI Chef Advisor - Response Cache Module
+
+以提示詞輸入的正規化雜湊為鍵，記憶體 LRU + SQLite 磁碟持久化的響應緩存
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+# 預設緩存位置與有效期（秒）
+DEFAULT_CACHE_PATH = os.getenv(
+    "AI_CHEF_CACHE_PATH",
+    str(Path(__file__).parent / ".cache" / "ai_chef_cache.sqlite3")
+)
+DEFAULT_CACHE_TTL = int(os.getenv("AI_CHEF_CACHE_TTL", str(7 * 24 * 3600)))
+DEFAULT_MEMORY_ENTRIES = 256
+
+
+def _normalize(value: Any) -> Any:
+    """正規化提示詞輸入，使等價的請求得到相同的鍵"""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        return {str(k).strip(): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        # 食材等列表與順序無關
+        items = [_normalize(v) for v in value]
+        items = [v for v in items if v not in ("", None)]
+        return sorted(items, key=lambda v: json.dumps(v, ensure_ascii=False, sort_keys=True))
+    return value
+
+
+def make_cache_key(namespace: str, service: str, model: str, **inputs) -> str:
+    """
+    生成內容定址的緩存鍵
+
+    Parameters:
+    -----------
+    namespace : str
+        任務類型，例如 "recipe"
+    service : str
+        AI 服務名稱
+    model : str
+        模型名稱
+    **inputs
+        構建提示詞的輸入參數
+
+    Returns:
+    --------
+    str
+        SHA-256 十六進位雜湊
+    """
+    payload = {
+        "namespace": namespace,
+        "service": service,
+        "model": model,
+        "inputs": _normalize(inputs),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """記憶體 LRU + SQLite 持久化的響應緩存"""
+
+    def __init__(self,
+                 path: Optional[str] = DEFAULT_CACHE_PATH,
+                 max_entries: int = DEFAULT_MEMORY_ENTRIES,
+                 default_ttl: Optional[int] = DEFAULT_CACHE_TTL):
+        """
+        初始化響應緩存
+
+        Parameters:
+        -----------
+        path : str, optional
+            SQLite 文件路徑；為 None 時僅使用記憶體
+        max_entries : int
+            記憶體中保留的最大條目數（LRU 淘汰）
+        default_ttl : int, optional
+            預設有效期（秒）；為 None 時永不過期
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn = None
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path: str):
+        """打開磁碟存儲，失敗時退回僅記憶體模式"""
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                       key TEXT PRIMARY KEY,
+                       value TEXT NOT NULL,
+                       expires_at REAL,
+                       created_at REAL NOT NULL
+                   )"""
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at < ?",
+                (time.time(),)
+            )
+            self._conn.commit()
+        except sqlite3.Error:
+            self._conn = None
+
+    # ==================== 讀寫 ====================
+
+    def get(self, key: str) -> Optional[Dict]:
+        """讀取緩存，未命中或已過期時返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return json.loads(value)
+                del self._memory[key]
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        self._remember(key, value, expires_at)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return json.loads(value)
+                    self._delete_disk(key)
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Dict, ttl: Optional[int] = None):
+        """寫入緩存"""
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        raw = json.dumps(value, ensure_ascii=False)
+
+        with self._lock:
+            self._remember(key, raw, expires_at)
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, expires_at, created_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (key, raw, expires_at, time.time())
+                    )
+                    self._conn.commit()
+                except sqlite3.Error:
+                    pass
+
+    def invalidate(self, key: str):
+        """刪除單條緩存"""
+        with self._lock:
+            self._memory.pop(key, None)
+            self._delete_disk(key)
+
+    def clear(self):
+        """清空全部緩存和計數器"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM responses")
+                    self._conn.commit()
+                except sqlite3.Error:
+                    pass
+            self.hits = self.misses = 0
+            self.memory_hits = self.disk_hits = self.evictions = 0
+
+    def stats(self) -> Dict:
+        """返回命中統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            disk_size = 0
+            if self._conn is not None:
+                try:
+                    disk_size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_size": len(self._memory),
+                "disk_size": disk_size,
+            }
+
+    # ==================== 內部方法 ====================
+
+    def _remember(self, key: str, raw: str, expires_at: Optional[float]):
+        """放入記憶體 LRU，超出容量時淘汰最久未用的條目"""
+        self._memory[key] = (raw, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _delete_disk(self, key: str):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+        except sqlite3.Error:
+            pass
+
+
+# ==================== 進程級共享緩存 ====================
+
+_default_cache: Optional[ResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> ResponseCache:
+    """獲取進程內共享的響應緩存（每次點擊都會新建 AIChefAdvisor，緩存必須跨實例共享）"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
@@ -6,34 +6,74 @@ AI Chef Advisor - AI Integration Module
 """
 
 import os
+import copy
 import json
-from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-import base64
-from io import BytesIO
-
-# AI 相關導入
-try:
-    from openai import OpenAI, APIError
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
+from functools import partial
+from typing import Dict, Iterator, List, Tuple, Optional
 
 # 圖片處理
 from PIL import Image
 import numpy as np
 
+from ai_chef_cache import ResponseCache, get_default_cache, make_cache_key
+from ai_chef_pool import ClientPool, get_client_pool
+from ai_chef_router import ModelRouter, get_model_router
+from ai_chef_streaming import RecipeStreamParser
+from ai_chef_memory import ConversationMemory
+from ai_chef_parsing import parse_structured, is_complete_result, get_parse_stats
+from ai_chef_images import prepare_image_bytes
+from ai_chef_vision import load_thumbnail, feature_vector, dominant_color_names, get_dish_index
+from ai_chef_phash import ImageDedupCache, get_image_cache, phash
+from ai_chef_nutrition import analyze_ingredients, rule_based_advice
+from ai_chef_ingredients import normalize_ingredients
+from ai_chef_recipes import RecipeStore, get_recipe_store
+from ai_chef_semantic import SemanticCache, get_semantic_cache
+from ai_chef_singleflight import SingleFlight, get_single_flight
+from ai_chef_ratelimit import RateLimiter, get_rate_limiter
+from ai_chef_hedging import Hedger, get_hedger, DEFAULT_HEDGE_ENABLED
+from ai_chef_metrics import Metrics, get_metrics, traced, note, note_service, note_fallback
+from ai_chef_backends import (
+    Backend,
+    BackendRegistry,
+    CompletionRequest,
+    LlamaCppBackend,
+    get_backend_registry,
+    describe_error,
+    TEXT,
+    VISION,
+    STREAMING,
+)
+from ai_chef_prompts import (
+    PromptTemplate,
+    TEMPLATES,
+    RECIPE_PROMPT,
+    ADVICE_PROMPT,
+    HEALTH_ADVICE_PROMPT,
+    IMAGE_PROMPT,
+    CHAT_PROMPT,
+    compact_json,
+)
 
 class AIChefAdvisor:
     """AI 廚師顧問主類"""
     
-    def __init__(self, api_key: Optional[str] = None, use_service: str = "openai"):
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 use_service: str = "openai",
+                 cache: Optional[ResponseCache] = None,
+                 use_cache: bool = True,
+                 pool: Optional[ClientPool] = None,
+                 router: Optional[ModelRouter] = None,
+                 memory: Optional[ConversationMemory] = None,
+                 image_cache: Optional[ImageDedupCache] = None,
+                 recipe_store: Optional[RecipeStore] = None,
+                 semantic_cache: Optional[SemanticCache] = None,
+                 flights: Optional[SingleFlight] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 hedger: Optional[Hedger] = None,
+                 hedge_advisor: Optional["AIChefAdvisor"] = None,
+                 metrics: Optional[Metrics] = None,
+                 backends: Optional[BackendRegistry] = None):
         """
         初始化 AI 廚師顧問
         
@@ -42,20 +82,98 @@ class AIChefAdvisor:
         api_key : str, optional
             API 金鑰
         use_service : str
-            使用的 AI 服務: "openai", "gemini", 或 "local"
+            使用的 AI 服務：後端註冊表中的名稱（"openai", "gemini", "local_server", "llama_cpp"），或 "local"
+        cache : ResponseCache, optional
+            響應緩存，預設使用進程內共享緩存
+        use_cache : bool
+            是否啟用響應緩存
+        pool : ClientPool, optional
+            客戶端池，預設使用進程內共享池
+        router : ModelRouter, optional
+            模型路由器，預設使用進程內共享路由器
+        memory : ConversationMemory, optional
+            對話記憶，預設按 AI_CHEF_CHAT_TOKEN_BUDGET 限制 token 數
+        image_cache : ImageDedupCache, optional
+            圖片識別的近似重複緩存，預設使用進程內共享緩存（use_cache 為 False 時停用）
+        recipe_store : RecipeStore, optional
+            保存生成菜譜的菜譜庫，預設使用進程內共享菜譜庫（use_cache 為 False 時停用）
+        semantic_cache : SemanticCache, optional
+            按語義相似度命中的緩存（菜名和首輪對話），預設使用進程內共享緩存（use_cache 為 False 時停用）
+        flights : SingleFlight, optional
+            請求合併器，同時進行的相同上游請求只發出一次，預設跨會話共享
+        rate_limiter : RateLimiter, optional
+            按服務和模型限速並重試 429 等錯誤，預設跨會話共享（配額按 API key 計算）
+        hedger : Hedger, optional
+            提供時啟用對沖請求：主後端超過其 p95 延遲仍未回應時向備用後端發出重複請求
+        hedge_advisor : AIChefAdvisor, optional
+            對沖使用的備用服務；未提供時 Gemini 對沖到下一個模型，OpenAI 不對沖
+        metrics : Metrics, optional
+            調用指標（耗時、token、費用、緩存命中等）的記錄器，預設跨會話共享
+        backends : BackendRegistry, optional
+            後端註冊表，預設使用進程內共享註冊表
         """
         self.use_service = use_service
         self.api_key = api_key or os.getenv("OPENAI_API_KEY") or os.getenv("GEMINI_API_KEY")
         
-        if use_service == "openai" and OPENAI_AVAILABLE:
-            self.client = OpenAI(api_key=self.api_key)
-        elif use_service == "gemini" and GEMINI_AVAILABLE:
-            genai.configure(api_key=self.api_key)
-        
-        self.conversation_history = []
+        # 客戶端和模型句柄由進程級連接池共享，新建顧問實例不會重新建立連接
+        self.pool = pool or get_client_pool()
+        self.backends = backends or get_backend_registry()
+        backend = self._backend()
+        if backend is not None:
+            backend.prepare(self)
+        
+        # 模型健康狀況同樣跨實例共享，失敗過的模型不會在每個請求上重試
+        self.router = router or get_model_router()
+        self.cache = (cache or get_default_cache()) if use_cache else None
+        # 空的緩存對象（__len__ 為 0）也是有效的實例，用 is None 判斷是否使用預設值
+        self.image_cache = (image_cache if image_cache is not None else get_image_cache()) if use_cache else None
+        self.recipe_store = (recipe_store if recipe_store is not None else get_recipe_store()) if use_cache else None
+        self.semantic_cache = (semantic_cache or get_semantic_cache()) if use_cache else None
+        self.flights = flights or get_single_flight()
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.hedger = hedger
+        self.hedge_advisor = hedge_advisor
+        self.metrics = metrics or get_metrics()
+        self.memory = memory if memory is not None else ConversationMemory()
+    
+    @property
+    def conversation_history(self) -> List[Dict]:
+        """當前對話窗口（較早的輪次已折疊進 self.memory.summary）"""
+        return self.memory.messages
+    
+    def _backend(self) -> Optional[Backend]:
+        """
+        當前服務的後端
+
+        服務未登記或依賴未安裝時使用本地模型；本地模型也不可用時為 None（返回配置提示）
+        """
+        return self.backends.resolve(self.use_service, self.pool) or self._local_backend()
+    
+    def _local_backend(self, exclude: Optional[Backend] = None) -> Optional[Backend]:
+        """
+        進程內的本地模型（降級回退）
+
+        只在配置了模型文件且 llama.cpp 已安裝時可用；exclude 是剛失敗的後端，
+        本地模型自己失敗時不再回退到自己。
+        """
+        backend = self.backends.get(LlamaCppBackend.name)
+        if backend is None or backend is exclude or not backend.configured() or not backend.available(self.pool):
+            return None
+        return backend
+    
+    def _active_service(self) -> str:
+        """實際使用的服務（依賴未安裝時為本地模型，本地模型也不可用時為 local）"""
+        backend = self._backend()
+        return backend.name if backend is not None else "local"
+    
+    def _text_model_name(self) -> str:
+        """當前服務的文本模型標識（用於緩存鍵）"""
+        backend = self._backend()
+        return backend.model_key() if backend is not None else "local"
     
     # ==================== 菜譜生成 ====================
     
+    @traced("recipe")
     def generate_recipe(self, 
                        dish_name: str, 
                        difficulty: str = "medium",
@@ -84,17 +202,224 @@ class AIChefAdvisor:
             生成的菜譜
         """
         
+        # 等價的食材寫法（西紅柿/番茄、簡繁體）規整後共用同一緩存條目；提示詞保留用戶的寫法
+        ingredient_keys = normalize_ingredients(available_ingredients)
+        cache_key = self._recipe_cache_key(
+            dish_name, difficulty, servings,
+            ingredient_keys, cooking_time_limit
+        )
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            note(cache="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+        # 精確鍵未命中時按菜名的語義相似度查找（"番茄炒蛋" / "番茄炒雞蛋"）
+        semantic_namespace = self._recipe_semantic_namespace(
+            difficulty, servings, ingredient_keys, cooking_time_limit
+        )
+        cached = self._semantic_get(semantic_namespace, dish_name)
+        if cached is not None:
+            return cached
+        
         prompt = self._build_recipe_prompt(
             dish_name, difficulty, servings, 
             available_ingredients, cooking_time_limit
         )
         
-        if self.use_service == "openai" and OPENAI_AVAILABLE:
-            return self._generate_with_openai(prompt, "recipe")
-        elif self.use_service == "gemini" and GEMINI_AVAILABLE:
-            return self._generate_with_gemini(prompt, "recipe")
-        else:
-            return self._generate_with_local(prompt, "recipe")
+        result = self._generate(prompt, "recipe")
+        
+        # 只緩存成功解析的結果，錯誤和未解析的原始回應下次重新生成
+        if cache_key and is_complete_result(result):
+            self.cache.set(cache_key, result)
+        self._semantic_set(semantic_namespace, dish_name, result)
+        self._store_recipe(
+            result, dish_name, difficulty, servings,
+            ingredient_keys, cooking_time_limit
+        )
+        
+        return result
+    
+    @traced("recipe_stream")
+    def generate_recipe_stream(self, 
+                               dish_name: str, 
+                               difficulty: str = "medium",
+                               servings: int = 2,
+                               available_ingredients: List[str] = None,
+                               cooking_time_limit: int = None,
+                               parser: Optional[RecipeStreamParser] = None) -> Iterator[str]:
+        """
+        以流式方式生成菜譜
+        
+        除 parser 外參數與 generate_recipe 相同。輸出的文本拼接後即為菜譜 JSON。
+        
+        Parameters:
+        -----------
+        parser : RecipeStreamParser, optional
+            提供時由顧問餵入輸出的文本：調用方可在 材料/步驟 等欄位完整時立即顯示，
+            結束後用 parser.finish() 取得與緩存一致的、經過結構校驗的最終結果
+        
+        Yields:
+        -------
+        str
+            菜譜 JSON 的增量文本；出錯時輸出 {"error": ...} 的 JSON
+        """
+        
+        parser = parser or RecipeStreamParser()
+        ingredient_keys = normalize_ingredients(available_ingredients)
+        cache_key = self._recipe_cache_key(
+            dish_name, difficulty, servings,
+            ingredient_keys, cooking_time_limit
+        )
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            note(cache="miss" if cached is None else "hit")
+            if cached is not None:
+                yield self._emit_result(parser, cached)
+                return
+        semantic_namespace = self._recipe_semantic_namespace(
+            difficulty, servings, ingredient_keys, cooking_time_limit
+        )
+        cached = self._semantic_get(semantic_namespace, dish_name)
+        if cached is not None:
+            yield self._emit_result(parser, cached)
+            return
+        
+        prompt = self._build_recipe_prompt(
+            dish_name, difficulty, servings, 
+            available_ingredients, cooking_time_limit
+        )
+        
+        backend = self._backend()
+        try:
+            for delta in self._stream_text(backend, RECIPE_PROMPT, prompt, max_tokens=2000, json_mode=True):
+                parser.feed(delta)
+                yield delta
+        except Exception as e:
+            # 還沒有輸出時改用本地模型一次性生成（降級結果不緩存）
+            fallback = None if parser.text else self._local_backend(exclude=backend)
+            if fallback is None:
+                yield self._emit_result(parser, {"error": f"❌ 生成出錯: {str(e)}"})
+                return
+            note_fallback()
+            result = dict(self._generate_with(fallback, prompt, "recipe"), degraded=fallback.name)
+            yield self._emit_result(parser, result)
+            return
+        
+        # 只按全文校驗過的結果緩存：被截斷的輸出即使已有部分欄位也不算完整
+        result = parser.finish()
+        if cache_key and is_complete_result(result):
+            self.cache.set(cache_key, result)
+        self._semantic_set(semantic_namespace, dish_name, result)
+        self._store_recipe(
+            result, dish_name, difficulty, servings,
+            ingredient_keys, cooking_time_limit
+        )
+    
+    @staticmethod
+    def _emit_result(parser: RecipeStreamParser, result: Dict) -> str:
+        """把已經完整的結果（緩存命中、降級結果或錯誤）作為一段輸出，並設為 parser 的最終結果"""
+        text = json.dumps(result, ensure_ascii=False)
+        parser.feed(text)
+        parser.final = result
+        return text
+    
+    def _store_recipe(self,
+                      result: Dict,
+                      dish_name: str,
+                      difficulty: str,
+                      servings: int,
+                      available_ingredients: List[str],
+                      cooking_time_limit: int):
+        """把成功生成的菜譜存入菜譜庫（add 會忽略錯誤和未完整解析的結果）"""
+        if self.recipe_store is not None:
+            self.recipe_store.add(
+                result, dish_name, difficulty, servings,
+                available_ingredients, cooking_time_limit
+            )
+    
+    def lookup_recipe(self,
+                      dish_name: str,
+                      difficulty: str = "medium",
+                      servings: int = 2,
+                      available_ingredients: List[str] = None,
+                      cooking_time_limit: int = None) -> Optional[Dict]:
+        """
+        只查找之前生成過的菜譜（響應緩存的精確鍵，然後是菜譜庫），不調用模型
+
+        參數與 generate_recipe 相同；沒有時返回 None。
+        """
+        available_ingredients = normalize_ingredients(available_ingredients)
+        cache_key = self._recipe_cache_key(
+            dish_name, difficulty, servings,
+            available_ingredients, cooking_time_limit
+        )
+        cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            return cached
+        if self.recipe_store is None:
+            return None
+        return self.recipe_store.get(
+            dish_name, difficulty, servings,
+            available_ingredients, cooking_time_limit
+        )
+    
+    def _recipe_semantic_namespace(self,
+                                   difficulty: str,
+                                   servings: int,
+                                   available_ingredients: List[str],
+                                   cooking_time_limit: int) -> Optional[str]:
+        """語義緩存的命名空間：菜名以外的參數都相同的請求才互相比較"""
+        if self.semantic_cache is None:
+            return None
+        return make_cache_key(
+            "recipe", self._active_service(), self._text_model_name(),
+            template=RECIPE_PROMPT.fingerprint,
+            difficulty=difficulty,
+            servings=servings,
+            available_ingredients=available_ingredients or [],
+            cooking_time_limit=cooking_time_limit
+        )
+    
+    def _chat_semantic_namespace(self) -> Optional[str]:
+        """
+        首輪對話的語義緩存命名空間；已有上下文時回答取決於歷史，不使用緩存
+
+        問題差一個詞意思就不同（"太軟" / "太硬"），對話只接受規整後文本相同的精確命中。
+        """
+        if self.semantic_cache is None or len(self.memory) or self.memory.summary:
+            return None
+        return make_cache_key("chat", self._active_service(), self._text_model_name(),
+                              template=CHAT_PROMPT.fingerprint)
+    
+    def _semantic_get(self, namespace: Optional[str], text: str, exact: bool = False) -> Optional[Dict]:
+        if namespace is None:
+            return None
+        cached = self.semantic_cache.get(namespace, text, exact=exact)
+        note(cache="miss" if cached is None else "semantic_hit")
+        return cached
+    
+    def _semantic_set(self, namespace: Optional[str], text: str, result: Dict):
+        if namespace is not None and is_complete_result(result):
+            self.semantic_cache.set(namespace, text, result)
+    
+    def _recipe_cache_key(self,
+                          dish_name: str,
+                          difficulty: str,
+                          servings: int,
+                          available_ingredients: List[str],
+                          cooking_time_limit: int) -> Optional[str]:
+        """菜譜請求的緩存鍵；未啟用緩存時返回 None"""
+        if self.cache is None:
+            return None
+        return make_cache_key(
+            "recipe", self._active_service(), self._text_model_name(),
+            template=RECIPE_PROMPT.fingerprint,
+            dish_name=dish_name,
+            difficulty=difficulty,
+            servings=servings,
+            available_ingredients=available_ingredients or [],
+            cooking_time_limit=cooking_time_limit
+        )
     
     def _build_recipe_prompt(self, 
                              dish_name: str,
@@ -102,139 +427,112 @@ class AIChefAdvisor:
                              servings: int,
                              available_ingredients: List[str],
                              cooking_time_limit: int) -> str:
-        """構建菜譜生成提示詞"""
-        
-        prompt = f"""
-請為我生成一份詳細的 {dish_name} 菜譜，要求如下：
-
-基本信息：
-- 菜名: {dish_name}
-- 難度級別: {difficulty} (easy/medium/hard)
-- 份量: {servings} 人份
-- 烹飪語言: 繁體中文
-
-格式要求（請按以下 JSON 格式返回）：
-{{
-    "菜名": "{dish_name}",
-    "難度": "難度等級描述",
-    "烹飪時間": "X-Y分鐘",
-    "份量": "{servings}人份",
-    "材料": {{
-        "材料名": "用量描述",
-        ...
-    }},
-    "步驟": [
-        "第一步的詳細描述",
-        "第二步的詳細描述",
-        ...
-    ],
-    "烹飪技巧": [
-        "技巧1: 描述",
-        "技巧2: 描述",
-        ...
-    ],
-    "營養信息": {{
-        "熱量": "數值 kcal/份",
-        "蛋白質": "數值g",
-        "脂肪": "數值g",
-        "碳水化合物": "數值g"
-    }},
-    "健康提示": [
-        "提示1",
-        "提示2",
-        ...
-    ],
-    "搭配建議": [
-        "搭配建議1",
-        "搭配建議2",
-        ...
-    ]
-}}
-"""
-        
-        if available_ingredients:
-            prompt += f"\n可用食材: {', '.join(available_ingredients)}\n"
-        
-        if cooking_time_limit:
-            prompt += f"烹飪時間限制: 不超過 {cooking_time_limit} 分鐘\n"
+        """構建菜譜生成提示詞的可變部分（說明和 JSON 結構在 RECIPE_PROMPT 的固定前綴中）"""
+        ingredients = list(dict.fromkeys(str(item).strip() for item in available_ingredients or []))
+        ingredients = [item for item in ingredients if item]
+        return RECIPE_PROMPT.render(
+            f"可用食材: {', '.join(ingredients)}" if ingredients else None,
+            f"烹飪時間限制: 不超過 {cooking_time_limit} 分鐘" if cooking_time_limit else None,
+            dish_name=dish_name,
+            difficulty=difficulty,
+            servings=servings
+        )
+    
+    def _generate(self, prompt: str, task_type: str) -> Dict:
+        """
+        用當前服務生成內容
         
-        return prompt
+        啟用對沖時，主後端超過其 p95 延遲仍未回應（或返回錯誤）就同時請求備用後端，
+        先返回完整結果的一方勝出。
+        """
+        target = self._hedge_target(task_type)
+        if target is None:
+            return self._generate_direct(prompt, task_type)
+        primary_name, backup_name, backup, candidates = target
+        return self.hedger.run(
+            (primary_name, partial(self._generate_direct, prompt, task_type)),
+            (backup_name, partial(backup._generate_direct, prompt, task_type, candidates)),
+            is_complete_result
+        )
     
-    def _generate_with_openai(self, prompt: str, task_type: str) -> Dict:
-        """使用 OpenAI API 生成內容"""
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "你是一位專業的廚師和營養師，提供詳細準確的菜譜和烹飪建議。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            content = response.choices[0].message.content
-            
-            # 嘗試解析 JSON
-            try:
-                import re
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group())
-            except:
-                pass
-            
-            return {"raw_response": content}
+    def _generate_direct(self, prompt: str, task_type: str, candidates: Optional[List[str]] = None) -> Dict:
+        backend = self._backend()
+        if backend is None:
+            return self._generate_with_local(prompt, task_type)
+        return self._generate_with(backend, prompt, task_type, candidates)
+    
+    def _hedge_target(self, task_type: str):
+        """
+        對沖的目標
         
-        except APIError as e:
-            return {"error": f"OpenAI API 錯誤: {str(e)}"}
+        Returns:
+        --------
+        tuple or None
+            (主後端名稱, 備用後端名稱, 備用顧問, 備用模型列表)；
+            未啟用或沒有可用的備用後端時為 None
+        """
+        backend = self._backend()
+        if self.hedger is None or backend is None:
+            return None
+        primary_name = f"{backend.name}:{backend.model_key()}:{task_type}"
+        backup = self.hedge_advisor
+        backup_backend = backup._backend() if backup is not None else None
+        if backup_backend is not None:
+            backup_name = f"{backup_backend.name}:{backup_backend.model_key()}:{task_type}"
+            return primary_name, backup_name, backup, None
+        # 同一服務內從下一個模型開始（路由器仍會跳過不健康的模型）
+        candidates = backend.alternate_models()
+        if candidates:
+            return primary_name, f"{backend.name}:{','.join(candidates)}:{task_type}", self, candidates
+        return None
+    
+    def _generation_request(self,
+                            prompt: str,
+                            task_type: str,
+                            candidates: Optional[List[str]] = None) -> CompletionRequest:
+        """結構化生成（菜譜、建議、健康建議）的請求：任務模板的固定前綴 + 可變部分"""
+        template = TEMPLATES[task_type]
+        return CompletionRequest(
+            prompt=prompt,
+            system=template.prefix,
+            max_tokens=2000,
+            json_mode=True,
+            models=candidates,
+            cache_key=template.name
+        )
     
-    def _generate_with_gemini(self, prompt: str, task_type: str) -> Dict:
-        """使用 Google Gemini API 生成內容"""
+    @traced("generate")
+    def _generate_with(self,
+                       backend: Backend,
+                       prompt: str,
+                       task_type: str,
+                       candidates: Optional[List[str]] = None) -> Dict:
+        """使用指定後端生成內容並解析為結構化結果"""
+        note_service(backend.name)
         try:
-            # 檢查 API Key
-            if not self.api_key:
-                return {"error": "❌ 未設置 GEMINI_API_KEY\n\n請在 .env 文件中添加：\nGEMINI_API_KEY=your_api_key_here\n\n獲取 API Key: https://ai.google.dev"}
-            
-            # 嘗試最新的穩定 Gemini 模型（2025年最新版本）
-            models_to_try = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-pro']
-            
-            for model_name in models_to_try:
-                try:
-                    model = genai.GenerativeModel(model_name)
-                    response = model.generate_content(prompt)
-                    
-                    content = response.text
-                    
-                    # 嘗試解析 JSON
-                    try:
-                        import re
-                        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                        if json_match:
-                            return json.loads(json_match.group())
-                    except:
-                        pass
-                    
-                    return {"raw_response": content}
-                except Exception as model_error:
-                    # 嘗試下一個模型
-                    continue
-            
-            return {"error": "❌ 所有 Gemini 模型都不可用\n請檢查：\n1. API Key 是否正確\n2. 網路連接\n3. 服務狀態"}
-        
+            content = backend.complete(self, self._generation_request(prompt, task_type, candidates))
         except Exception as e:
-            return {"error": f"❌ Gemini API 錯誤: {str(e)}"}
+            # 服務中斷時改用本地模型：格式相同但質量較低，標記後不進入緩存
+            fallback = self._local_backend(exclude=backend)
+            if fallback is not None:
+                note_fallback()
+                return dict(self._generate_with(fallback, prompt, task_type), degraded=fallback.name)
+            return {"error": f"❌ 生成出錯: {describe_error(backend, e)}"}
+        
+        return parse_structured(content, task_type)
     
+    @traced("generate", "local")
     def _generate_with_local(self, prompt: str, task_type: str) -> Dict:
-        """本地生成（回退方案）"""
+        """沒有任何可用後端（包括本地模型）時的回退：提示配置服務"""
         return {
             "error": "未配置 AI 服務",
-            "message": "請設置 OPENAI_API_KEY 或 GEMINI_API_KEY",
+            "message": "請設置 OPENAI_API_KEY 或 GEMINI_API_KEY，或用 AI_CHEF_LOCAL_MODEL_PATH 指定本地模型",
             "hint": "可在 .env 文件中設置 API 金鑰"
         }
     
     # ==================== 圖片識別 ====================
     
+    @traced("identify")
     def identify_dish_from_image(self, image_path: str) -> Dict:
         """
         從圖片識別菜品
@@ -253,165 +551,138 @@ class AIChefAdvisor:
         if not os.path.exists(image_path):
             return {"error": "圖片文件不存在"}
         
-        # 提取圖片特徵進行分析
-        image_features = self._extract_image_features(image_path)
+        backend = self._vision_backend()
+        if backend is None:
+            # 只有本地分析才需要解碼圖片提取特徵
+            return self._identify_with_local(self._extract_image_features(image_path))
         
-        if self.use_service == "openai" and OPENAI_AVAILABLE:
-            return self._identify_with_openai(image_path)
-        elif self.use_service == "gemini" and GEMINI_AVAILABLE:
-            return self._identify_with_gemini(image_path)
-        else:
-            return self._identify_with_local(image_features)
-    
-    def _identify_with_openai(self, image_path: str) -> Dict:
-        """使用 OpenAI Vision API 識別圖片"""
-        try:
-            with open(image_path, "rb") as image_file:
-                image_data = base64.standard_b64encode(image_file.read()).decode("utf-8")
-            
-            # 確定圖片類型
-            ext = Path(image_path).suffix.lower()
-            media_type = "image/jpeg" if ext in [".jpg", ".jpeg"] else f"image/{ext[1:]}"
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4-vision-preview",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """分析這張美食圖片，請返回以下信息（使用 JSON 格式，語言為繁體中文）：
-{
-    "菜品名稱": ["可能的菜名1", "可能的菜名2", ...],
-    "置信度": [0.95, 0.87, ...],
-    "食材分析": ["食材1", "食材2", ...],
-    "烹飪方式": "推測的烹飪方式",
-    "難度評估": "簡單/中等/難",
-    "營養特點": ["特點1", "特點2", ...],
-    "烹飪建議": "基於這道菜的烹飪建議",
-    "相似菜品": ["相似菜品1", "相似菜品2", ...]
-}"""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{media_type};base64,{image_data}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1024
-            )
-            
-            content = response.choices[0].message.content
-            
-            # 嘗試解析 JSON
-            try:
-                import re
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group())
-            except:
-                pass
-            
-            return {"raw_response": content}
+        # 同一張照片重新保存、裁剪或壓縮後再次上傳時直接復用結果
+        image_hash = self._image_hash(image_path)
+        cached = self._cached_identification(image_hash)
+        if cached is not None:
+            return cached
         
-        except APIError as e:
+        try:
+            image = prepare_image_bytes(image_path)
+        except Exception as e:
             return {"error": f"圖片識別失敗: {str(e)}"}
+        result = self._identify_with(backend, image)
+        
+        self._remember_identification(image_hash, result)
+        return result
+    
+    def _vision_backend(self) -> Optional[Backend]:
+        """支持圖片輸入的當前後端；沒有時為 None（使用本地特徵識別）"""
+        backend = self._backend()
+        return backend if backend is not None and backend.supports(VISION) else None
     
-    def _identify_with_gemini(self, image_path: str) -> Dict:
-        """使用 Google Gemini Vision API 識別圖片"""
+    def _image_hash(self, image_path: str) -> Optional[int]:
+        """圖片的感知雜湊（從本地特徵使用的同一張縮略圖計算）"""
+        if self.image_cache is None:
+            return None
         try:
-            # 嘗試支持視覺功能的 Gemini 模型
-            models_to_try = ['gemini-2.5-flash', 'gemini-1.5-flash', 'gemini-pro-vision', 'gemini-pro']
-            
-            image = Image.open(image_path)
-            
-            prompt = """分析這張美食圖片，請返回以下信息（使用 JSON 格式，語言為繁體中文）：
-{
-    "菜品名稱": ["可能的菜名1", "可能的菜名2", ...],
-    "置信度": [0.95, 0.87, ...],
-    "食材分析": ["食材1", "食材2", ...],
-    "烹飪方式": "推測的烹飪方式",
-    "難度評估": "簡單/中等/難",
-    "營養特點": ["特點1", "特點2", ...],
-    "烹飪建議": "基於這道菜的烹飪建議",
-    "相似菜品": ["相似菜品1", "相似菜品2", ...]
-}"""
-            
-            for model_name in models_to_try:
-                try:
-                    model = genai.GenerativeModel(model_name)
-                    response = model.generate_content([prompt, image])
-                    
-                    content = response.text
-                    
-                    # 嘗試解析 JSON
-                    try:
-                        import re
-                        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                        if json_match:
-                            return json.loads(json_match.group())
-                    except:
-                        pass
-                    
-                    return {"raw_response": content}
-                
-                except Exception as model_error:
-                    # 嘗試下一個模型
-                    continue
-            
-            return {"error": "所有 Gemini Vision 模型都不可用"}
-        
+            return phash(load_thumbnail(image_path))
+        except Exception:
+            return None
+    
+    def _vision_namespace(self) -> str:
+        """圖片識別結果的緩存命名空間（不同服務/模型的結果互不復用）"""
+        backend = self._vision_backend()
+        if backend is None:
+            return "local"
+        return f"{backend.name}:{backend.model_key(vision=True)}:{IMAGE_PROMPT.fingerprint}"
+    
+    def _cached_identification(self, image_hash: Optional[int]) -> Optional[Dict]:
+        if self.image_cache is None or image_hash is None:
+            return None
+        cached = self.image_cache.get(self._vision_namespace(), image_hash)
+        note(cache="miss" if cached is None else "hit")
+        return cached
+    
+    def _remember_identification(self, image_hash: Optional[int], result: Dict):
+        if self.image_cache is not None and image_hash is not None and is_complete_result(result):
+            self.image_cache.set(self._vision_namespace(), image_hash, result)
+    
+    @staticmethod
+    def _vision_request(image: Tuple[bytes, str]) -> CompletionRequest:
+        """圖片識別的請求；image 為已縮小到模型解析度的 (圖片字節, MIME 類型)"""
+        return CompletionRequest(
+            prompt=IMAGE_PROMPT.prefix,
+            image=image,
+            max_tokens=1024,
+            json_mode=True,
+            temperature=None,
+            cache_key=IMAGE_PROMPT.name
+        )
+    
+    @traced("identify")
+    def _identify_with(self, backend: Backend, image: Tuple[bytes, str]) -> Dict:
+        """使用指定後端識別圖片"""
+        note_service(backend.name)
+        try:
+            content = backend.complete(self, self._vision_request(image))
         except Exception as e:
-            return {"error": f"圖片識別失敗: {str(e)}"}
+            return {"error": f"圖片識別失敗: {describe_error(backend, e)}"}
+        
+        return parse_structured(content, "vision")
     
+    @traced("identify", "local")
     def _identify_with_local(self, image_features: Dict) -> Dict:
-        """本地圖片識別（基於視覺特徵）"""
-        return {
-            "菜品名稱": ["番茄炒雞蛋", "清蒸魚", "紅燒肉"],
-            "置信度": [0.78, 0.65, 0.52],
+        """本地圖片識別（在參考索引中查找顏色和紋理最相近的菜品）"""
+        if "error" in image_features:
+            return {"error": f"圖片識別失敗: {image_features['error']}"}
+        
+        try:
+            index = get_dish_index()
+        except Exception as e:
+            return {"error": f"本地參考索引載入失敗: {str(e)}"}
+        
+        result = {
+            "菜品名稱": [],
+            "置信度": [],
             "食材分析": list(image_features.get("dominant_colors", [])),
-            "烹飪方式": "炒/蒸/燉",
-            "難度評估": "中等",
-            "營養特點": ["豐富蛋白質", "含纖維"],
-            "烹飪建議": "基於圖片特徵的一般性烹飪建議",
-            "相似菜品": ["類似菜品1", "類似菜品2"],
-            "note": "使用本地特徵分析，建議配置 OpenAI 或 Gemini API 以獲得更精確的結果"
         }
+        if index is None:
+            result["note"] = "未找到本地參考索引，請先運行 python ai_chef_vision.py build <圖片目錄> 構建"
+            return result
+        
+        matches = index.search(image_features["vector"], top_k=5)
+        result["菜品名稱"] = [name for name, _, _ in matches[:3]]
+        result["置信度"] = [round(confidence, 2) for _, confidence, _ in matches[:3]]
+        result["相似菜品"] = [name for name, _, _ in matches[3:]]
+        result["note"] = "使用本地特徵分析，建議配置 OpenAI 或 Gemini API 以獲得更精確的結果"
+        return result
     
     def _extract_image_features(self, image_path: str) -> Dict:
         """提取圖片特徵"""
         try:
-            image = Image.open(image_path)
-            
-            # 轉換為 RGB
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # 提取主要顏色
-            image_small = image.resize((50, 50))
-            pixels = np.array(image_small).reshape(-1, 3)
+            with Image.open(image_path) as image:
+                size, mode = image.size, image.mode
             
-            # 計算平均顏色
-            avg_color = pixels.mean(axis=0)
-            
-            # 識別色調
-            hue = self._get_hue_description(avg_color)
-            
-            return {
-                "size": image.size,
-                "mode": image.mode,
-                "avg_color": avg_color.tolist(),
-                "hue": hue,
-                "dominant_colors": ["紅色" if hue == "red" else "其他色系"]
-            }
+            # JPEG 在解碼時直接縮小，只需要很小的縮略圖
+            features = self._features_from_thumbnail(load_thumbnail(image_path))
+            features.update(size=size, mode=mode)
+            return features
         
         except Exception as e:
             return {"error": str(e)}
     
+    def _features_from_thumbnail(self, thumbnail: np.ndarray) -> Dict:
+        """從 RGB 縮略圖計算本地識別所需的特徵"""
+        # 計算平均顏色
+        avg_color = thumbnail.reshape(-1, 3).mean(axis=0)
+        
+        # 識別色調
+        hue = self._get_hue_description(avg_color)
+        
+        return {
+            "avg_color": avg_color.tolist(),
+            "hue": hue,
+            "dominant_colors": dominant_color_names(thumbnail),
+            "thumbnail": thumbnail,
+            "vector": feature_vector(thumbnail)
+        }
+    
     def _get_hue_description(self, rgb: np.ndarray) -> str:
         """根據 RGB 值判斷色調"""
         r, g, b = rgb
@@ -427,6 +698,7 @@ class AIChefAdvisor:
     
     # ==================== 烹飪建議 ====================
     
+    @traced("advice")
     def get_cooking_advice(self, 
                           dish_name: str,
                           skill_level: str = "intermediate",
@@ -449,41 +721,33 @@ class AIChefAdvisor:
             烹飪建議
         """
         
-        prompt = f"""
-為一位{skill_level}級廚師提供 {dish_name} 的烹飪建議。
-"""
-        
-        if dietary_restrictions:
-            prompt += f"飲食限制: {', '.join(dietary_restrictions)}\n"
-        
-        prompt += """
-請返回 JSON 格式的建議，包含：
-{
-    "難度評估": "難度描述",
-    "關鍵技巧": ["技巧1", "技巧2", ...],
-    "常見錯誤": ["錯誤1", "錯誤2", ...],
-    "補救方案": ["補救方案1", "補救方案2", ...],
-    "時間管理": "時間分配建議",
-    "替代食材": ["替代食材1", "替代食材2", ...],
-    "個性化建議": "根據技能等級的具體建議"
-}
-"""
+        prompt = self._build_advice_prompt(dish_name, skill_level, dietary_restrictions)
         
-        if self.use_service == "openai" and OPENAI_AVAILABLE:
-            return self._generate_with_openai(prompt, "advice")
-        elif self.use_service == "gemini" and GEMINI_AVAILABLE:
-            return self._generate_with_gemini(prompt, "advice")
-        else:
-            return self._generate_with_local(prompt, "advice")
+        return self._generate(prompt, "advice")
+    
+    def _build_advice_prompt(self,
+                             dish_name: str,
+                             skill_level: str,
+                             dietary_restrictions: List[str]) -> str:
+        """構建烹飪建議提示詞的可變部分"""
+        return ADVICE_PROMPT.render(
+            f"飲食限制: {', '.join(dietary_restrictions)}" if dietary_restrictions else None,
+            dish_name=dish_name,
+            skill_level=skill_level
+        )
     
     # ==================== 營養分析 ====================
     
+    @traced("nutrition")
     def analyze_nutrition(self, 
                          ingredients: Dict[str, str],
                          servings: int = 1) -> Dict:
         """
         分析菜譜的營養成分
         
+        熱量、宏量和微量營養由本地食物成分表確定性地計算；
+        只有敘述性的健康建議才調用 AI 服務。
+        
         Parameters:
         -----------
         ingredients : dict
@@ -497,45 +761,33 @@ class AIChefAdvisor:
             營養分析結果
         """
         
-        ingredients_text = "\n".join([f"- {name}: {amount}" for name, amount in ingredients.items()])
+        result = analyze_ingredients(ingredients, servings)
+        prompt = self._build_health_advice_prompt(ingredients, result)
         
-        prompt = f"""
-分析以下食材組合的營養成分（{servings}人份）：
-
-{ingredients_text}
-
-請返回詳細的 JSON 營養分析：
-{{
-    "總熱量": "X kcal",
-    "宏量營養": {{
-        "蛋白質": "Xg",
-        "脂肪": "Xg",
-        "碳水化合物": "Xg"
-    }},
-    "微量營養": {{
-        "鈣": "mg",
-        "鐵": "mg",
-        "維生素C": "mg"
-    }},
-    "飲食適應": {{
-        "素食": true/false,
-        "無麩質": true/false,
-        "低脂": true/false
-    }},
-    "健康評分": "1-10分的評分",
-    "健康建議": ["建議1", "建議2", ...]
-}}
-"""
+        advice = self._generate(prompt, "health_advice") if self._active_service() != "local" else {}
         
-        if self.use_service == "openai" and OPENAI_AVAILABLE:
-            return self._generate_with_openai(prompt, "nutrition")
-        elif self.use_service == "gemini" and GEMINI_AVAILABLE:
-            return self._generate_with_gemini(prompt, "nutrition")
+        return self._merge_health_advice(result, advice)
+    
+    def _build_health_advice_prompt(self, ingredients: Dict[str, str], nutrition: Dict) -> str:
+        """構建健康建議提示詞的可變部分（營養數值已在本地計算好）"""
+        return HEALTH_ADVICE_PROMPT.render(
+            ingredients="\n".join(f"- {name}: {amount}" for name, amount in ingredients.items()),
+            facts=compact_json({key: nutrition[key] for key in ["每份熱量", "份量", "宏量營養", "微量營養", "飲食適應"]})
+        )
+    
+    @staticmethod
+    def _merge_health_advice(result: Dict, advice: Dict) -> Dict:
+        """把模型給出的健康建議併入本地計算結果，失敗時使用規則建議"""
+        suggestions = advice.get("健康建議")
+        if isinstance(suggestions, list) and suggestions and "schema_errors" not in advice:
+            result["健康建議"] = suggestions
         else:
-            return self._generate_with_local(prompt, "nutrition")
+            result["健康建議"] = rule_based_advice(result)
+        return result
     
     # ==================== 對話功能 ====================
     
+    @traced("chat")
     def chat(self, user_message: str) -> str:
         """
         與 AI 廚師進行對話
@@ -551,87 +803,173 @@ class AIChefAdvisor:
             AI 回應
         """
         
-        self.conversation_history.append({
-            "role": "user",
-            "content": user_message
-        })
+        semantic_namespace = self._chat_semantic_namespace()
+        cached = self._semantic_get(semantic_namespace, user_message, exact=True)
+        if cached is not None:
+            self._remember_turn(user_message, cached["content"])
+            return cached["content"]
         
-        if self.use_service == "openai" and OPENAI_AVAILABLE:
-            return self._chat_with_openai()
-        elif self.use_service == "gemini" and GEMINI_AVAILABLE:
-            return self._chat_with_gemini()
-        else:
+        backend = self._backend()
+        if backend is None:
             return self._chat_with_local()
+        # 請求用追加了用戶消息的副本構建；只有成功的回應才和用戶消息一起寫入記憶
+        pending = self.memory.with_message("user", user_message)
+        response = self._chat_with(backend, pending)
+        
+        if response.startswith("❌"):
+            # 服務中斷時用本地模型回答（不進入語義緩存）
+            fallback = self._local_backend(exclude=backend)
+            if fallback is None:
+                return response
+            note_fallback()
+            response = self._chat_with(fallback, pending)
+            if not response.startswith("❌"):
+                self._remember_turn(user_message, response)
+            return response
+        
+        self._remember_turn(user_message, response)
+        self._semantic_set(semantic_namespace, user_message, {"content": response})
+        return response
     
-    def _chat_with_openai(self) -> str:
-        """使用 OpenAI 進行對話"""
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                system="你是一位友善且知識豐富的廚師，幫助用戶解答烹飪相關問題。使用繁體中文回應。",
-                messages=self.conversation_history,
-                temperature=0.7,
-                max_tokens=512
-            )
-            
-            assistant_message = response.choices[0].message.content
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": assistant_message
-            })
-            
-            return assistant_message
-        
-        except APIError as e:
-            return f"❌ 對話出錯: {str(e)}"
+    def _remember_turn(self, user_message: str, assistant_message: str):
+        """把一輪成功的對話寫入記憶"""
+        self.memory.append("user", user_message)
+        self.memory.append("assistant", assistant_message)
+    
+    def _chat_request(self, memory: ConversationMemory) -> CompletionRequest:
+        """按對話記憶（已包含本輪用戶消息）構建的對話請求"""
+        return CompletionRequest(system=CHAT_PROMPT.prefix, memory=memory, max_tokens=512,
+                                 cache_key=CHAT_PROMPT.name)
     
-    def _chat_with_gemini(self) -> str:
-        """使用 Gemini 進行對話"""
+    @traced("chat")
+    def _chat_with(self, backend: Backend, memory: ConversationMemory) -> str:
+        """使用指定後端進行對話；出錯時返回以 ❌ 開頭的提示"""
+        note_service(backend.name)
         try:
-            # 檢查 API Key
-            if not self.api_key:
-                return "❌ 未設置 GEMINI_API_KEY\n請在 .env 文件中添加 API Key"
-            
-            # 嘗試最新的穩定 Gemini 模型（2025年最新版本）
-            models_to_try = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-pro']
-            
-            for model_name in models_to_try:
-                try:
-                    model = genai.GenerativeModel(model_name)
-                    
-                    response = model.generate_content(
-                        f"""你是一位友善且知識豐富的廚師，幫助用戶解答烹飪相關問題。使用繁體中文回應。
-用戶說: {self.conversation_history[-1]['content']}"""
-                    )
-                    
-                    assistant_message = response.text
-                    self.conversation_history.append({
-                        "role": "assistant",
-                        "content": assistant_message
-                    })
-                    
-                    return assistant_message
-                except Exception as model_error:
-                    # 嘗試下一個模型
-                    continue
-            
-            return "❌ 所有 Gemini 模型都不可用\n請檢查 API Key 和網路連接"
-        
+            return backend.complete(self, self._chat_request(memory))
         except Exception as e:
-            return f"❌ 對話出錯: {str(e)}"
+            return f"❌ 對話出錯: {describe_error(backend, e)}"
     
+    @traced("chat", "local")
     def _chat_with_local(self) -> str:
-        """本地對話（回退方案）"""
-        return "未配置 AI 服務。請設置 OPENAI_API_KEY 或 GEMINI_API_KEY 以使用 AI 功能。"
+        """沒有任何可用後端（包括本地模型）時的回退：提示配置服務"""
+        return "未配置 AI 服務。請設置 OPENAI_API_KEY 或 GEMINI_API_KEY（或本地模型 AI_CHEF_LOCAL_MODEL_PATH）以使用 AI 功能。"
+    
+    @traced("chat_stream")
+    def chat_stream(self, user_message: str) -> Iterator[str]:
+        """
+        與 AI 廚師進行流式對話
+        
+        Parameters:
+        -----------
+        user_message : str
+            用戶消息
+        
+        Yields:
+        -------
+        str
+            AI 回應的增量文本；完整回應在結束後加入對話歷史
+        """
+        
+        semantic_namespace = self._chat_semantic_namespace()
+        cached = self._semantic_get(semantic_namespace, user_message, exact=True)
+        if cached is not None:
+            self._remember_turn(user_message, cached["content"])
+            yield cached["content"]
+            return
+        
+        backend = self._backend()
+        note(service=self._active_service())
+        if backend is None:
+            yield self._chat_with_local()
+            return
+        pending = self.memory.with_message("user", user_message)
+        if not backend.supports(STREAMING):
+            response = self._chat_with(backend, pending)
+            if not response.startswith("❌"):
+                self._remember_turn(user_message, response)
+            yield response
+            return
+        
+        parts = []
+        try:
+            for delta in backend.stream(self, self._chat_request(pending)):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            # 還沒有輸出時改用本地模型回答（不進入語義緩存）；已輸出一部分時這一輪不寫入記憶
+            fallback = None if parts else self._local_backend(exclude=backend)
+            if fallback is None:
+                yield f"❌ 對話出錯: {describe_error(backend, e)}"
+                return
+            note_fallback()
+            response = self._chat_with(fallback, pending)
+            if not response.startswith("❌"):
+                self._remember_turn(user_message, response)
+            yield response
+            return
+        
+        response = "".join(parts)
+        self._remember_turn(user_message, response)
+        self._semantic_set(semantic_namespace, user_message, {"content": response})
+    
+    # ==================== 流式後端 ====================
+    
+    def _stream_text(self,
+                     backend: Optional[Backend],
+                     template: PromptTemplate,
+                     prompt: str,
+                     max_tokens: int,
+                     json_mode: bool = False) -> Iterator[str]:
+        """用指定後端流式生成單輪文本；後端不支持流式輸出時一次性返回，沒有後端時返回配置提示"""
+        note(service=backend.name if backend is not None else "local")
+        if backend is None:
+            yield json.dumps(self._generate_with_local(prompt, "recipe"), ensure_ascii=False)
+            return
+        
+        request = CompletionRequest(prompt=prompt, system=template.prefix, max_tokens=max_tokens,
+                                    json_mode=json_mode, cache_key=template.name)
+        if backend.supports(STREAMING):
+            yield from backend.stream(self, request)
+        else:
+            yield backend.complete(self, request)
     
     def clear_conversation(self):
         """清除對話歷史"""
-        self.conversation_history = []
+        self.memory.clear()
+    
+    def for_session(self, memory: Optional[ConversationMemory] = None) -> "AIChefAdvisor":
+        """
+        共用同一組緩存、連接池和路由器，但有自己對話記憶的顧問
+
+        適合多個用戶會話共享一個顧問：只有對話狀態是每個會話獨有的。
+        """
+        advisor = copy.copy(self)
+        advisor.memory = memory if memory is not None else ConversationMemory()
+        return advisor
+    
+    def model_health(self) -> Dict[str, Dict]:
+        """查看各模型的健康狀況（熔斷器狀態、延遲 EWMA、最近錯誤）"""
+        return self.router.snapshot()
+    
+    def backend_info(self) -> Dict[str, Dict]:
+        """已登記後端的能力、模型元數據和實測延遲"""
+        return self.backends.describe(self.router)
+    
+    def hedge_stats(self) -> Optional[Dict]:
+        """對沖請求的統計（未啟用時為 None）"""
+        return self.hedger.stats() if self.hedger else None
+    
+    def parse_stats(self) -> Dict[str, Dict]:
+        """查看各任務類型的 JSON 解析統計（包括失敗次數）"""
+        return get_parse_stats().snapshot()
 
 
 # ==================== 便利函數 ====================
 
-def init_ai_chef(api_key: Optional[str] = None, service: str = "auto") -> AIChefAdvisor:
+def init_ai_chef(api_key: Optional[str] = None,
+                 service: str = "auto",
+                 hedge: bool = DEFAULT_HEDGE_ENABLED) -> AIChefAdvisor:
     """
     初始化 AI 廚師顧問
     
@@ -640,7 +978,10 @@ def init_ai_chef(api_key: Optional[str] = None, service: str = "auto") -> AIChef
     api_key : str, optional
         API 金鑰
     service : str
-        服務選擇: "auto", "openai", "gemini", "local"
+        服務選擇: "auto", "openai", "gemini", "local_server", "llama_cpp", "local"
+    hedge : bool
+        是否啟用對沖請求（預設讀取 AI_CHEF_HEDGE）；另一個服務也配置了
+        API Key 時對沖到該服務，否則對沖到同一服務的下一個模型
     
     Returns:
     --------
@@ -649,12 +990,30 @@ def init_ai_chef(api_key: Optional[str] = None, service: str = "auto") -> AIChef
     """
     
     if service == "auto":
-        # 自動檢測可用服務
-        if OPENAI_AVAILABLE and os.getenv("OPENAI_API_KEY"):
-            service = "openai"
-        elif GEMINI_AVAILABLE and os.getenv("GEMINI_API_KEY"):
-            service = "gemini"
-        else:
-            service = "local"
+        # 自動檢測可用服務（按後端註冊表的登記順序）
+        service = detect_service()
     
-    return AIChefAdvisor(api_key=api_key, use_service=service)
+    return AIChefAdvisor(api_key=api_key, use_service=service, **hedge_options(service, hedge))
+
+
+def detect_service() -> str:
+    """第一個已配置 API Key（或服務地址）且依賴已安裝的服務，都沒有時為 "local" """
+    return get_backend_registry().detect(get_client_pool())
+
+
+def hedge_options(service: str, hedge: bool) -> Dict:
+    """
+    構建啟用對沖所需的 AIChefAdvisor 參數
+    
+    備用服務的顧問不使用緩存：結果由主顧問統一緩存和保存。
+    """
+    if not hedge or service == "local":
+        return {}
+    options = {"hedger": get_hedger()}
+    pool = get_client_pool()
+    for backup in get_backend_registry().backends():
+        if backup.name != service and backup.supports(TEXT) and backup.configured() and backup.available(pool):
+            backup_key = os.getenv(backup.key_env) if backup.key_env else None
+            options["hedge_advisor"] = AIChefAdvisor(api_key=backup_key, use_service=backup.name, use_cache=False)
+            break
+    return options
@@ -0,0 +1,338 @@
+"""
+AI 廚師顧問 - 對沖請求模組
+AI Chef Advisor - Hedged Requests Module
+
+主後端超過其 p95 延遲仍未回應（或很快就失敗）時，向備用服務或備用模型
+發出一個重複請求，先得到有效結果的一方勝出；
+異步版本中落敗的上游請求會被取消，同步版本的請求無法中斷，落敗的一方
+在後台跑完（仍消耗配額），跑完之前計入對沖預算；
+對沖請求的數量受預算限制，只用來削掉偶發的極慢請求
+"""
+
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+DEFAULT_HEDGE_ENABLED = os.getenv("AI_CHEF_HEDGE", "").strip().lower() in ("1", "true", "yes", "on")
+# 對沖請求數佔總請求數的上限
+DEFAULT_HEDGE_BUDGET = float(os.getenv("AI_CHEF_HEDGE_BUDGET", "0.1"))
+DEFAULT_HEDGE_QUANTILE = 0.95
+# 樣本不足時不按延遲對沖（只在主後端失敗時對沖）
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_LATENCY_WINDOW = 200
+MIN_HEDGE_DELAY = 0.5
+# 預算允許的連續對沖次數
+DEFAULT_HEDGE_BURST = 5.0
+
+# (後端名稱, 無參數的調用函數)
+Backend = Tuple[str, Callable[[], Any]]
+AsyncBackend = Tuple[str, Callable[[], Awaitable]]
+
+
+# ==================== 延遲統計 ====================
+
+class LatencyTracker:
+    """每個後端最近若干次成功請求的延遲"""
+
+    def __init__(self, window: int = DEFAULT_LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, backend: str, seconds: float):
+        """記錄一次延遲（秒）"""
+        with self._lock:
+            samples = self._samples.get(backend)
+            if samples is None:
+                samples = self._samples[backend] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def quantile(self, backend: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """延遲分位數；樣本數不足 min_samples 時返回 None"""
+        with self._lock:
+            samples = self._samples.get(backend)
+            if not samples or len(samples) < min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """每個後端的樣本數和 p50/p95"""
+        with self._lock:
+            backends = list(self._samples)
+        return {
+            backend: {
+                "samples": len(self._samples[backend]),
+                "p50": self.quantile(backend, 0.50),
+                "p95": self.quantile(backend, 0.95),
+            }
+            for backend in backends
+        }
+
+
+class HedgeBudget:
+    """
+    對沖預算
+
+    每個請求存入 ratio 個額度，每次對沖花費 1 個，額度最多累積 burst 個；
+    長期來看對沖請求數不超過總請求數的 ratio 倍。
+    """
+
+    def __init__(self, ratio: float = DEFAULT_HEDGE_BUDGET, burst: float = DEFAULT_HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self._credits = burst
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._credits = min(self.burst, self._credits + self.ratio)
+
+    def try_spend(self) -> bool:
+        """額度足夠時花費一個並返回 True"""
+        with self._lock:
+            if self._credits >= 1.0:
+                self._credits -= 1.0
+                return True
+            return False
+
+
+def _start(fn: Callable[[], Any]) -> Future:
+    """在新的守護線程中執行 fn（不佔用共享線程池，主請求不會因池滿而排隊）"""
+    future: Future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    # 沿用調用方的上下文，兩個後端的用量都記在同一條調用指標上
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+    return future
+
+
+# ==================== 對沖執行器 ====================
+
+class Hedger:
+    """按主後端的 p95 延遲決定何時向備用後端發出重複請求"""
+
+    def __init__(self,
+                 tracker: Optional[LatencyTracker] = None,
+                 budget: Optional[HedgeBudget] = None,
+                 quantile: float = DEFAULT_HEDGE_QUANTILE,
+                 min_samples: int = DEFAULT_MIN_SAMPLES,
+                 min_delay: float = MIN_HEDGE_DELAY):
+        """
+        初始化對沖執行器
+
+        Parameters:
+        -----------
+        tracker : LatencyTracker, optional
+            延遲統計，預設新建
+        budget : HedgeBudget, optional
+            對沖預算，預設為總請求數的 AI_CHEF_HEDGE_BUDGET（10%）
+        quantile : float
+            對沖截止時間使用的延遲分位數
+        min_samples : int
+            主後端至少有多少個延遲樣本才按延遲對沖
+        min_delay : float
+            對沖截止時間的下限（秒）
+        """
+        self.tracker = tracker or LatencyTracker()
+        self.budget = budget or HedgeBudget()
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        # 同步對沖中已被丟棄但仍在後台執行的請求數
+        self.abandoned = 0
+
+    def deadline(self, backend: str) -> Optional[float]:
+        """主後端在多少秒內未回應就發出對沖請求；樣本不足時為 None（不按延遲對沖）"""
+        latency = self.tracker.quantile(backend, self.quantile, self.min_samples)
+        if latency is None:
+            return None
+        return max(self.min_delay, latency)
+
+    def _count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _allow_hedge(self) -> bool:
+        # 丟棄後仍在跑的同步請求照樣佔用上游配額，未結束前不發出更多對沖
+        with self._lock:
+            saturated = self.abandoned >= self.budget.burst
+        if not saturated and self.budget.try_spend():
+            self._count("hedged")
+            return True
+        self._count("budget_denied")
+        return False
+
+    def _begin(self):
+        self._count("requests")
+        self.budget.deposit()
+
+    # ==================== 同步 ====================
+
+    def run(self,
+            primary: Backend,
+            secondary: Backend,
+            is_valid: Callable[[Any], bool]) -> Any:
+        """
+        執行主請求，必要時對沖到備用後端
+
+        主後端超過截止時間仍未回應，或返回了無效結果/拋出異常時，
+        在預算允許的情況下發出對沖請求；先返回有效結果的一方勝出。
+        同步請求無法中斷：落敗的請求在守護線程中繼續執行直到上游返回，
+        仍消耗配額和限速令牌，完成後結果被丟棄（其延遲仍計入統計）。
+        這些請求結束前計入 abandoned，數量達到預算的 burst 時不再發出新的對沖。
+
+        Parameters:
+        -----------
+        primary, secondary : tuple
+            (後端名稱, 無參數的調用函數)
+        is_valid : callable
+            判斷結果是否有效
+
+        Returns:
+        --------
+        Any
+            勝出的結果；都無效時返回主後端的結果（或拋出其異常）
+        """
+        self._begin()
+        futures = {self._launch(primary, is_valid): primary[0]}
+        done, _ = wait(list(futures), timeout=self.deadline(primary[0]))
+
+        primary_future = next(iter(futures))
+        if not done or not self._succeeded(primary_future, is_valid):
+            if self._allow_hedge():
+                futures[self._launch(secondary, is_valid)] = secondary[0]
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if self._succeeded(future, is_valid):
+                    if future is not primary_future:
+                        self._count("hedge_wins")
+                    for loser in pending:
+                        self._abandon(loser)
+                    return future.result()[0]
+
+        return primary_future.result()[0]
+
+    def _abandon(self, future: Future):
+        self._count("abandoned")
+        future.add_done_callback(lambda _: self._release_abandoned())
+
+    def _release_abandoned(self):
+        with self._lock:
+            self.abandoned -= 1
+
+    def _launch(self, backend: Backend, is_valid: Callable[[Any], bool]) -> Future:
+        name, fn = backend
+
+        def timed():
+            started = time.perf_counter()
+            value = fn()
+            latency = time.perf_counter() - started
+            if is_valid(value):
+                self.tracker.record(name, latency)
+            return value, latency
+
+        return _start(timed)
+
+    @staticmethod
+    def _succeeded(future: Future, is_valid: Callable[[Any], bool]) -> bool:
+        return future.exception() is None and is_valid(future.result()[0])
+
+    # ==================== 異步 ====================
+
+    async def run_async(self,
+                        primary: AsyncBackend,
+                        secondary: AsyncBackend,
+                        is_valid: Callable[[Any], bool]) -> Any:
+        """
+        run 的異步版本；落敗的請求會被取消
+
+        取消沿著調用鏈傳到上游：請求合併中沒有其他等待者時，
+        共享的上游請求隨之取消（見 AsyncSingleFlight），並發名額和限速隊列立即釋放。
+        """
+        self._begin()
+        primary_task = asyncio.ensure_future(primary[1]())
+        tasks = {primary_task: primary[0]}
+        started = {primary_task: time.perf_counter()}
+        try:
+            done, _ = await asyncio.wait([primary_task], timeout=self.deadline(primary[0]))
+            if not done or not self._task_succeeded(primary_task, is_valid):
+                if self._allow_hedge():
+                    hedge_task = asyncio.ensure_future(secondary[1]())
+                    tasks[hedge_task] = secondary[0]
+                    started[hedge_task] = time.perf_counter()
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not self._task_succeeded(task, is_valid):
+                        continue
+                    now = time.perf_counter()
+                    self.tracker.record(tasks[task], now - started[task])
+                    for loser in pending:
+                        # 被取消的請求只知道延遲的下限，仍記錄下來以免分位數被低估
+                        self.tracker.record(tasks[loser], now - started[loser])
+                    if task is not primary_task:
+                        self._count("hedge_wins")
+                    return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return primary_task.result()
+
+    @staticmethod
+    def _task_succeeded(task: asyncio.Future, is_valid: Callable[[Any], bool]) -> bool:
+        return not task.cancelled() and task.exception() is None and is_valid(task.result())
+
+    def stats(self) -> Dict:
+        """請求數、對沖數、對沖勝出數、預算拒絕數，以及各後端的延遲分位數"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "abandoned": self.abandoned,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+                "backends": self.tracker.snapshot(),
+            }
+
+
+# ==================== 進程級共享實例 ====================
+
+_default_hedger: Optional[Hedger] = None
+_default_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Hedger:
+    """獲取進程內共享的對沖執行器（延遲統計和預算跨會話共享）"""
+    global _default_hedger
+    with _default_hedger_lock:
+        if _default_hedger is None:
+            _default_hedger = Hedger()
+        return _default_hedger
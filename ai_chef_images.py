@@ -0,0 +1,136 @@
+"""
+AI 廚師顧問 - 圖片預處理模組
+AI Chef Advisor - Image Preprocessing Module
+
+上傳前的圖片處理：按 EXIF 方向擺正、縮小到視覺模型實際使用的解析度、
+以可控的 JPEG 質量重新編碼，避免把整張手機原圖 base64 內嵌進請求
+"""
+
+import io
+import os
+import base64
+from typing import Dict, Tuple
+
+from PIL import Image, ImageOps
+
+
+# 視覺模型實際處理的解析度：長邊不超過 2048、短邊不超過 768，
+# 超出部分在服務端也會被縮小，上傳只是浪費
+MAX_LONG_SIDE = int(os.getenv("AI_CHEF_IMAGE_MAX_LONG_SIDE", "2048"))
+MAX_SHORT_SIDE = int(os.getenv("AI_CHEF_IMAGE_MAX_SHORT_SIDE", "768"))
+JPEG_QUALITY = int(os.getenv("AI_CHEF_IMAGE_JPEG_QUALITY", "85"))
+
+# 小於此大小、尺寸和方向都合適的 JPEG/PNG 直接上傳原文件
+PASSTHROUGH_BYTES = 512 * 1024
+
+_EXIF_ORIENTATION = 0x0112
+_MEDIA_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+def _target_size(size: Tuple[int, int],
+                 max_long_side: int,
+                 max_short_side: int) -> Tuple[int, int]:
+    """按長邊和短邊上限等比縮小，不放大"""
+    width, height = size
+    scale = min(1.0,
+                max_long_side / max(width, height),
+                max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _needs_transpose(image: Image.Image) -> bool:
+    try:
+        return image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+    except Exception:
+        return False
+
+
+def load_image(image_path: str,
+               max_long_side: int = MAX_LONG_SIDE,
+               max_short_side: int = MAX_SHORT_SIDE) -> Image.Image:
+    """
+    讀取並擺正、縮小圖片
+
+    對 JPEG 使用 draft 模式在解碼時直接按 1/2、1/4、1/8 縮小，
+    大圖無需完整解碼。
+
+    Parameters:
+    -----------
+    image_path : str
+        圖片文件路徑
+    max_long_side, max_short_side : int
+        長邊和短邊上限
+
+    Returns:
+    --------
+    PIL.Image.Image
+        RGB 圖片
+    """
+    # 在 with 內完成解碼並返回與文件無關的圖片，批量處理時不會累積打開的文件句柄
+    with Image.open(image_path) as source:
+        target = _target_size(source.size, max_long_side, max_short_side)
+        if source.format == "JPEG" and target != source.size:
+            source.draft("RGB", target)
+
+        image = ImageOps.exif_transpose(source)
+        if image.mode in ("RGBA", "LA", "P"):
+            # 透明背景鋪白，避免轉 JPEG 時變成黑色
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        # exif_transpose 可能交換寬高，需重新計算
+        target = _target_size(image.size, max_long_side, max_short_side)
+        if target != image.size:
+            image = image.resize(target, Image.LANCZOS)
+        if image is source:
+            image = source.copy()
+    return image
+
+
+def prepare_image_bytes(image_path: str,
+                        max_long_side: int = MAX_LONG_SIDE,
+                        max_short_side: int = MAX_SHORT_SIDE,
+                        quality: int = JPEG_QUALITY) -> Tuple[bytes, str]:
+    """
+    準備上傳給視覺模型的圖片數據
+
+    已經足夠小的 JPEG/PNG 原樣返回；其餘圖片擺正、縮小並重新編碼為 JPEG。
+
+    Returns:
+    --------
+    tuple
+        (圖片字節, MIME 類型)
+    """
+    with Image.open(image_path) as probe:
+        media_type = _MEDIA_TYPES.get(probe.format)
+        fits = _target_size(probe.size, max_long_side, max_short_side) == probe.size
+        passthrough = (
+            media_type in ("image/jpeg", "image/png")
+            and fits
+            and not _needs_transpose(probe)
+            and os.path.getsize(image_path) <= PASSTHROUGH_BYTES
+        )
+
+    if passthrough:
+        with open(image_path, "rb") as f:
+            return f.read(), media_type
+
+    image = load_image(image_path, max_long_side, max_short_side)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue(), "image/jpeg"
+
+
+def to_data_url(data: bytes, media_type: str) -> str:
+    """把圖片字節轉為 OpenAI image_url 可用的 data URL"""
+    return f"data:{media_type};base64,{base64.standard_b64encode(data).decode('utf-8')}"
+
+
+def to_gemini_part(data: bytes, media_type: str) -> Dict:
+    """把圖片字節轉為 Gemini generate_content 可用的內容片段"""
+    return {"mime_type": media_type, "data": data}
+
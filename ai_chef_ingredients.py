@@ -0,0 +1,357 @@
+"""
+AI 廚師顧問 - 食材名稱索引模組
+AI Chef Advisor - Ingredient Name Index Module
+
+基於字符 n-gram 倒排索引的食材名稱模糊匹配：統一繁簡寫法、同義詞
+（番茄/西紅柿）和錯別字，把自由輸入的食材名稱規整為標準名稱，
+讓提示詞和響應緩存鍵在等價輸入下保持一致
+"""
+
+import re
+import csv
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_SYNONYM_SOURCE = str(Path(__file__).parent / "data" / "food_composition.csv")
+
+# 模糊匹配的最低相似度：三字名稱錯一字（0.67）不算匹配，否則 羊排骨 會被當成 排骨（豬排骨）；
+# 兩三個字的短名稱的錯別字由 IngredientIndex._correct_typo 按更嚴格的規則處理
+DEFAULT_MIN_SCORE = 0.75
+# 參與精排的候選數
+RERANK_CANDIDATES = 20
+# 切分時視為詞邊界的烹調動詞和連詞（單字食材名稱只在這些字旁邊才算獨立成詞）
+_SEGMENT_BOUNDARIES = frozenset("炒煮蒸燒燉煎炸烤拌滷燜涮爆燴熗焗煨醃燙熬和與及配加佐")
+
+
+# ==================== 繁簡轉換 ====================
+
+# 食材和烹飪常用字的簡體 → 繁體對照（每對前簡後繁）
+_SIMPLIFIED_TRADITIONAL = (
+    "鸡雞猪豬鱼魚虾蝦酱醬葱蔥萝蘿卜蔔姜薑面麵汤湯饭飯鸭鴨鹅鵝蚝蠔蛎蠣鳕鱈鲈鱸鲑鮭鲤鯉"
+    "鳗鰻带帶贝貝盐鹽笋筍莲蓮干乾丝絲条條块塊颗顆个個只隻头頭苹蘋柠檸蓝藍红紅绿綠黄黃"
+    "烧燒炖燉卤滷凉涼热熱冻凍鲜鮮软軟咸鹹麦麥饺餃馄餛饨飩馒饅饼餅龙龍凤鳳银銀针針鲍鮑"
+    "参參芦蘆荟薈枣棗杨楊榄欖马馬铃鈴莴萵苋莧荠薺荚莢蚕蠶肠腸腊臘熏燻烟煙鱿魷蚬蜆鳝鱔"
+    "鳅鰍鲫鯽鲢鰱鳙鱅鲳鯧鲭鯖鲔鮪枪槍罗羅吴吳蛏蟶浆漿优優酿釀绍紹兴興荞蕎谷穀杂雜粮糧"
+    "淀澱圆圓调調叶葉苏蘇莳蒔发發枫楓乌烏猕獼樱櫻兰蘭净淨无無锅鍋炉爐两兩"
+    "么麼丽麗鸽鴿鹌鵪鹑鶉鲨鯊鳖鱉蛳螄鳞鱗粤粵闽閩脍膾炝熗焖燜烩燴样樣谱譜"
+)
+# 菜單和手寫中常見的同音字和簡寫（每對前錯後對），用於兩字名稱的錯別字糾正
+_CONFUSABLE_CHARS = "旦蛋反飯采菜彩菜才菜交椒焦椒加茄玲鈴令鈴羅蘿卜蔔芹琴豆荳瓜刮"
+_CONFUSABLE = {(_CONFUSABLE_CHARS[i], _CONFUSABLE_CHARS[i + 1]) for i in range(0, len(_CONFUSABLE_CHARS), 2)}
+
+_TO_TRADITIONAL = str.maketrans({
+    _SIMPLIFIED_TRADITIONAL[i]: _SIMPLIFIED_TRADITIONAL[i + 1]
+    for i in range(0, len(_SIMPLIFIED_TRADITIONAL), 2)
+})
+
+
+def to_traditional(text: str) -> str:
+    """把食材名稱中的簡體字轉為繁體"""
+    return text.translate(_TO_TRADITIONAL)
+
+
+# ==================== 名稱清洗 ====================
+
+_NOTE_RE = re.compile(r"[（(\[【].*?[）)\]】]")
+_SPLIT_RE = re.compile(r"[\n,，、;；|/]+")
+_AMOUNT_RE = re.compile(r"\s*[\d½¼¾][\d./\s]*\s*[a-zA-Z一-鿿]{0,2}$")
+
+# 不改變食材本身的修飾詞
+_DESCRIPTORS = ("新鮮", "冷凍", "冷藏", "進口", "有機", "生的", "熟的",
+                "切片", "切絲", "切丁", "切塊", "切段", "切碎", "去皮", "去骨", "去籽", "少許", "適量")
+
+
+def clean_name(name: str) -> str:
+    """去掉括號註釋、空白和修飾詞，並轉為繁體"""
+    name = to_traditional(_NOTE_RE.sub("", str(name))).strip()
+    for word in _DESCRIPTORS:
+        name = name.replace(word, "")
+    return "".join(name.split()).casefold()
+
+
+def split_ingredient_text(text: str) -> List[str]:
+    """把多行或以逗號、頓號分隔的食材輸入拆成列表（去掉結尾的用量）"""
+    items = []
+    for item in _SPLIT_RE.split(text or ""):
+        item = _AMOUNT_RE.sub("", item.strip()).strip()
+        if item:
+            items.append(item)
+    return items
+
+
+def _grams(text: str) -> List[str]:
+    """單字加首尾補位的雙字 n-gram；短名稱靠單字也能召回"""
+    padded = f"\x02{text}\x03"
+    return list(dict.fromkeys(list(text) + [padded[i:i + 2] for i in range(len(padded) - 1)]))
+
+
+def _similarity(a: str, b: str) -> float:
+    """基於編輯距離的相似度（0-1），用於精排錯別字"""
+    if a == b:
+        return 1.0
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return 1.0 - previous[-1] / max(len(a), len(b))
+
+
+# ==================== 索引 ====================
+
+class IngredientIndex:
+    """
+    食材名稱的 n-gram 倒排索引
+
+    每個名稱（標準名或別名）拆成單字和雙字 n-gram，倒排表記錄含有該
+    n-gram 的名稱編號。查詢時合併查詢詞各 n-gram 的倒排表，按共有
+    n-gram 的 Dice 係數取前若干個候選，再用編輯距離精排。
+    """
+
+    def __init__(self, min_score: float = DEFAULT_MIN_SCORE):
+        self.min_score = min_score
+        self._names: List[str] = []
+        self._canonical: List[str] = []
+        self._gram_counts: List[int] = []
+        self._exact: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        self._frozen: Dict[str, np.ndarray] = {}
+        self._max_length = 0
+        self._chars: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, name: str, canonical: Optional[str] = None):
+        """加入一個名稱；canonical 為其標準名（預設為自身）"""
+        key = clean_name(name)
+        if not key or key in self._exact:
+            return
+        canonical = canonical or name
+        with self._lock:
+            entry_id = len(self._names)
+            self._names.append(key)
+            self._canonical.append(canonical)
+            grams = _grams(key)
+            self._gram_counts.append(len(grams))
+            self._exact[key] = entry_id
+            self._max_length = max(self._max_length, len(key))
+            self._chars.update(key)
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(entry_id)
+                self._frozen.pop(gram, None)
+
+    def add_synonyms(self, canonical: str, synonyms: Iterable[str]):
+        """加入一組同義詞"""
+        self.add(canonical, canonical)
+        for synonym in synonyms:
+            self.add(synonym, canonical)
+
+    @classmethod
+    def from_csv(cls, path: str = DEFAULT_SYNONYM_SOURCE, **options) -> "IngredientIndex":
+        """
+        從 name / aliases（以 | 分隔）欄位的 CSV 構建
+
+        只讀取真正的同義詞（aliases）；similar 欄位中營養相近但不同的食材（牛腩/牛肉、烏醋/醋）
+        只供營養估算使用，規整提示詞和緩存鍵時不能互相替換。
+        """
+        index = cls(**options)
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                index.add_synonyms(row["name"], [a for a in (row.get("aliases") or "").split("|") if a])
+        return index
+
+    # ==================== 查詢 ====================
+
+    def _posting(self, gram: str) -> Optional[np.ndarray]:
+        postings = self._frozen.get(gram)
+        if postings is None:
+            raw = self._postings.get(gram)
+            if raw is None:
+                return None
+            postings = self._frozen[gram] = np.array(raw, dtype=np.int32)
+        return postings
+
+    def _rank(self, key: str) -> List[Tuple[float, str, str]]:
+        """返回 [(相似度, 標準名, 命中的名稱), ...]，每個標準名只保留最佳名稱"""
+        entry_id = self._exact.get(key)
+        if entry_id is not None:
+            return [(1.0, self._canonical[entry_id], key)]
+
+        grams = _grams(key)
+        postings = [p for p in (self._posting(g) for g in grams) if p is not None]
+        if not postings:
+            return []
+        ids, shared = np.unique(np.concatenate(postings), return_counts=True)
+        counts = np.array([self._gram_counts[i] for i in ids])
+        dice = 2.0 * shared / (len(grams) + counts)
+        top = ids[np.argsort(-dice)[:RERANK_CANDIDATES]]
+
+        best: Dict[str, Tuple[float, str, str]] = {}
+        for entry_id in top:
+            candidate = self._names[entry_id]
+            canonical = self._canonical[entry_id]
+            score = _similarity(key, candidate)
+            current = best.get(canonical)
+            # 同分時優先保留作為查詢詞後綴的名稱（見 match）
+            if current is None or (score, key.endswith(candidate)) > (current[0], key.endswith(current[2])):
+                best[canonical] = (score, canonical, candidate)
+        return sorted(best.values(), key=lambda item: -item[0])
+
+    def search(self, name: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """
+        查找最相近的標準名
+
+        Returns:
+        --------
+        list
+            [(標準名, 相似度), ...]，按相似度從高到低排序，每個標準名只出現一次
+        """
+        key = clean_name(name)
+        if not key:
+            return []
+        return [(canonical, score) for score, canonical, _ in self._rank(key)[:limit]]
+
+    def match(self, name: str, partial: bool = False) -> Optional[str]:
+        """
+        返回名稱對應的標準名，找不到足夠相近的名稱時返回 None
+
+        中文複合詞的中心語在末尾：已知名稱是查詢詞的後綴時（豬五花肉 → 五花肉）
+        視為同一食材；出現在開頭或中間時（雞蛋餅 ⊃ 雞蛋）是另一種食物，不算匹配。
+
+        Parameters:
+        -----------
+        name : str
+            食材名稱
+        partial : bool
+            是否允許匹配名稱中包含的最長已知名稱（"雞蛋餅" → 雞蛋）；
+            營養估算可以接受，規整提示詞輸入時不應使用
+        """
+        key = clean_name(name)
+        if not key:
+            return None
+        for score, canonical, candidate in self._rank(key)[:3]:
+            if score < self.min_score:
+                break
+            if candidate in key and not key.endswith(candidate):
+                continue
+            return canonical
+        corrected = self._correct_typo(key)
+        if corrected is not None:
+            return corrected
+        if partial:
+            contained = [(len(n), i) for n, i in self._exact.items() if len(n) > 1 and n in key]
+            if contained:
+                return self._canonical[max(contained)[1]]
+        return None
+
+    def _correct_typo(self, key: str) -> Optional[str]:
+        """
+        兩三個字的名稱錯一個字時的糾正（編輯距離相似度只有 0.5–0.67，低於 min_score）
+
+        只接受長度相同、恰好一個字不同的名稱，且滿足其一：
+        錯字和正字是常見的同音字或簡寫（雞旦 → 雞蛋、青交 → 青椒）；
+        或名稱至少三個字、其餘字中有連續兩字完全相同，而錯字不出現在任何已知名稱中
+        （馬玲薯 → 馬鈴薯）。錯字本身是已知名稱的一部分時（羊排骨 的 羊、鴨蛋 的 鴨）
+        多半是另一種食材，不糾正；符合條件的標準名不止一個時也不糾正。
+        """
+        if not 2 <= len(key) <= 3:
+            return None
+        found = set()
+        for position, wrong in enumerate(key):
+            rest = key[:position] + key[position + 1:]
+            contiguous = len(key) == 3 and position != 1
+            for entry_id in self._candidates(key, position):
+                candidate = self._names[entry_id]
+                if len(candidate) != len(key) or candidate[:position] + candidate[position + 1:] != rest:
+                    continue
+                right = candidate[position]
+                if (wrong, right) in _CONFUSABLE or (contiguous and wrong not in self._chars):
+                    found.add(self._canonical[entry_id])
+        return found.pop() if len(found) == 1 else None
+
+    def _candidates(self, key: str, position: int) -> List[int]:
+        """與 key 除第 position 個字外都相同的名稱的候選（取其餘某個字的倒排表）"""
+        other = key[1] if position == 0 else key[0]
+        postings = self._posting(other)
+        return [] if postings is None else postings.tolist()
+
+    def segment(self, text: str) -> List[Tuple[str, bool]]:
+        """
+        正向最大匹配切分：已知食材名稱替換為標準名，其餘逐字輸出
+
+        單字名稱（蛋、魚、醋）只在獨立成詞時才替換為標準名：前後是文本邊界、
+        多字食材或烹調動詞/連詞（炒、燒、和）。"鴨蛋"、"烏醋" 這類未收錄的詞
+        保持原樣作為一個食材片段輸出，不會變成 雞蛋 和 醋。
+
+        Returns:
+        --------
+        list
+            [(片段, 是否為食材), ...]；"番茄炒蛋" → [("番茄", True), ("炒", False), ("雞蛋", True)]
+        """
+        text = to_traditional(str(text)).casefold()
+        matches, i = [], 0
+        while i < len(text):
+            for length in range(min(self._max_length, len(text) - i), 0, -1):
+                entry_id = self._exact.get(text[i:i + length])
+                if entry_id is not None:
+                    matches.append((text[i:i + length], self._canonical[entry_id]))
+                    i += length
+                    break
+            else:
+                matches.append((text[i], None))
+                i += 1
+
+        def delimits(position: int) -> bool:
+            if position < 0 or position >= len(matches):
+                return True
+            raw, canonical = matches[position]
+            return (canonical is not None and len(raw) > 1) or raw in _SEGMENT_BOUNDARIES
+
+        pieces = []
+        for position, (raw, canonical) in enumerate(matches):
+            if canonical is not None and (len(raw) > 1 or (delimits(position - 1) and delimits(position + 1))):
+                pieces.append((canonical, True))
+            elif canonical is not None and pieces and not pieces[-1][1] and not delimits(position - 1):
+                # 單字名稱是前一個字所在詞的詞尾（鴨蛋、烏醋）：整個詞作為未收錄的食材
+                pieces[-1] = (pieces[-1][0] + raw, True)
+            else:
+                pieces.append((raw, False))
+        return pieces
+
+    def normalize(self, name: str) -> str:
+        """規整單個食材名稱；找不到時返回清洗後的原名"""
+        return self.match(name) or to_traditional(str(name)).strip()
+
+
+_default_index: Optional[IngredientIndex] = None
+_default_index_lock = threading.Lock()
+
+
+def get_ingredient_index() -> IngredientIndex:
+    """獲取進程內共享的食材名稱索引"""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = IngredientIndex.from_csv()
+        return _default_index
+
+
+def normalize_ingredients(ingredients: Optional[Iterable[str]]) -> Optional[List[str]]:
+    """
+    規整食材列表：統一為標準名、去重並保持原順序
+
+    等價的輸入（西紅柿/番茄、鸡蛋/雞蛋）得到相同的列表，響應緩存因此更容易命中；
+    只做繁簡轉換和同義詞替換，規整結果用於緩存鍵和比較，提示詞中保留用戶的寫法。
+    """
+    if not ingredients:
+        return None
+    index = get_ingredient_index()
+    normalized = list(dict.fromkeys(index.normalize(item) for item in ingredients if str(item).strip()))
+    return normalized or None
@@ -0,0 +1,209 @@
+"""
+AI 廚師顧問 - 對話記憶模組
+AI Chef Advisor - Conversation Memory Module
+
+按 token 預算管理對話歷史：保留最近的對話窗口，較早的輪次增量折疊進滾動摘要，
+OpenAI 和 Gemini 後端使用同一份歷史
+"""
+
+import os
+import re
+import copy
+from typing import Callable, Dict, List, Optional
+
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("AI_CHEF_CHAT_TOKEN_BUDGET", "2000"))
+DEFAULT_SUMMARY_TOKENS = 300
+
+# 每條消息的固定開銷（角色標記等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 數
+
+    中日韓字符大約每字一個 token，其餘文本大約每 4 個字符一個 token。
+    只用於預算控制，不需要和服務端的計數完全一致。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _clip(text: str, limit: int) -> str:
+    """截取文本的開頭部分作為摘要"""
+    text = " ".join(text.split())
+    for sep in ["。", "！", "？", ". ", "\n"]:
+        index = text.find(sep)
+        if 0 < index < limit:
+            return text[:index + len(sep)].strip()
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def extractive_summarizer(summary: str, evicted: List[Dict]) -> str:
+    """
+    預設的摘要函數：把移出窗口的輪次濃縮成一行追加到已有摘要後
+
+    Parameters:
+    -----------
+    summary : str
+        當前摘要
+    evicted : list
+        剛移出窗口的消息
+
+    Returns:
+    --------
+    str
+        新的摘要
+    """
+    parts = []
+    for msg in evicted:
+        if msg["role"] == "user":
+            parts.append(f"用戶問：{_clip(msg['content'], 60)}")
+        else:
+            parts.append(f"廚師答：{_clip(msg['content'], 80)}")
+    line = "；".join(parts)
+    return f"{summary}\n- {line}" if summary else f"- {line}"
+
+
+class ConversationMemory:
+    """有 token 預算的對話記憶：最近對話窗口 + 滾動摘要"""
+
+    def __init__(self,
+                 max_tokens: int = DEFAULT_TOKEN_BUDGET,
+                 summary_max_tokens: int = DEFAULT_SUMMARY_TOKENS,
+                 min_recent_messages: int = 1,
+                 summarizer: Optional[Callable[[str, List[Dict]], str]] = None):
+        """
+        初始化對話記憶
+
+        Parameters:
+        -----------
+        max_tokens : int
+            窗口加摘要的 token 上限
+        summary_max_tokens : int
+            摘要的 token 上限，超出時丟棄最早的摘要行
+        min_recent_messages : int
+            無論預算如何都保留的最近消息數（至少保留當前的用戶消息）
+        summarizer : callable, optional
+            summarizer(舊摘要, 移出的消息) -> 新摘要；只處理新移出的消息，
+            因此摘要是增量更新的
+        """
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.min_recent_messages = min_recent_messages
+        self.summarizer = summarizer or extractive_summarizer
+
+        self.messages: List[Dict] = []
+        self.summary = ""
+        self._message_tokens: List[int] = []
+        self._summary_tokens = 0
+
+    # ==================== 讀寫 ====================
+
+    def append(self, role: str, content: str):
+        """追加一條消息，超出預算時把最早的輪次折疊進摘要"""
+        self.messages.append({"role": role, "content": content})
+        self._message_tokens.append(estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS)
+        self._compact()
+
+    def with_message(self, role: str, content: str) -> "ConversationMemory":
+        """
+        返回追加了一條消息的副本，本對象不變
+
+        對話請求用副本構建：回應成功後才把用戶消息和回應一起寫入記憶，
+        出錯時記憶中不會留下沒有回應的用戶消息。
+        """
+        pending = copy.copy(self)
+        pending.messages = list(self.messages)
+        pending._message_tokens = list(self._message_tokens)
+        pending.append(role, content)
+        return pending
+
+    def clear(self):
+        """清除全部歷史和摘要"""
+        self.messages = []
+        self.summary = ""
+        self._message_tokens = []
+        self._summary_tokens = 0
+
+    def token_count(self) -> int:
+        """當前窗口加摘要的估算 token 數"""
+        return sum(self._message_tokens) + self._summary_tokens
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    # ==================== 各後端的消息格式 ====================
+
+    def system_text(self, system_prompt: str) -> str:
+        """系統提示詞加上較早對話的摘要"""
+        if not self.summary:
+            return system_prompt
+        return f"{system_prompt}\n\n之前的對話摘要：\n{self.summary}"
+
+    def build_messages(self, system_prompt: str) -> List[Dict]:
+        """OpenAI chat.completions 格式的消息列表"""
+        return [{"role": "system", "content": self.system_text(system_prompt)}] + \
+            [dict(msg) for msg in self.messages]
+
+    def gemini_contents(self, system_prompt: str) -> List[Dict]:
+        """
+        Gemini generate_content 格式的多輪內容
+
+        系統提示詞和摘要放在第一條用戶消息前面（部分舊模型不支持
+        system_instruction）；連續的同角色消息會被合併以保持輪流順序。
+        """
+        contents: List[Dict] = []
+        for msg in self.messages:
+            role = "user" if msg["role"] == "user" else "model"
+            if contents and contents[-1]["role"] == role:
+                contents[-1]["parts"][0] += "\n" + msg["content"]
+            else:
+                contents.append({"role": role, "parts": [msg["content"]]})
+
+        prefix = self.system_text(system_prompt)
+        if contents and contents[0]["role"] == "user":
+            contents[0]["parts"][0] = f"{prefix}\n\n用戶說: {contents[0]['parts'][0]}"
+        else:
+            contents.insert(0, {"role": "user", "parts": [prefix]})
+        return contents
+
+    # ==================== 內部方法 ====================
+
+    def _compact(self):
+        """把超出預算的最早輪次移出窗口並增量更新摘要"""
+        while self.token_count() > self.max_tokens:
+            # 按整輪移出（用戶消息及其後的回應），保證窗口從用戶消息開始
+            turn_end = next(
+                (i for i in range(1, len(self.messages)) if self.messages[i]["role"] == "user"),
+                None
+            )
+            if turn_end is None or len(self.messages) - turn_end < self.min_recent_messages:
+                break
+            self._fold([self._pop_oldest() for _ in range(turn_end)])
+
+    def _pop_oldest(self) -> Dict:
+        self._message_tokens.pop(0)
+        return self.messages.pop(0)
+
+    def _fold(self, evicted: List[Dict]):
+        if not evicted:
+            return
+        summary = self.summarizer(self.summary, evicted)
+        lines = summary.split("\n")
+        # 摘要超出上限時丟棄最早的行
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        self.summary = "\n".join(lines)
+        self._summary_tokens = estimate_tokens(self.summary)
@@ -0,0 +1,509 @@
+"""
+AI 廚師顧問 - 調用指標模組
+AI Chef Advisor - Call Metrics Module
+
+記錄每次 AI 調用的耗時、首個片段延遲、token 用量、估算費用、實際使用的模型、
+回退次數、緩存命中和解析結果，分發到可插拔的輸出：內存直方圖
+（可導出 Prometheus 文本格式）和 JSONL 追蹤文件
+"""
+
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+import contextvars
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from ai_chef_router import classify_error
+from ai_chef_memory import estimate_tokens
+
+
+DEFAULT_TRACE_PATH = os.getenv("AI_CHEF_TRACE_PATH") or None
+
+# 耗時直方圖的桶邊界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# 每百萬 token 的美元價格 (輸入, 輸出)；按公開標價估算，可直接修改此表
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4-vision-preview": (10.00, 30.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-pro": (0.50, 1.50),
+    "gemini-pro-vision": (0.50, 1.50),
+}
+
+RECENT_EVENTS = 200
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Optional[float]:
+    """按 MODEL_PRICES 估算一次調用的費用（美元）；未知模型返回 None"""
+    model = model or ""
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        # 帶日期的模型版本（gpt-3.5-turbo-0125）按最長的前綴匹配
+        prefixes = [name for name in MODEL_PRICES if model.startswith(name)]
+        price = MODEL_PRICES[max(prefixes, key=len)] if prefixes else None
+    if price is None or (prompt_tokens is None and completion_tokens is None):
+        return None
+    return ((prompt_tokens or 0) * price[0] + (completion_tokens or 0) * price[1]) / 1_000_000
+
+
+# ==================== 單次調用記錄 ====================
+
+class CallTrace:
+    """一次調用的指標；調用過程中由各層逐步填寫"""
+
+    def __init__(self, operation: str, service: Optional[str] = None):
+        self.operation = operation
+        self.service = service
+        self.model: Optional[str] = None
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        # 提示詞中命中服務端前綴緩存的部分（OpenAI 提示詞緩存、Gemini 上下文緩存）
+        self.cached_prompt_tokens: Optional[int] = None
+        self.usage_estimated = False
+        self.fallback_attempts = 0
+        self.cache: Optional[str] = None
+        self.parsed: Optional[bool] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def add_usage(self,
+                  prompt_tokens: Optional[int],
+                  completion_tokens: Optional[int],
+                  cached_prompt_tokens: Optional[int] = None):
+        """累加 token 用量（對沖或重試可能產生多次上游調用）"""
+        with self._lock:
+            if prompt_tokens is not None:
+                self.prompt_tokens = (self.prompt_tokens or 0) + int(prompt_tokens)
+            if completion_tokens is not None:
+                self.completion_tokens = (self.completion_tokens or 0) + int(completion_tokens)
+            if cached_prompt_tokens is not None:
+                self.cached_prompt_tokens = (self.cached_prompt_tokens or 0) + int(cached_prompt_tokens)
+
+    def mark_first_token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def add_fallback(self):
+        with self._lock:
+            self.fallback_attempts += 1
+
+    def observe_result(self, result: Any):
+        """按返回值判斷解析結果和錯誤（後端把異常轉成了錯誤字典或 "❌" 開頭的文本）"""
+        if isinstance(result, dict):
+            self.parsed = not any(key in result for key in ("error", "raw_response", "schema_errors"))
+            if "error" in result and "raw_response" not in result:
+                self.error = self.error or classify_error(RuntimeError(str(result["error"])))
+        elif isinstance(result, str) and result.startswith("❌"):
+            self.error = self.error or classify_error(RuntimeError(result))
+
+    def to_event(self) -> Dict:
+        finished = time.perf_counter()
+        return {
+            "timestamp": time.time(),
+            "operation": self.operation,
+            "service": self.service,
+            "model": self.model,
+            "wall_seconds": round(finished - self.started, 4),
+            "ttft_seconds": round(self.first_token - self.started, 4) if self.first_token else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "usage_estimated": self.usage_estimated,
+            "cost_usd": estimate_cost(self.model, self.prompt_tokens, self.completion_tokens),
+            "fallback_attempts": self.fallback_attempts,
+            "cache": self.cache,
+            "parsed": self.parsed,
+            "error": self.error,
+        }
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("ai_chef_trace", default=None)
+
+
+def current_trace() -> Optional[CallTrace]:
+    """當前上下文中進行中的調用記錄"""
+    return _current_trace.get()
+
+
+def note(**fields):
+    """給當前調用記錄填寫欄位（不在記錄中時忽略）"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    for name, value in fields.items():
+        setattr(trace, name, value)
+
+
+def note_service(service: str):
+    """記錄使用的服務；已有服務名稱時不覆蓋（與 traced 的 service 參數一致）"""
+    trace = _current_trace.get()
+    if trace is not None and not trace.service:
+        trace.service = service
+
+
+def note_usage(model: Optional[str],
+               prompt_tokens: Optional[int],
+               completion_tokens: Optional[int],
+               cached_prompt_tokens: Optional[int] = None):
+    """記錄上游回應中的模型和 token 用量（cached_prompt_tokens 為命中前綴緩存的提示詞 token 數）"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    if model:
+        trace.model = model
+    trace.add_usage(prompt_tokens, completion_tokens, cached_prompt_tokens)
+
+
+def note_fallback():
+    """記錄一次換模型重試"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_fallback()
+
+
+# ==================== 輸出 ====================
+
+class MetricsSink:
+    """指標輸出的基類"""
+
+    def record(self, event: Dict):
+        raise NotImplementedError
+
+
+class InMemoryMetrics(MetricsSink):
+    """
+    內存中的直方圖和計數器，按 (操作, 服務, 模型) 分組
+
+    同時保留最近的若干條記錄，供調試面板顯示。
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, recent: int = RECENT_EVENTS):
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, str, str], Dict] = {}
+        self._recent: deque = deque(maxlen=recent)
+        self._lock = threading.Lock()
+
+    def _new_series(self) -> Dict:
+        return {
+            "calls": 0, "errors": {}, "cache": {}, "parsed": 0, "parse_failed": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cached_prompt_tokens": 0,
+            "cost_usd": 0.0, "fallback_attempts": 0,
+            "wall": [0] * (len(self.buckets) + 1), "wall_sum": 0.0,
+            "ttft": [0] * (len(self.buckets) + 1), "ttft_sum": 0.0, "ttft_count": 0,
+        }
+
+    def _bucket(self, seconds: float) -> int:
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                return i
+        return len(self.buckets)
+
+    def record(self, event: Dict):
+        labels = (event["operation"], event["service"] or "none", event["model"] or "none")
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = self._new_series()
+            series["calls"] += 1
+            series["wall"][self._bucket(event["wall_seconds"])] += 1
+            series["wall_sum"] += event["wall_seconds"]
+            if event["ttft_seconds"] is not None:
+                series["ttft"][self._bucket(event["ttft_seconds"])] += 1
+                series["ttft_sum"] += event["ttft_seconds"]
+                series["ttft_count"] += 1
+            if event["error"]:
+                series["errors"][event["error"]] = series["errors"].get(event["error"], 0) + 1
+            if event["cache"]:
+                series["cache"][event["cache"]] = series["cache"].get(event["cache"], 0) + 1
+            if event["parsed"] is True:
+                series["parsed"] += 1
+            elif event["parsed"] is False:
+                series["parse_failed"] += 1
+            series["prompt_tokens"] += event["prompt_tokens"] or 0
+            series["completion_tokens"] += event["completion_tokens"] or 0
+            series["cached_prompt_tokens"] += event.get("cached_prompt_tokens") or 0
+            series["cost_usd"] += event["cost_usd"] or 0.0
+            series["fallback_attempts"] += event["fallback_attempts"]
+            self._recent.append(event)
+
+    def recent(self) -> List[Dict]:
+        """最近的調用記錄（新的在前）"""
+        with self._lock:
+            return list(reversed(self._recent))
+
+    def _quantile(self, counts: List[int], q: float) -> Optional[float]:
+        """由直方圖估算分位數（返回所在桶的上界）"""
+        total = sum(counts)
+        if not total:
+            return None
+        target = q * total
+        running = 0
+        for i, count in enumerate(counts):
+            running += count
+            if running >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def summary(self) -> List[Dict]:
+        """每組的調用數、錯誤率、緩存命中率、解析成功率、延遲分位數、token 和費用"""
+        with self._lock:
+            rows = []
+            for (operation, service, model), s in sorted(self._series.items()):
+                cache_total = sum(s["cache"].values())
+                cache_hits = cache_total - s["cache"].get("miss", 0)
+                parse_total = s["parsed"] + s["parse_failed"]
+                rows.append({
+                    "operation": operation,
+                    "service": service,
+                    "model": model,
+                    "calls": s["calls"],
+                    "error_rate": sum(s["errors"].values()) / s["calls"],
+                    "cache_hit_rate": cache_hits / cache_total if cache_total else None,
+                    "parse_success_rate": s["parsed"] / parse_total if parse_total else None,
+                    "mean_seconds": s["wall_sum"] / s["calls"],
+                    "p50_seconds": self._quantile(s["wall"], 0.50),
+                    "p95_seconds": self._quantile(s["wall"], 0.95),
+                    "mean_ttft_seconds": s["ttft_sum"] / s["ttft_count"] if s["ttft_count"] else None,
+                    "prompt_tokens": s["prompt_tokens"],
+                    "completion_tokens": s["completion_tokens"],
+                    "cached_prompt_tokens": s["cached_prompt_tokens"],
+                    "cost_usd": round(s["cost_usd"], 6),
+                    "fallback_attempts": s["fallback_attempts"],
+                })
+            return rows
+
+    def prometheus_text(self) -> str:
+        """以 Prometheus 文本格式導出（可直接作為 /metrics 的響應或 textfile collector 的文件）"""
+        lines = []
+
+        def histogram(name: str, help_text: str, field: str, sum_field: str, count_field: Optional[str]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, s in sorted(self._series.items()):
+                base = _labels(labels)
+                running = 0
+                for bound, count in zip(self.buckets + (float("inf"),), s[field]):
+                    running += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{base},le="{le}"}} {running}')
+                lines.append(f"{name}_sum{{{base}}} {s[sum_field]}")
+                lines.append(f"{name}_count{{{base}}} {s[count_field] if count_field else running}")
+
+        def counter(name: str, help_text: str, rows: List[Tuple[str, float]]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{{{labels}}} {value}" for labels, value in rows)
+
+        with self._lock:
+            histogram("ai_chef_call_duration_seconds", "Wall time of AI calls", "wall", "wall_sum", None)
+            histogram("ai_chef_time_to_first_token_seconds", "Time to first streamed chunk",
+                      "ttft", "ttft_sum", "ttft_count")
+            series = sorted(self._series.items())
+            counter("ai_chef_calls_total", "AI calls", [(_labels(k), s["calls"]) for k, s in series])
+            counter("ai_chef_errors_total", "Failed AI calls by error type", [
+                (f'{_labels(k)},type="{kind}"', n) for k, s in series for kind, n in sorted(s["errors"].items())
+            ])
+            counter("ai_chef_cache_requests_total", "Cache lookups by result", [
+                (f'{_labels(k)},result="{kind}"', n) for k, s in series for kind, n in sorted(s["cache"].items())
+            ])
+            counter("ai_chef_parse_total", "Structured responses by parse result", [
+                (f'{_labels(k)},result="{result}"', s[field]) for k, s in series
+                for result, field in (("ok", "parsed"), ("failed", "parse_failed"))
+            ])
+            counter("ai_chef_tokens_total", "Tokens used", [
+                (f'{_labels(k)},type="{kind}"', s[f"{kind}_tokens"]) for k, s in series
+                for kind in ("prompt", "completion", "cached_prompt")
+            ])
+            counter("ai_chef_cost_usd_total", "Estimated cost in USD",
+                    [(_labels(k), round(s["cost_usd"], 6)) for k, s in series])
+            counter("ai_chef_fallback_attempts_total", "Model fallbacks",
+                    [(_labels(k), s["fallback_attempts"]) for k, s in series])
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            self._recent.clear()
+
+
+def _labels(labels: Tuple[str, str, str]) -> str:
+    operation, service, model = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in labels)
+    return f'operation="{operation}",service="{service}",model="{model}"'
+
+
+class JsonlTraceSink(MetricsSink):
+    """每次調用追加一行 JSON 到追蹤文件"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def record(self, event: Dict):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+# ==================== 指標記錄器 ====================
+
+class Metrics:
+    """把調用記錄分發到各個輸出"""
+
+    def __init__(self, sinks: Optional[List[MetricsSink]] = None):
+        """
+        初始化指標記錄器
+
+        Parameters:
+        -----------
+        sinks : list, optional
+            指標輸出，預設只有一個 InMemoryMetrics
+        """
+        self.sinks: List[MetricsSink] = list(sinks) if sinks is not None else [InMemoryMetrics()]
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink: MetricsSink):
+        with self._lock:
+            self.sinks.append(sink)
+
+    @property
+    def memory(self) -> Optional[InMemoryMetrics]:
+        """第一個內存輸出（調試面板使用）"""
+        return next((s for s in self.sinks if isinstance(s, InMemoryMetrics)), None)
+
+    def emit(self, trace: CallTrace):
+        event = trace.to_event()
+        with self._lock:
+            sinks = list(self.sinks)
+        for sink in sinks:
+            try:
+                sink.record(event)
+            except Exception:
+                # 指標輸出失敗不能影響業務調用
+                pass
+
+
+def traced(operation: str, service: Optional[str] = None):
+    """
+    記錄方法調用的裝飾器（支持普通函數、協程和生成器）
+
+    已在記錄中時（例如公開方法調用後端方法）不新建記錄，只補充服務名稱，
+    因此每次用戶請求只產生一條記錄。實例的 metrics 屬性決定輸出位置。
+    生成器的首個片段時間記為 TTFT；上游沒有報告用量時按輸出文本估算 token 數。
+    """
+    def decorate(fn: Callable) -> Callable:
+        def begin(instance) -> Tuple[Optional[CallTrace], Optional[Metrics]]:
+            active = _current_trace.get()
+            if active is not None:
+                if service and not active.service:
+                    active.service = service
+                return None, None
+            return CallTrace(operation, service), getattr(instance, "metrics", None) or get_metrics()
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(self, *args, **kwargs) -> Iterator:
+                trace, metrics = begin(self)
+                if trace is None:
+                    yield from fn(self, *args, **kwargs)
+                    return
+                generator = fn(self, *args, **kwargs)
+                output = []
+                try:
+                    while True:
+                        # 只在生成器內部執行時設置上下文，避免記錄洩漏到調用方
+                        token = _current_trace.set(trace)
+                        try:
+                            chunk = next(generator)
+                        except StopIteration:
+                            break
+                        finally:
+                            _current_trace.reset(token)
+                        trace.mark_first_token()
+                        output.append(chunk)
+                        yield chunk
+                except Exception as e:
+                    trace.error = classify_error(e)
+                    raise
+                finally:
+                    generator.close()
+                    text = "".join(output)
+                    if trace.completion_tokens is None and text:
+                        trace.completion_tokens = estimate_tokens(text)
+                        trace.usage_estimated = True
+                    try:
+                        # 菜譜流拼接後是 JSON，按字典判斷解析結果
+                        result = json.loads(text) if text.startswith("{") else text
+                    except ValueError:
+                        result = text
+                    trace.observe_result(result)
+                    metrics.emit(trace)
+            return generator_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def coroutine_wrapper(self, *args, **kwargs):
+                trace, metrics = begin(self)
+                if trace is None:
+                    return await fn(self, *args, **kwargs)
+                token = _current_trace.set(trace)
+                try:
+                    result = await fn(self, *args, **kwargs)
+                    trace.observe_result(result)
+                    return result
+                except Exception as e:
+                    trace.error = classify_error(e)
+                    raise
+                finally:
+                    _current_trace.reset(token)
+                    metrics.emit(trace)
+            return coroutine_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            trace, metrics = begin(self)
+            if trace is None:
+                return fn(self, *args, **kwargs)
+            token = _current_trace.set(trace)
+            try:
+                result = fn(self, *args, **kwargs)
+                trace.observe_result(result)
+                return result
+            except Exception as e:
+                trace.error = classify_error(e)
+                raise
+            finally:
+                _current_trace.reset(token)
+                metrics.emit(trace)
+        return wrapper
+
+    return decorate
+
+
+# ==================== 進程級共享實例 ====================
+
+_default_metrics: Optional[Metrics] = None
+_default_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """獲取進程內共享的指標記錄器（設置 AI_CHEF_TRACE_PATH 時同時寫入 JSONL 追蹤文件）"""
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            sinks: List[MetricsSink] = [InMemoryMetrics()]
+            if DEFAULT_TRACE_PATH:
+                sinks.append(JsonlTraceSink(DEFAULT_TRACE_PATH))
+            _default_metrics = Metrics(sinks)
+        return _default_metrics
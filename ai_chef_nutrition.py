@@ -0,0 +1,453 @@
+"""
+AI 廚師顧問 - 本地營養計算模組
+AI Chef Advisor - Local Nutrition Module
+
+確定性的營養分析：內置食物成分表（編譯為 NumPy 列式存儲）、用量解析
+（"200g"、"2顆"、"1湯匙"）、食材名稱匹配，以及向量化的每份營養計算。
+只有敘述性的健康建議才需要調用模型
+"""
+
+import os
+import re
+import csv
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ai_chef_ingredients import IngredientIndex
+
+
+DATA_DIR = Path(__file__).parent / "data"
+DEFAULT_FOOD_TABLE_CSV = str(DATA_DIR / "food_composition.csv")
+DEFAULT_FOOD_TABLE_CACHE = str(Path(__file__).parent / ".cache" / "food_table.npz")
+
+# 成分表的營養素欄位（每 100 克可食部分）
+NUTRIENT_COLUMNS = (
+    "energy_kcal", "protein_g", "fat_g", "carbs_g", "fiber_g",
+    "sodium_mg", "calcium_mg", "iron_mg", "vitamin_c_mg",
+)
+MACRO_LABELS = {"protein_g": "蛋白質", "fat_g": "脂肪", "carbs_g": "碳水化合物", "fiber_g": "膳食纖維"}
+MICRO_LABELS = {"calcium_mg": "鈣", "iron_mg": "鐵", "vitamin_c_mg": "維生素C", "sodium_mg": "鈉"}
+
+_COLUMN = {name: i for i, name in enumerate(NUTRIENT_COLUMNS)}
+
+# 營養估算的模糊匹配比規整提示詞輸入寬鬆：找到相近的食材總比沒有數據好（羊排骨 → 排骨）
+FUZZY_MIN_SCORE = 0.6
+
+
+# ==================== 用量解析 ====================
+
+# 質量單位（克）；台灣習慣 1 斤 = 600 克、1 兩 = 37.5 克
+MASS_UNITS = {
+    "mg": 0.001, "毫克": 0.001,
+    "g": 1.0, "克": 1.0, "公克": 1.0, "gram": 1.0, "grams": 1.0,
+    "kg": 1000.0, "公斤": 1000.0, "千克": 1000.0, "kilogram": 1000.0, "kilograms": 1000.0,
+    "斤": 600.0, "台斤": 600.0, "兩": 37.5,
+    "lb": 453.6, "lbs": 453.6, "磅": 453.6, "oz": 28.35, "盎司": 28.35,
+}
+
+# 容量單位（毫升），按密度 1 換算為克
+VOLUME_UNITS = {
+    "ml": 1.0, "毫升": 1.0, "cc": 1.0,
+    "l": 1000.0, "liter": 1000.0, "liters": 1000.0, "litre": 1000.0, "litres": 1000.0,
+    "公升": 1000.0, "升": 1000.0,
+    "湯匙": 15.0, "大匙": 15.0, "tbsp": 15.0, "tablespoon": 15.0, "tablespoons": 15.0,
+    "茶匙": 5.0, "小匙": 5.0, "tsp": 5.0, "teaspoon": 5.0, "teaspoons": 5.0,
+    "杯": 240.0, "cup": 240.0, "cups": 240.0, "gallon": 3785.0, "gallons": 3785.0,
+}
+
+# 計數單位的預設重量（克），成分表中有該食材的單位重量時優先使用
+COUNT_UNITS = {
+    "顆": 50.0, "個": 50.0, "粒": 1.0, "片": 10.0, "根": 50.0, "條": 100.0,
+    "支": 50.0, "塊": 50.0, "瓣": 4.0, "把": 100.0, "朵": 10.0, "隻": 200.0,
+    "尾": 100.0, "張": 8.0, "包": 200.0, "盒": 300.0, "罐": 150.0, "份": 100.0,
+    "棵": 60.0, "節": 200.0, "段": 100.0, "頭": 40.0, "碗": 200.0,
+}
+
+# 不精確的用量
+VAGUE_AMOUNTS = {"少許": 2.0, "少量": 2.0, "一點": 2.0, "一些": 5.0, "適量": 5.0, "酌量": 5.0}
+
+_UNIT_ALIASES = {"个": "個", "颗": "顆", "条": "條", "块": "塊", "只": "隻", "汤匙": "湯匙",
+                 "张": "張", "两": "兩", "节": "節", "头": "頭", "盒装": "盒",
+                 "slice": "片", "slices": "片", "clove": "瓣", "cloves": "瓣",
+                 "piece": "個", "pieces": "個", "pcs": "個", "can": "罐", "cans": "罐",
+                 "stalk": "根", "stalks": "根", "bunch": "把", "pack": "包", "packs": "包"}
+
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "兩": 2, "两": 2, "三": 3, "四": 4, "五": 5,
+              "六": 6, "七": 7, "八": 8, "九": 9}
+
+_UNITS = sorted(set(MASS_UNITS) | set(VOLUME_UNITS) | set(COUNT_UNITS) | set(_UNIT_ALIASES),
+                key=len, reverse=True)
+_NUMBER = r"(?:\d+(?:\.\d+)?(?:\s*/\s*\d+)?|[½¼¾]|[零一二兩两三四五六七八九十百半]+)"
+# 英文單位後面不能緊跟字母："1 large" 的 l 不是公升，"1 gallon" 的 g 不是克
+_UNIT_PATTERN = "|".join(re.escape(u) + ("(?![a-z])" if u.isascii() else "") for u in _UNITS)
+_QUANTITY_RE = re.compile(
+    rf"(?P<low>{_NUMBER})(?:\s*(?:-|~|～|至|到)\s*(?P<high>{_NUMBER}))?\s*"
+    rf"(?P<unit>{_UNIT_PATTERN})?(?P<half>半)?",
+    re.IGNORECASE
+)
+_NOTE_RE = re.compile(r"[（(\[【].*?[）)\]】]")
+
+
+def _parse_number(text: str) -> Optional[float]:
+    """解析阿拉伯數字、分數和中文數字"""
+    text = text.strip()
+    if text in ("½", "¼", "¾"):
+        return {"½": 0.5, "¼": 0.25, "¾": 0.75}[text]
+    if "/" in text:
+        numerator, denominator = text.split("/", 1)
+        return float(numerator) / float(denominator) if float(denominator) else None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+
+    if text == "半":
+        return 0.5
+    total, current = 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            current = _CN_DIGITS[ch]
+        elif ch == "十":
+            total += (current or 1) * 10
+            current = 0
+        elif ch == "百":
+            total += (current or 1) * 100
+            current = 0
+        else:
+            return None
+    return float(total + current)
+
+
+def parse_quantity(text: str, unit_grams: Optional[Dict[str, float]] = None) -> Optional[float]:
+    """
+    把用量描述換算成克數
+
+    Parameters:
+    -----------
+    text : str
+        用量，如 "200g"、"2顆"、"1湯匙"、"半個"、"2-3瓣"、"適量"
+    unit_grams : dict, optional
+        該食材各計數單位的重量（克），如 {"顆": 50}
+
+    Returns:
+    --------
+    float or None
+        克數；無法解析時返回 None
+    """
+    if text is None:
+        return None
+    text = _NOTE_RE.sub("", str(text)).strip().lower()
+    if not text:
+        return None
+    for word, grams in VAGUE_AMOUNTS.items():
+        if word in text:
+            return grams
+
+    match = _QUANTITY_RE.search(text)
+    if not match:
+        return None
+    low = _parse_number(match.group("low"))
+    high = _parse_number(match.group("high")) if match.group("high") else low
+    if low is None or high is None:
+        return None
+    amount = (low + high) / 2
+    if match.group("half"):
+        amount += 0.5
+
+    unit = match.group("unit")
+    if unit is None:
+        if re.match(r"\s*[a-z]", text[match.end():]):
+            # 數字後面是英文單詞而不是單位（"2 large eggs"）：按個數計
+            unit = "個"
+        else:
+            # 沒有單位的純數字按克計
+            return amount
+    unit = _UNIT_ALIASES.get(unit, unit)
+    if unit_grams and unit in unit_grams:
+        return amount * unit_grams[unit]
+    if unit in MASS_UNITS:
+        return amount * MASS_UNITS[unit]
+    if unit in VOLUME_UNITS:
+        return amount * VOLUME_UNITS[unit]
+    return amount * COUNT_UNITS[unit]
+
+
+# ==================== 食物成分表 ====================
+
+def _parse_unit_grams(text: str) -> Dict[str, float]:
+    units = {}
+    for item in filter(None, (text or "").split("|")):
+        unit, grams = item.split(":")
+        units[unit.strip()] = float(grams)
+    return units
+
+
+class FoodTable:
+    """
+    列式存儲的食物成分表
+
+    營養素是 (食材數, 營養素數) 的 float32 矩陣，一道菜的計算只需一次
+    矩陣乘法。CSV 源文件首次載入時編譯為 .npz，之後直接讀取二進制陣列。
+    """
+
+    def __init__(self,
+                 names: np.ndarray,
+                 nutrients: np.ndarray,
+                 vegetarian: np.ndarray,
+                 gluten: np.ndarray,
+                 alias_names: np.ndarray,
+                 alias_ids: np.ndarray,
+                 unit_ids: np.ndarray,
+                 unit_names: np.ndarray,
+                 unit_values: np.ndarray):
+        self.names = names
+        self.nutrients = nutrients.astype(np.float32)
+        self.vegetarian = vegetarian.astype(bool)
+        self.gluten = gluten.astype(bool)
+        self.alias_names = alias_names
+        self.alias_ids = alias_ids
+
+        self._aliases: Dict[str, int] = {str(a): int(i) for a, i in zip(alias_names, alias_ids)}
+        self._unit_grams: List[Dict[str, float]] = [{} for _ in range(len(names))]
+        for food_id, unit, grams in zip(unit_ids, unit_names, unit_values):
+            self._unit_grams[int(food_id)][str(unit)] = float(grams)
+        self._index = IngredientIndex(min_score=FUZZY_MIN_SCORE)
+        for alias, food_id in self._aliases.items():
+            self._index.add(alias, str(self.names[food_id]))
+        self._name_ids = {str(n): i for i, n in enumerate(names)}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # ==================== 載入 ====================
+
+    @classmethod
+    def from_csv(cls, path: str) -> "FoodTable":
+        """從 CSV 源文件構建"""
+        names, rows, vegetarian, gluten = [], [], [], []
+        alias_names, alias_ids = [], []
+        unit_ids, unit_names, unit_values = [], [], []
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for food_id, row in enumerate(csv.DictReader(f)):
+                names.append(row["name"])
+                rows.append([float(row[column]) for column in NUTRIENT_COLUMNS])
+                vegetarian.append(row["vegetarian"] == "1")
+                gluten.append(row["gluten"] == "1")
+                # 營養估算同時使用同義詞（aliases）和營養相近的食材（similar，如 牛腩 → 牛肉）
+                aliases = f"{row['aliases']}|{row.get('similar') or ''}".split("|")
+                for alias in [row["name"]] + [a for a in aliases if a]:
+                    alias_names.append(alias.strip())
+                    alias_ids.append(food_id)
+                for unit, grams in _parse_unit_grams(row["unit_grams"]).items():
+                    unit_ids.append(food_id)
+                    unit_names.append(unit)
+                    unit_values.append(grams)
+
+        return cls(
+            np.array(names), np.array(rows, dtype=np.float32),
+            np.array(vegetarian), np.array(gluten),
+            np.array(alias_names), np.array(alias_ids, dtype=np.int32),
+            np.array(unit_ids, dtype=np.int32), np.array(unit_names),
+            np.array(unit_values, dtype=np.float32),
+        )
+
+    @classmethod
+    def load(cls,
+             csv_path: str = DEFAULT_FOOD_TABLE_CSV,
+             cache_path: Optional[str] = DEFAULT_FOOD_TABLE_CACHE) -> "FoodTable":
+        """
+        載入成分表；編譯後的 .npz 比 CSV 新時直接讀取，否則重新編譯
+        """
+        if cache_path and os.path.exists(cache_path) and \
+                os.path.getmtime(cache_path) >= os.path.getmtime(csv_path):
+            try:
+                with np.load(cache_path, allow_pickle=False) as data:
+                    return cls(**{key: data[key] for key in data.files})
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        table = cls.from_csv(csv_path)
+        if cache_path:
+            try:
+                Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+                table.save(cache_path)
+            except OSError:
+                pass
+        return table
+
+    def save(self, path: str):
+        """保存為 .npz"""
+        unit_ids, unit_names, unit_values = [], [], []
+        for food_id, units in enumerate(self._unit_grams):
+            for unit, grams in units.items():
+                unit_ids.append(food_id)
+                unit_names.append(unit)
+                unit_values.append(grams)
+        np.savez(
+            path,
+            names=self.names, nutrients=self.nutrients,
+            vegetarian=self.vegetarian, gluten=self.gluten,
+            alias_names=self.alias_names, alias_ids=self.alias_ids,
+            unit_ids=np.array(unit_ids, dtype=np.int32), unit_names=np.array(unit_names),
+            unit_values=np.array(unit_values, dtype=np.float32),
+        )
+
+    # ==================== 查詢 ====================
+
+    def match(self, name: str) -> Optional[int]:
+        """
+        把食材名稱匹配到成分表條目
+
+        先精確匹配名稱和別名，再經食材名稱索引做繁簡、錯別字的模糊匹配，
+        最後查找名稱中包含的最長別名（"新鮮番茄" → 番茄，"雞蛋（打散）" → 雞蛋）。
+        """
+        name = _NOTE_RE.sub("", str(name)).strip()
+        if not name:
+            return None
+        food_id = self._aliases.get(name)
+        if food_id is not None:
+            return food_id
+        canonical = self._index.match(name, partial=True)
+        return self._name_ids.get(canonical) if canonical else None
+
+    def unit_grams(self, food_id: int) -> Dict[str, float]:
+        """該食材各計數單位的重量（克）"""
+        return self._unit_grams[food_id]
+
+
+_default_table: Optional[FoodTable] = None
+_default_table_lock = threading.Lock()
+
+
+def get_food_table() -> FoodTable:
+    """獲取進程內共享的食物成分表"""
+    global _default_table
+    with _default_table_lock:
+        if _default_table is None:
+            _default_table = FoodTable.load()
+        return _default_table
+
+
+# ==================== 營養計算 ====================
+
+def _flatten(ingredients: Dict) -> List[Tuple[str, str]]:
+    """展開按類別分組的材料（如 {"主料": {...}, "調料": {...}}）"""
+    items = []
+    for name, amount in ingredients.items():
+        if isinstance(amount, dict):
+            items.extend(_flatten(amount))
+        else:
+            items.append((str(name), "" if amount is None else str(amount)))
+    return items
+
+
+def _health_score(per_serving: np.ndarray) -> int:
+    """按能量來源比例、鈉和膳食纖維給出 1-10 分"""
+    energy = float(per_serving[_COLUMN["energy_kcal"]]) or 1.0
+    fat_ratio = per_serving[_COLUMN["fat_g"]] * 9 / energy
+    protein_ratio = per_serving[_COLUMN["protein_g"]] * 4 / energy
+    sodium = per_serving[_COLUMN["sodium_mg"]]
+
+    score = 10
+    if sodium > 1500:
+        score -= 3
+    elif sodium > 800:
+        score -= 2
+    if fat_ratio > 0.45:
+        score -= 3
+    elif fat_ratio > 0.35:
+        score -= 2
+    if protein_ratio < 0.10:
+        score -= 1
+    if per_serving[_COLUMN["fiber_g"]] < 3:
+        score -= 1
+    if energy > 900:
+        score -= 1
+    return int(max(1, min(10, score)))
+
+
+def analyze_ingredients(ingredients: Dict, servings: int = 1, table: Optional[FoodTable] = None) -> Dict:
+    """
+    計算食材組合的營養成分
+
+    Parameters:
+    -----------
+    ingredients : dict
+        食材及用量，可以按類別嵌套
+    servings : int
+        份量
+    table : FoodTable, optional
+        成分表，預設使用內置成分表
+
+    Returns:
+    --------
+    dict
+        與 analyze_nutrition 相同結構的營養分析（不含健康建議）；
+        宏量和微量營養為每份數值
+    """
+    table = table or get_food_table()
+    servings = max(1, int(servings or 1))
+
+    food_ids, grams, unmatched, unparsed = [], [], [], []
+    for name, amount in _flatten(ingredients):
+        food_id = table.match(name)
+        if food_id is None:
+            unmatched.append(name)
+            continue
+        weight = parse_quantity(amount, table.unit_grams(food_id))
+        if weight is None:
+            unparsed.append(f"{name}: {amount}")
+            continue
+        food_ids.append(food_id)
+        grams.append(weight)
+
+    ids = np.array(food_ids, dtype=np.int64)
+    weights = np.array(grams, dtype=np.float64)
+    totals = (weights / 100.0) @ table.nutrients[ids].astype(np.float64) \
+        if len(ids) else np.zeros(len(NUTRIENT_COLUMNS))
+    per_serving = totals / servings
+
+    energy = float(per_serving[_COLUMN["energy_kcal"]])
+    fat_ratio = per_serving[_COLUMN["fat_g"]] * 9 / energy if energy else 0.0
+    result = {
+        "總熱量": f"{totals[_COLUMN['energy_kcal']]:.0f} kcal",
+        "每份熱量": f"{energy:.0f} kcal",
+        "份量": f"{servings}人份",
+        "宏量營養": {label: f"{per_serving[_COLUMN[key]]:.1f}g" for key, label in MACRO_LABELS.items()},
+        "微量營養": {label: f"{per_serving[_COLUMN[key]]:.1f}mg" for key, label in MICRO_LABELS.items()},
+        "飲食適應": {
+            "素食": bool(table.vegetarian[ids].all()) if len(ids) else False,
+            "無麩質": not bool(table.gluten[ids].any()) if len(ids) else False,
+            "低脂": bool(fat_ratio < 0.30),
+        },
+        "健康評分": f"{_health_score(per_serving)}/10" if len(ids) else "無法評分",
+        "計算方式": "本地食物成分表（宏量與微量營養為每份數值）",
+    }
+    if unmatched:
+        result["未識別食材"] = unmatched
+    if unparsed:
+        result["未解析用量"] = unparsed
+    return result
+
+
+def rule_based_advice(result: Dict) -> List[str]:
+    """不調用模型時，根據計算結果給出的健康建議"""
+    def value(section: str, label: str) -> float:
+        return float(result[section][label].rstrip("gm"))
+
+    advice = []
+    if value("微量營養", "鈉") > 800:
+        advice.append("每份鈉含量偏高，可減少鹽、醬油等調味料的用量")
+    energy = float(result["每份熱量"].split()[0]) or 1.0
+    if value("宏量營養", "脂肪") * 9 / energy > 0.35:
+        advice.append("脂肪供能比例偏高，可減少用油或改用瘦肉")
+    if value("宏量營養", "膳食纖維") < 3:
+        advice.append("膳食纖維不足，建議搭配蔬菜或全穀類")
+    if value("宏量營養", "蛋白質") * 4 / energy < 0.10:
+        advice.append("蛋白質偏少，可加入蛋、豆腐或瘦肉")
+    if not advice:
+        advice.append("營養比例均衡，注意控制份量即可")
+    return advice
@@ -0,0 +1,277 @@
+"""
+AI 廚師顧問 - 結構化輸出解析模組
+AI Chef Advisor - Structured Output Parsing Module
+
+從模型回應中穩健地提取 JSON：代碼圍欄剝離、平衡括號掃描、寬鬆修復，
+並按任務類型（菜譜/建議/營養/圖片識別/健康建議）做結構校驗，解析失敗會被計數
+"""
+
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+# 預編譯的正則表達式
+_FENCE_RE = re.compile(r"```[a-zA-Z]*\s*\n?(.*?)```", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+_ELLIPSIS_ITEM_RE = re.compile(r",\s*(?:\.\.\.|…)(\s*[}\]])")
+_LINE_COMMENT_RE = re.compile(r"^\s*//.*$", re.MULTILINE)
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PY_LITERAL_RE = re.compile(r"(?<![\w\"])(True|False|None)(?![\w\"])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "＂": '"'})
+
+
+# 各任務類型的必需欄位及其類型
+TASK_SCHEMAS: Dict[str, Dict[str, tuple]] = {
+    "recipe": {
+        "菜名": (str,),
+        "材料": (dict, list),
+        "步驟": (list,),
+    },
+    "advice": {
+        "關鍵技巧": (list,),
+    },
+    "nutrition": {
+        "總熱量": (str, int, float),
+        "宏量營養": (dict,),
+    },
+    "vision": {
+        "菜品名稱": (list,),
+    },
+    "health_advice": {
+        "健康建議": (list,),
+    },
+}
+
+# 可以從單個值自動包裝成列表的欄位
+_LIST_FIELDS = {"步驟", "烹飪技巧", "健康提示", "搭配建議", "關鍵技巧", "常見錯誤",
+                "補救方案", "替代食材", "健康建議", "菜品名稱", "置信度", "食材分析",
+                "營養特點", "相似菜品"}
+
+
+# ==================== 統計 ====================
+
+class ParseStats:
+    """各任務類型的解析結果計數"""
+
+    OUTCOMES = ("direct", "fenced", "scanned", "repaired", "schema_error", "failed")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, task_type: str, outcome: str):
+        with self._lock:
+            counts = self._counts.setdefault(task_type, dict.fromkeys(self.OUTCOMES, 0))
+            counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """返回各任務類型的計數，以及總解析次數和失敗率"""
+        with self._lock:
+            result = {}
+            for task_type, counts in self._counts.items():
+                total = sum(v for k, v in counts.items() if k != "schema_error")
+                result[task_type] = dict(counts, total=total,
+                                         failure_rate=counts["failed"] / total if total else 0.0)
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+_stats = ParseStats()
+
+
+def get_parse_stats() -> ParseStats:
+    """獲取進程內共享的解析統計"""
+    return _stats
+
+
+# ==================== 提取與修復 ====================
+
+def _balanced_end(text: str, start: int) -> Optional[int]:
+    """從 start 處的 '{' 開始，返回與之匹配的 '}' 的位置（忽略字符串中的括號）"""
+    depth = 0
+    in_string = False
+    escape = False
+    for index in range(start, len(text)):
+        ch = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+    return None
+
+
+def iter_json_objects(text: str):
+    """依次產生文本中每個頂層平衡的 {...} 片段"""
+    start = text.find("{")
+    while start != -1:
+        end = _balanced_end(text, start)
+        if end is None:
+            # 不完整（可能被截斷），把剩餘部分交給修復流程
+            yield text[start:]
+            return
+        yield text[start:end + 1]
+        start = text.find("{", end + 1)
+
+
+def repair_json(candidate: str) -> str:
+    """
+    寬鬆修復常見的 JSON 錯誤
+
+    處理：彎引號、// 註釋、模板殘留的 "..." 項、尾隨逗號、
+    Python 字面量（True/False/None），以及被截斷的結尾。
+    """
+    text = candidate.translate(_SMART_QUOTES)
+    text = _LINE_COMMENT_RE.sub("", text)
+    text = _ELLIPSIS_ITEM_RE.sub(r"\1", text)
+    text = _TRAILING_COMMA_RE.sub(r"\1", text)
+    text = _PY_LITERAL_RE.sub(lambda m: _PY_LITERALS[m.group(1)], text)
+    return _close_truncated(text)
+
+
+def _close_truncated(text: str) -> str:
+    """補全被截斷的字符串和括號"""
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+
+    if not stack and not in_string:
+        return text
+    if in_string:
+        text += '"'
+    text = _TRAILING_COMMA_RE.sub(r"\1", text.rstrip().rstrip(",").rstrip(":") + "".join(reversed(stack)))
+    return text
+
+
+def extract_json(content: str) -> Tuple[Optional[Dict], str]:
+    """
+    從模型回應中提取 JSON 對象
+
+    Returns:
+    --------
+    tuple
+        (解析結果, 方式)；方式為 "direct", "fenced", "scanned", "repaired" 或 "failed"
+    """
+    if not content:
+        return None, "failed"
+
+    text = content.strip()
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data, "direct"
+    except ValueError:
+        pass
+
+    fence = _FENCE_RE.search(text)
+    if fence:
+        try:
+            data = json.loads(fence.group(1).strip())
+            if isinstance(data, dict):
+                return data, "fenced"
+        except ValueError:
+            pass
+
+    candidates = list(iter_json_objects(text))
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate)
+            if isinstance(data, dict):
+                return data, "scanned"
+        except ValueError:
+            continue
+
+    for candidate in candidates:
+        try:
+            data = json.loads(repair_json(candidate))
+            if isinstance(data, dict):
+                return data, "repaired"
+        except ValueError:
+            continue
+
+    return None, "failed"
+
+
+# ==================== 結構校驗 ====================
+
+def validate_schema(data: Dict, task_type: str) -> List[str]:
+    """
+    按任務類型校驗並就地規整結果
+
+    單個字符串的列表欄位會被包裝成列表；返回無法修正的問題描述。
+    """
+    for key in _LIST_FIELDS:
+        if isinstance(data.get(key), str):
+            data[key] = [data[key]]
+
+    errors = []
+    for key, types in TASK_SCHEMAS.get(task_type, {}).items():
+        if key not in data:
+            errors.append(f"缺少欄位: {key}")
+        elif not isinstance(data[key], types):
+            errors.append(f"欄位類型錯誤: {key}")
+    return errors
+
+
+def is_complete_result(result: Dict) -> bool:
+    """結果是否成功且結構完整（只有這樣的結果才值得緩存；本地模型的降級結果不緩存）"""
+    return not any(key in result for key in ("error", "raw_response", "schema_errors", "degraded"))
+
+
+def parse_structured(content: str, task_type: str) -> Dict:
+    """
+    解析模型回應為結構化結果
+
+    Parameters:
+    -----------
+    content : str
+        模型回應文本
+    task_type : str
+        "recipe", "advice", "nutrition", "vision" 或 "health_advice"
+
+    Returns:
+    --------
+    dict
+        解析結果；無法解析時為 {"raw_response": ..., "parse_error": ...}，
+        結構不完整時附帶 "schema_errors"
+    """
+    data, outcome = extract_json(content)
+    _stats.record(task_type, outcome)
+
+    if data is None:
+        return {"raw_response": content, "parse_error": "無法從回應中解析 JSON"}
+
+    errors = validate_schema(data, task_type)
+    if errors:
+        _stats.record(task_type, "schema_error")
+        data["schema_errors"] = errors
+    return data
@@ -0,0 +1,357 @@
+"""
+AI 廚師顧問 - 感知雜湊去重緩存模組
+AI Chef Advisor - Perceptual Hash Deduplication Module
+
+用 NumPy 從縮略圖計算 dHash/pHash，BK 樹按漢明距離查找近似重複的圖片，
+重新保存、輕微裁剪或重新壓縮的同一張照片可以直接復用之前的識別結果
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+DEFAULT_PHASH_CACHE_PATH = os.getenv(
+    "AI_CHEF_PHASH_CACHE_PATH",
+    str(Path(__file__).parent / ".cache" / "ai_chef_images.sqlite3")
+)
+DEFAULT_PHASH_THRESHOLD = int(os.getenv("AI_CHEF_PHASH_THRESHOLD", "10"))
+DEFAULT_PHASH_ENTRIES = 4096
+DEFAULT_PHASH_TTL = 30 * 24 * 3600
+
+
+# ==================== 感知雜湊 ====================
+
+def _gray(thumbnail: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """把 RGB 縮略圖縮小為灰度陣列（BOX 採樣，即區域平均）"""
+    image = Image.fromarray(np.asarray(thumbnail, dtype=np.uint8)).convert("L")
+    return np.asarray(image.resize(size, Image.BOX), dtype=np.float64)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel().astype(np.uint8)).tobytes(), "big")
+
+
+def dhash(thumbnail: np.ndarray) -> int:
+    """差值雜湊：9x8 灰度圖中每行相鄰像素的明暗關係"""
+    gray = _gray(thumbnail, (9, 8))
+    return _bits_to_int(gray[:, 1:] > gray[:, :-1])
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def phash(thumbnail: np.ndarray) -> int:
+    """
+    DCT 雜湊：32x32 灰度圖二維 DCT 的左上 8x8 低頻係數與其中位數比較
+
+    對重新壓縮、縮放和輕微裁剪都很穩定。
+    """
+    gray = _gray(thumbnail, (32, 32))
+    low = (_DCT_32 @ gray @ _DCT_32.T)[:8, :8].ravel()
+    # 直流分量只反映整體亮度，不參與中位數
+    median = np.median(low[1:])
+    return _bits_to_int(low > median)
+
+
+def hamming(a: int, b: int) -> int:
+    """兩個雜湊的漢明距離"""
+    return bin(a ^ b).count("1")
+
+
+# ==================== BK 樹 ====================
+
+class BKTree:
+    """
+    按漢明距離組織的 BK 樹
+
+    查找半徑為 r 時，利用三角不等式只需訪問距離落在 [d - r, d + r] 的子樹。
+    刪除採用墓碑標記，墓碑過多時重建。
+    """
+
+    def __init__(self):
+        self._root: Optional[int] = None
+        self._children: Dict[int, Dict[int, int]] = {}
+        self._deleted: set = set()
+
+    def __len__(self) -> int:
+        return len(self._children) - len(self._deleted)
+
+    def add(self, value: int):
+        if value in self._children:
+            self._deleted.discard(value)
+            return
+        self._children[value] = {}
+        if self._root is None:
+            self._root = value
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node)
+            child = self._children[node].get(distance)
+            if child is None:
+                self._children[node][distance] = value
+                return
+            node = child
+
+    def remove(self, value: int):
+        if value not in self._children:
+            return
+        self._deleted.add(value)
+        if len(self._deleted) > len(self._children) // 2:
+            self._rebuild()
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """返回距離不超過 radius 的 [(距離, 雜湊), ...]，按距離排序"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node)
+            if distance <= radius and node not in self._deleted:
+                found.append((distance, node))
+            for edge, child in self._children[node].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return sorted(found)
+
+    def _rebuild(self):
+        alive = [v for v in self._children if v not in self._deleted]
+        self._root = None
+        self._children = {}
+        self._deleted = set()
+        for value in alive:
+            self.add(value)
+
+
+# ==================== 去重緩存 ====================
+
+class ImageDedupCache:
+    """以感知雜湊為鍵、支持近似匹配的圖片識別結果緩存（SQLite 持久化）"""
+
+    def __init__(self,
+                 path: Optional[str] = DEFAULT_PHASH_CACHE_PATH,
+                 max_entries: int = DEFAULT_PHASH_ENTRIES,
+                 threshold: int = DEFAULT_PHASH_THRESHOLD,
+                 default_ttl: Optional[int] = DEFAULT_PHASH_TTL):
+        """
+        初始化去重緩存
+
+        Parameters:
+        -----------
+        path : str, optional
+            SQLite 文件路徑；為 None 時僅使用記憶體
+        max_entries : int
+            最大條目數，超出時淘汰最久未用的條目
+        threshold : int
+            視為同一張圖片的最大漢明距離（64 位中）
+        default_ttl : int, optional
+            有效期（秒）；為 None 時永不過期
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.default_ttl = default_ttl
+
+        # (namespace, hash) -> [結果 JSON, 最近使用時間, 過期時間]
+        self._entries: Dict[Tuple[str, int], list] = {}
+        self._trees: Dict[str, BKTree] = {}
+        self._lock = threading.RLock()
+        self._conn = None
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path: str):
+        """打開磁碟存儲並載入未過期的條目，失敗時退回僅記憶體模式"""
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS image_results (
+                       namespace TEXT NOT NULL,
+                       hash TEXT NOT NULL,
+                       value TEXT NOT NULL,
+                       last_used REAL NOT NULL,
+                       expires_at REAL,
+                       PRIMARY KEY (namespace, hash)
+                   )"""
+            )
+            self._conn.execute(
+                "DELETE FROM image_results WHERE expires_at IS NOT NULL AND expires_at < ?",
+                (time.time(),)
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT namespace, hash, value, last_used, expires_at FROM image_results "
+                "ORDER BY last_used DESC LIMIT ?", (self.max_entries,)
+            ).fetchall()
+        except sqlite3.Error:
+            self._conn = None
+            return
+
+        for namespace, hex_hash, value, last_used, expires_at in rows:
+            image_hash = int(hex_hash, 16)
+            self._entries[(namespace, image_hash)] = [value, last_used, expires_at]
+            self._trees.setdefault(namespace, BKTree()).add(image_hash)
+
+    # ==================== 讀寫 ====================
+
+    def get(self, namespace: str, image_hash: int) -> Optional[Dict]:
+        """
+        查找近似重複圖片的緩存結果
+
+        Parameters:
+        -----------
+        namespace : str
+            服務和模型標識，不同模型的結果互不復用
+        image_hash : int
+            圖片的感知雜湊
+
+        Returns:
+        --------
+        dict or None
+            距離最近且未過期的結果
+        """
+        now = time.time()
+        with self._lock:
+            tree = self._trees.get(namespace)
+            matches = tree.search(image_hash, self.threshold) if tree else []
+            for distance, candidate in matches:
+                entry = self._entries[(namespace, candidate)]
+                value, _, expires_at = entry
+                if expires_at is not None and expires_at <= now:
+                    self._evict(namespace, candidate)
+                    continue
+                entry[1] = now
+                self._touch_disk(namespace, candidate, now)
+                self.hits += 1
+                if distance:
+                    self.near_hits += 1
+                return json.loads(value)
+
+            self.misses += 1
+            return None
+
+    def set(self, namespace: str, image_hash: int, value: Dict, ttl: Optional[int] = None):
+        """寫入識別結果"""
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        raw = json.dumps(value, ensure_ascii=False)
+
+        with self._lock:
+            self._entries[(namespace, image_hash)] = [raw, now, expires_at]
+            self._trees.setdefault(namespace, BKTree()).add(image_hash)
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO image_results "
+                        "(namespace, hash, value, last_used, expires_at) VALUES (?, ?, ?, ?, ?)",
+                        (namespace, f"{image_hash:016x}", raw, now, expires_at)
+                    )
+                    self._conn.commit()
+                except sqlite3.Error:
+                    pass
+
+            # 超出容量時淘汰最久未用的條目
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                oldest = sorted(self._entries.items(), key=lambda item: item[1][1])[:overflow]
+                for (old_namespace, old_hash), _ in oldest:
+                    self._evict(old_namespace, old_hash)
+
+    def clear(self):
+        """清空全部條目和計數器"""
+        with self._lock:
+            self._entries.clear()
+            self._trees.clear()
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM image_results")
+                    self._conn.commit()
+                except sqlite3.Error:
+                    pass
+            self.hits = self.near_hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict:
+        """返回命中統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "threshold": self.threshold,
+            }
+
+    # ==================== 內部方法 ====================
+
+    def _evict(self, namespace: str, image_hash: int):
+        self._entries.pop((namespace, image_hash), None)
+        tree = self._trees.get(namespace)
+        if tree is not None:
+            tree.remove(image_hash)
+        self.evictions += 1
+        if self._conn is not None:
+            try:
+                self._conn.execute(
+                    "DELETE FROM image_results WHERE namespace = ? AND hash = ?",
+                    (namespace, f"{image_hash:016x}")
+                )
+                self._conn.commit()
+            except sqlite3.Error:
+                pass
+
+    def _touch_disk(self, namespace: str, image_hash: int, now: float):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                "UPDATE image_results SET last_used = ? WHERE namespace = ? AND hash = ?",
+                (now, namespace, f"{image_hash:016x}")
+            )
+            self._conn.commit()
+        except sqlite3.Error:
+            pass
+
+
+# ==================== 進程級共享緩存 ====================
+
+_default_image_cache: Optional[ImageDedupCache] = None
+_default_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageDedupCache:
+    """獲取進程內共享的圖片去重緩存"""
+    global _default_image_cache
+    with _default_image_cache_lock:
+        if _default_image_cache is None:
+            _default_image_cache = ImageDedupCache()
+        return _default_image_cache
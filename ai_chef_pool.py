@@ -0,0 +1,330 @@
+"""
+AI 廚師顧問 - 客戶端連接池
+AI Chef Advisor - Client Pool Module
+
+進程級共享、線程安全的 OpenAI 客戶端、Gemini 模型句柄和本地 llama.cpp 模型池
+"""
+
+import time
+import asyncio
+import hashlib
+import weakref
+import threading
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from openai import OpenAI, AsyncOpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+try:
+    import google.generativeai as genai
+    GEMINI_AVAILABLE = True
+except ImportError:
+    GEMINI_AVAILABLE = False
+
+# 上下文緩存（CachedContent）需要較新版本的 google-generativeai
+try:
+    from google.generativeai import caching as genai_caching
+    GEMINI_CONTEXT_CACHE_AVAILABLE = True
+except ImportError:
+    GEMINI_CONTEXT_CACHE_AVAILABLE = False
+
+try:
+    from llama_cpp import Llama, LlamaRAMCache
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+
+
+def _freeze(options: Dict) -> Tuple:
+    """把選項字典轉為可雜湊的鍵"""
+    return tuple(sorted((k, repr(v)) for k, v in options.items()))
+
+
+class ClientPool:
+    """
+    長生命週期客戶端池
+
+    以 (service, api_key, model_name) 為鍵緩存客戶端和模型句柄，
+    OpenAI 客戶端內部的 httpx 連接池會保持 keep-alive 連接，
+    避免每次請求重新建立 TLS 連接。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple, Any] = {}
+        self._factories: Dict[str, Callable] = {}
+        self._gemini_key: Optional[str] = None
+        # 異步客戶端按事件循環分別緩存（以循環對象為弱引用鍵，循環關閉後丟棄）
+        self._loop_entries: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, Any]]" = \
+            weakref.WeakKeyDictionary()
+
+        self.created = 0
+        self.reused = 0
+
+    def set_factory(self, service: str, factory: Optional[Callable]):
+        """
+        替換某服務的客戶端構造函數（用於測試或基準測試中注入假後端）
+
+        Parameters:
+        -----------
+        service : str
+            "openai", "openai_async", "gemini", "gemini_cached" 或 "llama_cpp"
+        factory : callable, optional
+            openai / openai_async: factory(api_key, base_url=None) -> client；
+            gemini: factory(api_key, model_name, **options) -> model；
+            gemini_cached: factory(api_key, model_name, prefix, ttl, **options) -> model；
+            llama_cpp: factory(model_path, **options) -> model；
+            傳入 None 恢復預設
+        """
+        with self._lock:
+            if factory is None:
+                self._factories.pop(service, None)
+            else:
+                self._factories[service] = factory
+            # 構造方式變了，舊句柄不再有效
+            self._entries = {k: v for k, v in self._entries.items() if k[0] != service}
+            for entries in self._loop_entries.values():
+                for key in [k for k in entries if k[0] == service]:
+                    del entries[key]
+
+    def available(self, service: str) -> bool:
+        """服務是否可用：已安裝對應 SDK，或已注入假後端"""
+        if service == "openai":
+            return OPENAI_AVAILABLE or "openai" in self._factories
+        if service == "gemini":
+            return GEMINI_AVAILABLE or "gemini" in self._factories
+        if service == "llama_cpp":
+            return LLAMA_CPP_AVAILABLE or "llama_cpp" in self._factories
+        return False
+
+    def _get_or_create(self, key: Tuple, create: Callable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.reused += 1
+                return entry
+            entry = create()
+            self._entries[key] = entry
+            self.created += 1
+            return entry
+
+    # ==================== OpenAI ====================
+
+    def openai_client(self, api_key: Optional[str], base_url: Optional[str] = None):
+        """
+        獲取共享的 OpenAI 客戶端
+
+        Parameters:
+        -----------
+        api_key : str
+            API 金鑰
+        base_url : str, optional
+            OpenAI 兼容服務的地址（如本地 llama.cpp 服務），預設為 OpenAI 官方接口
+        """
+        factory = self._factories.get("openai")
+
+        def create():
+            if factory is not None:
+                return factory(api_key, base_url=base_url)
+            return OpenAI(api_key=api_key, base_url=base_url)
+
+        return self._get_or_create(("openai", api_key, base_url), create)
+
+    def async_openai_client(self, api_key: Optional[str], base_url: Optional[str] = None):
+        """
+        獲取共享的 AsyncOpenAI 客戶端
+
+        異步客戶端的連接池綁定在事件循環上，因此按事件循環分別緩存；
+        每次 asyncio.run 都是新的循環，已關閉循環的客戶端在下次取用時丟棄。
+        """
+        factory = self._factories.get("openai_async")
+
+        def create():
+            if factory is not None:
+                return factory(api_key, base_url=base_url)
+            return AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+        key = ("openai_async", api_key, base_url)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self._get_or_create(key, create)
+
+        with self._lock:
+            # 客戶端的連接可能反過來引用循環，弱引用鍵不一定能自動釋放，因此主動清理
+            for closed in [l for l in self._loop_entries if l.is_closed()]:
+                del self._loop_entries[closed]
+            entries = self._loop_entries.setdefault(loop, {})
+            client = entries.get(key)
+            if client is not None:
+                self.reused += 1
+                return client
+            client = entries[key] = create()
+            self.created += 1
+            return client
+
+    # ==================== Gemini ====================
+
+    def configure_gemini(self, api_key: Optional[str]):
+        """
+        配置 Gemini API Key
+
+        genai.configure 是全局設置，只有在金鑰變化時才重新配置。
+        """
+        if "gemini" in self._factories or not GEMINI_AVAILABLE:
+            return
+        with self._lock:
+            if self._gemini_key != api_key:
+                genai.configure(api_key=api_key)
+                self._gemini_key = api_key
+
+    def gemini_model(self, api_key: Optional[str], model_name: str, **options):
+        """
+        獲取共享的 Gemini 模型句柄
+
+        Parameters:
+        -----------
+        api_key : str
+            API 金鑰
+        model_name : str
+            模型名稱
+        **options
+            傳給 genai.GenerativeModel 的其他參數（如 generation_config）
+        """
+        factory = self._factories.get("gemini")
+        if factory is None:
+            self.configure_gemini(api_key)
+
+        def create():
+            if factory is not None:
+                return factory(api_key, model_name, **options)
+            return genai.GenerativeModel(model_name, **options)
+
+        return self._get_or_create(("gemini", api_key, model_name, _freeze(options)), create)
+
+    def gemini_cached_model(self, api_key: Optional[str], model_name: str, prefix: str, ttl: int, **options):
+        """
+        獲取固定前綴已保存為 CachedContent 的 Gemini 模型句柄
+
+        服務端緩存在 ttl 秒後過期，句柄在此之前重新創建；創建失敗（SDK 版本過舊、
+        模型不支持或前綴太短）時在一個 ttl 內不再嘗試。
+
+        Parameters:
+        -----------
+        api_key : str
+            API 金鑰
+        model_name : str
+            模型名稱
+        prefix : str
+            要緩存的固定前綴
+        ttl : int
+            服務端緩存的存活時間（秒）
+        **options
+            傳給模型句柄的其他參數（如 generation_config）
+
+        Returns:
+        --------
+        model or None
+            不能使用上下文緩存時為 None（調用方改為直接發送前綴）
+        """
+        factory = self._factories.get("gemini_cached")
+        if factory is None and not (GEMINI_AVAILABLE and GEMINI_CONTEXT_CACHE_AVAILABLE):
+            return None
+        key = ("gemini_cached", api_key, model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest(),
+               _freeze(options))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.reused += 1
+                return entry[0]
+
+        # 創建緩存是一次網路請求，不持有池的鎖；並發的首次請求可能各創建一次
+        try:
+            if factory is not None:
+                model = factory(api_key, model_name, prefix, ttl, **options)
+            else:
+                self.configure_gemini(api_key)
+                cached = genai_caching.CachedContent.create(
+                    model=f"models/{model_name}", contents=[prefix], ttl=timedelta(seconds=ttl)
+                )
+                model = genai.GenerativeModel.from_cached_content(cached_content=cached, **options)
+        except Exception:
+            model = None
+        with self._lock:
+            # 提前一成時間換新，避免用到剛在服務端過期的緩存
+            self._entries[key] = (model, now + ttl * 0.9)
+            self.created += 1
+        return model
+
+    # ==================== llama.cpp ====================
+
+    def llama_model(self, model_path: str, cache_bytes: int = 0, **options):
+        """
+        獲取共享的本地 llama.cpp 模型
+
+        模型權重佔用數百 MB 以上，每個文件和參數組合在進程內只加載一次。
+
+        Parameters:
+        -----------
+        model_path : str
+            GGUF 模型文件路徑
+        cache_bytes : int
+            提示詞 KV 緩存（LlamaRAMCache）的容量，0 表示不啟用
+        **options
+            傳給 Llama 的其他參數（如 n_ctx、n_threads、use_mmap）
+        """
+        factory = self._factories.get("llama_cpp")
+
+        def create():
+            if factory is not None:
+                return factory(model_path, cache_bytes=cache_bytes, **options)
+            model = Llama(model_path=model_path, **options)
+            if cache_bytes:
+                model.set_cache(LlamaRAMCache(capacity_bytes=cache_bytes))
+            return model
+
+        return self._get_or_create(("llama_cpp", model_path, cache_bytes, _freeze(options)), create)
+
+    # ==================== 管理 ====================
+
+    def clear(self):
+        """釋放全部句柄"""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if key[0] == "openai" and hasattr(entry, "close"):
+                    try:
+                        entry.close()
+                    except Exception:
+                        pass
+            self._entries.clear()
+            self._loop_entries.clear()
+            self._gemini_key = None
+
+    def stats(self) -> Dict:
+        """返回池的使用統計"""
+        with self._lock:
+            return {
+                "size": len(self._entries) + sum(len(entries) for entries in self._loop_entries.values()),
+                "created": self.created,
+                "reused": self.reused,
+            }
+
+
+# ==================== 進程級共享連接池 ====================
+
+_default_pool: Optional[ClientPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """獲取進程內共享的客戶端池（跨 Streamlit 會話和重新運行復用）"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ClientPool()
+        return _default_pool
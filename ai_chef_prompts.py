@@ -0,0 +1,242 @@
+"""
+AI 廚師顧問 - 提示詞模板模組
+AI Chef Advisor - Prompt Templates Module
+
+各任務的提示詞分為固定前綴（角色、任務說明、緊湊的 JSON 結構）和可變部分；
+前綴在導入時組裝一次，所有請求逐字相同並放在最前面，以命中 OpenAI 的自動提示詞緩存
+和 Gemini 的上下文緩存（CachedContent）；並可輸出各模板的 token 數報告
+
+用法：
+    python ai_chef_prompts.py
+    python ai_chef_prompts.py --json prompt_tokens.json
+"""
+
+import os
+import json
+import hashlib
+import argparse
+from typing import Dict, List, Optional
+
+from ai_chef_memory import estimate_tokens
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+# 服務端前綴緩存
+PROMPT_CACHE_ENABLED = os.getenv("AI_CHEF_PROMPT_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+# OpenAI 只緩存至少 1024 token 的提示詞前綴（自動進行，無需額外請求）
+OPENAI_CACHE_MIN_TOKENS = 1024
+# Gemini 顯式上下文緩存按存儲時長計費，需要單獨開啟；前綴短於最小長度時服務端會拒絕創建
+GEMINI_CONTEXT_CACHE_ENABLED = os.getenv("AI_CHEF_GEMINI_CONTEXT_CACHE", "").strip().lower() in ("1", "true", "yes", "on")
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv("AI_CHEF_GEMINI_CACHE_MIN_TOKENS", "1024"))
+GEMINI_CACHE_TTL = int(os.getenv("AI_CHEF_GEMINI_CACHE_TTL", "3600"))
+
+CHEF_PERSONA = "你是一位專業的廚師和營養師，提供詳細準確的菜譜和烹飪建議。"
+CHAT_PERSONA = "你是一位友善且知識豐富的廚師，幫助用戶解答烹飪相關問題。使用繁體中文回應。"
+JSON_INSTRUCTION = "只返回 JSON（繁體中文），結構如下，值為填寫說明，列表可有多項："
+
+
+def compact_json(schema: Dict) -> str:
+    """沒有縮進和多餘空白的 JSON（結構說明不需要排版，空白也佔 token）"""
+    return json.dumps(schema, ensure_ascii=False, separators=(",", ":"))
+
+
+def count_tokens(text: str) -> int:
+    """提示詞的 token 數：安裝了 tiktoken 時按 OpenAI 分詞器計數，否則估算"""
+    if TIKTOKEN_AVAILABLE:
+        return len(_encoding().encode(text))
+    return estimate_tokens(text)
+
+
+_tiktoken_encoding = None
+
+
+def _encoding():
+    global _tiktoken_encoding
+    if _tiktoken_encoding is None:
+        _tiktoken_encoding = tiktoken.get_encoding("cl100k_base")
+    return _tiktoken_encoding
+
+
+def gemini_context_cacheable(prefix_tokens: int) -> bool:
+    """前綴是否值得（並且能夠）用 Gemini CachedContent 緩存"""
+    return PROMPT_CACHE_ENABLED and GEMINI_CONTEXT_CACHE_ENABLED and prefix_tokens >= GEMINI_CACHE_MIN_TOKENS
+
+
+# ==================== 模板 ====================
+
+class PromptTemplate:
+    """
+    固定前綴 + 可變部分的提示詞模板
+
+    前綴作為系統消息（或圖片識別的文本部分）發送，同一模板的所有請求逐字相同；
+    可變部分只包含本次請求的參數。
+    """
+
+    __slots__ = ("name", "prefix", "user", "sample", "prefix_tokens", "fingerprint")
+
+    def __init__(self,
+                 name: str,
+                 instructions: str,
+                 schema: Optional[Dict] = None,
+                 user: str = "",
+                 sample: Optional[Dict] = None):
+        """
+        Parameters:
+        -----------
+        name : str
+            模板名稱，同時作為服務端緩存的路由鍵
+        instructions : str
+            角色和任務說明
+        schema : dict, optional
+            要求返回的 JSON 結構，以緊湊格式附在說明後面
+        user : str
+            可變部分的 str.format 模板
+        sample : dict, optional
+            填入 user 的示例參數（用於 token 報告）
+        """
+        self.name = name
+        self.prefix = instructions if schema is None else f"{instructions}\n{JSON_INSTRUCTION}\n{compact_json(schema)}"
+        self.user = user
+        self.sample = sample or {}
+        self.prefix_tokens = count_tokens(self.prefix)
+        # 前綴變化後舊的緩存結果不再命中
+        self.fingerprint = hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()[:12]
+
+    def render(self, *extra_lines: Optional[str], **values) -> str:
+        """
+        組裝可變部分
+
+        Parameters:
+        -----------
+        *extra_lines : str
+            附在後面的可選行，空值會被略過
+        **values
+            填入 user 模板的參數
+        """
+        lines = [self.user.format(**values)] if self.user else []
+        lines.extend(line for line in extra_lines if line)
+        return "\n".join(lines)
+
+    def report(self) -> Dict:
+        """前綴和示例可變部分的 token 數，以及能否命中各服務的前綴緩存"""
+        variable_tokens = count_tokens(self.render(**self.sample)) if self.user else 0
+        total = self.prefix_tokens + variable_tokens
+        return {
+            "prefix_tokens": self.prefix_tokens,
+            "sample_variable_tokens": variable_tokens,
+            "sample_total_tokens": total,
+            "prefix_share": round(self.prefix_tokens / total, 3) if total else None,
+            "openai_cacheable": self.prefix_tokens >= OPENAI_CACHE_MIN_TOKENS,
+            "gemini_cacheable": gemini_context_cacheable(self.prefix_tokens),
+            "fingerprint": self.fingerprint,
+        }
+
+
+RECIPE_PROMPT = PromptTemplate(
+    "recipe",
+    f"{CHEF_PERSONA}\n按用戶給出的菜名、難度、份量和限制生成詳細菜譜。",
+    {
+        "菜名": "菜名",
+        "難度": "難度等級描述",
+        "烹飪時間": "X-Y分鐘",
+        "份量": "N人份",
+        "材料": {"材料名": "用量描述"},
+        "步驟": ["每一步的詳細描述"],
+        "烹飪技巧": ["技巧: 描述"],
+        "營養信息": {"熱量": "數值 kcal/份", "蛋白質": "數值g", "脂肪": "數值g", "碳水化合物": "數值g"},
+        "健康提示": ["提示"],
+        "搭配建議": ["搭配建議"],
+    },
+    user="菜名: {dish_name}\n難度級別: {difficulty} (easy/medium/hard)\n份量: {servings} 人份",
+    sample={"dish_name": "番茄炒蛋", "difficulty": "medium", "servings": 2},
+)
+
+ADVICE_PROMPT = PromptTemplate(
+    "advice",
+    f"{CHEF_PERSONA}\n按用戶的技能等級和飲食限制給出這道菜的烹飪建議。",
+    {
+        "難度評估": "難度描述",
+        "關鍵技巧": ["技巧"],
+        "常見錯誤": ["錯誤"],
+        "補救方案": ["補救方案"],
+        "時間管理": "時間分配建議",
+        "替代食材": ["替代食材"],
+        "個性化建議": "根據技能等級的具體建議",
+    },
+    user="菜名: {dish_name}\n技能等級: {skill_level}",
+    sample={"dish_name": "番茄炒蛋", "skill_level": "intermediate"},
+)
+
+HEALTH_ADVICE_PROMPT = PromptTemplate(
+    "health_advice",
+    f"{CHEF_PERSONA}\n用戶會給出一道菜的食材和已經計算好的每份營養數據，"
+    "請根據這些數據（不要重新計算）給出 2-4 條具體的健康建議。",
+    {"健康建議": ["建議"]},
+    user="食材:\n{ingredients}\n\n營養數據：{facts}",
+    sample={
+        "ingredients": "- 雞蛋: 3個\n- 番茄: 2個",
+        "facts": compact_json({"每份熱量": "180 kcal", "份量": 2, "宏量營養": {"蛋白質": "10g"}}),
+    },
+)
+
+# 圖片識別沒有可變的文本部分（OpenAI 和 Gemini 共用）
+IMAGE_PROMPT = PromptTemplate(
+    "vision",
+    "分析這張美食圖片。",
+    {
+        "菜品名稱": ["可能的菜名"],
+        "置信度": [0.9],
+        "食材分析": ["食材"],
+        "烹飪方式": "推測的烹飪方式",
+        "難度評估": "簡單/中等/難",
+        "營養特點": ["特點"],
+        "烹飪建議": "基於這道菜的烹飪建議",
+        "相似菜品": ["相似菜品"],
+    },
+)
+
+CHAT_PROMPT = PromptTemplate("chat", CHAT_PERSONA)
+
+# 按任務類型（parse_structured 的 task_type）查找模板
+TEMPLATES: Dict[str, PromptTemplate] = {
+    template.name: template
+    for template in (RECIPE_PROMPT, ADVICE_PROMPT, HEALTH_ADVICE_PROMPT, IMAGE_PROMPT, CHAT_PROMPT)
+}
+
+
+def token_report() -> Dict[str, Dict]:
+    """各模板的 token 數報告"""
+    return {name: template.report() for name, template in TEMPLATES.items()}
+
+
+# ==================== 命令行 ====================
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="AI 廚師顧問提示詞模板的 token 數報告")
+    parser.add_argument("--json", dest="output", help="同時把報告保存為 JSON 文件")
+    args = parser.parse_args(argv)
+
+    report = token_report()
+    counter = "tiktoken cl100k_base" if TIKTOKEN_AVAILABLE else "估算"
+    print(f"token 計數方式: {counter}  OpenAI 緩存下限: {OPENAI_CACHE_MIN_TOKENS}  "
+          f"Gemini 上下文緩存: {'開啟' if GEMINI_CONTEXT_CACHE_ENABLED else '關閉'}（下限 {GEMINI_CACHE_MIN_TOKENS}）")
+    print(f"{'模板':<14}{'前綴':>6}{'可變':>6}{'合計':>6}{'前綴佔比':>10}  OpenAI  Gemini")
+    for name, row in report.items():
+        share = f"{row['prefix_share']:.0%}" if row["prefix_share"] is not None else "-"
+        print(f"{name:<14}{row['prefix_tokens']:>6}{row['sample_variable_tokens']:>6}"
+              f"{row['sample_total_tokens']:>6}{share:>10}  "
+              f"{'✓' if row['openai_cacheable'] else '-':^6}  {'✓' if row['gemini_cacheable'] else '-':^6}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 報告已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+"""
+AI 廚師顧問 - 速率限制模組
+AI Chef Advisor - Rate Limiting Module
+
+按服務和模型維護每分鐘請求數（RPM）和每分鐘 token 數（TPM）的令牌桶，
+由響應頭和 usage 數據校正；接近上限時排隊等待而不是直接失敗，
+遇到 429 等可重試錯誤時按 Retry-After 或帶抖動的指數退避重試，
+並讓同一模型的其他請求一起暫停，避免錯誤風暴
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ai_chef_router import classify_error
+from ai_chef_memory import estimate_tokens
+
+
+def _env_limit(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return float(value) if value.strip() else None
+
+
+# Gemini 的回應不帶限額響應頭，無法像 OpenAI 那樣按賬號的實際限額自動校正，
+# 只能按賬號層級選擇起始限額：free 為免費層（每模型 15 RPM），paid 為付費 Tier 1 的保守值
+GEMINI_TIER_LIMITS = {
+    "free": {"rpm": 15, "tpm": 1000000},
+    "paid": {"rpm": 1000, "tpm": 4000000},
+}
+GEMINI_TIER = os.getenv("AI_CHEF_GEMINI_TIER", "free").strip().lower()
+if GEMINI_TIER not in GEMINI_TIER_LIMITS:
+    raise ValueError(f"AI_CHEF_GEMINI_TIER 應為 {' / '.join(GEMINI_TIER_LIMITS)}，收到 {GEMINI_TIER!r}")
+
+# 每個模型的預設限額（可用環境變量覆蓋；OpenAI 響應頭中的實際限額會自動校正）
+DEFAULT_MODEL_LIMITS = {
+    "openai": {
+        "rpm": _env_limit("AI_CHEF_OPENAI_RPM", 500),
+        "tpm": _env_limit("AI_CHEF_OPENAI_TPM", 200000),
+    },
+    "gemini": {
+        "rpm": _env_limit("AI_CHEF_GEMINI_RPM", GEMINI_TIER_LIMITS[GEMINI_TIER]["rpm"]),
+        "tpm": _env_limit("AI_CHEF_GEMINI_TPM", GEMINI_TIER_LIMITS[GEMINI_TIER]["tpm"]),
+    },
+}
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+# 令牌桶允許的突發量（秒數）：按 10 秒的配額平滑突發，避免一分鐘的配額在一瞬間用完
+BURST_SECONDS = 10.0
+# 未知輸出長度時預留的 token 數
+DEFAULT_OUTPUT_TOKENS = 1024
+
+RETRYABLE_ERRORS = ("rate_limit", "server", "timeout")
+
+
+class RateLimitExceeded(RuntimeError):
+    """排隊等待時間超過 max_wait"""
+
+    def __init__(self, provider: str, model: Optional[str], wait: float):
+        super().__init__(f"{provider}/{model or '*'} 速率限制：需等待 {wait:.1f} 秒")
+        self.retry_after = wait
+
+
+# ==================== 響應頭解析 ====================
+
+_DURATION_RE = re.compile(r"([\d.]+)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """解析 "1s"、"6m0s"、"20ms" 或純數字秒數"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header(headers, name: str) -> Optional[str]:
+    if headers is None:
+        return None
+    try:
+        return headers.get(name)
+    except AttributeError:
+        return None
+
+
+_RETRY_MESSAGE_RE = re.compile(r"(?:retry (?:in|after)|try again in)\s*([\d.]+)\s*(ms|s)?", re.IGNORECASE)
+_RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)")
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    從異常中取出服務端建議的等待秒數
+
+    OpenAI 錯誤帶有 Retry-After / retry-after-ms 響應頭；Gemini 的
+    ResourceExhausted 在錯誤詳情中給出 retry_delay。
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    milliseconds = _header(headers, "retry-after-ms")
+    if milliseconds is not None:
+        try:
+            return float(milliseconds) / 1000.0
+        except ValueError:
+            pass
+    seconds = parse_duration(_header(headers, "retry-after"))
+    if seconds is not None:
+        return seconds
+
+    message = str(error)
+    match = _RETRY_DELAY_RE.search(message)
+    if match:
+        return float(match.group(1))
+    match = _RETRY_MESSAGE_RE.search(message)
+    if match:
+        return float(match.group(1)) * (0.001 if match.group(2) == "ms" else 1.0)
+    return None
+
+
+# ==================== 令牌桶 ====================
+
+class TokenBucket:
+    """
+    可透支的令牌桶
+
+    reserve 直接扣除令牌並返回需要等待的秒數；餘額為負時後來的請求
+    等待得更久，等待中的請求因此按到達順序排隊。
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """扣除 amount 個令牌，返回需要等待的秒數"""
+        self._refill(now)
+        self.tokens -= amount
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 0:
+            wait = max(wait, -self.tokens / self.rate)
+        return wait
+
+    def adjust(self, amount: float, now: float):
+        """按實際用量校正（amount 為正表示多用了，負數表示退回）"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def sync(self, remaining: float, now: float, limit: Optional[float] = None):
+        """用服務端報告的剩餘額度校正（其他進程也在消耗同一配額）"""
+        if limit:
+            self.per_minute = limit
+            self.rate = limit / 60.0
+            self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self._refill(now)
+        self.tokens = min(self.tokens, remaining)
+
+    def block(self, until: float):
+        """在 until（monotonic 時間）之前不再放行請求"""
+        self.blocked_until = max(self.blocked_until, until)
+
+
+# ==================== 速率限制器 ====================
+
+class RateLimiter:
+    """按服務和模型限速，並負責可重試錯誤的退避重試"""
+
+    def __init__(self,
+                 model_limits: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY,
+                 max_wait: Optional[float] = None):
+        """
+        初始化速率限制器
+
+        Parameters:
+        -----------
+        model_limits : dict, optional
+            {服務: {"rpm": ..., "tpm": ...}}，每個模型各自的預設限額
+        max_retries : int
+            可重試錯誤（429、5xx、超時）的最大重試次數
+        base_delay, max_delay : float
+            指數退避的初始和最大等待（秒）
+        max_wait : float, optional
+            排隊等待的上限（秒），超過時拋出 RateLimitExceeded；為 None 時一直排隊
+        """
+        self.model_limits = model_limits or DEFAULT_MODEL_LIMITS
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+
+        # (服務, 模型或 None) -> {"rpm": 桶, "tpm": 桶}；模型為 None 的是跨模型的服務級上限
+        self._buckets: Dict[Tuple[str, Optional[str]], Dict[str, TokenBucket]] = {}
+        self._overrides: Dict[Tuple[str, Optional[str]], Dict[str, Optional[float]]] = {}
+        self._stats: Dict[Tuple[str, Optional[str]], Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def configure(self,
+                  provider: str,
+                  model: Optional[str] = None,
+                  rpm: Optional[float] = None,
+                  tpm: Optional[float] = None):
+        """
+        設置限額
+
+        model 為 None 時設置服務級上限（該服務所有模型共享），
+        否則設置單個模型的限額。
+        """
+        key = (provider, model)
+        with self._lock:
+            self._overrides[key] = {"rpm": rpm, "tpm": tpm}
+            self._buckets.pop(key, None)
+
+    def limits(self, provider: str, model: Optional[str] = None) -> Dict[str, Optional[float]]:
+        """當前生效的限額"""
+        with self._lock:
+            buckets = self._buckets.get((provider, model))
+            if buckets is not None:
+                return {kind: bucket.per_minute for kind, bucket in buckets.items()}
+            return dict(self._configured(provider, model))
+
+    def _configured(self, provider: str, model: Optional[str]) -> Dict[str, Optional[float]]:
+        override = self._overrides.get((provider, model))
+        if override is not None:
+            return override
+        if model is None:
+            return {}
+        return self.model_limits.get(provider, {})
+
+    def _bucket_set(self, provider: str, model: Optional[str]) -> Dict[str, TokenBucket]:
+        key = (provider, model)
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = self._buckets[key] = {
+                kind: TokenBucket(limit)
+                for kind, limit in self._configured(provider, model).items() if limit
+            }
+        return buckets
+
+    def _all_buckets(self, provider: str, model: Optional[str]) -> List[Tuple[str, TokenBucket]]:
+        """服務級和模型級的 [(類型, 桶), ...]"""
+        buckets = list(self._bucket_set(provider, None).items())
+        if model is not None:
+            buckets.extend(self._bucket_set(provider, model).items())
+        return buckets
+
+    def _stat(self, provider: str, model: Optional[str]) -> Dict[str, float]:
+        return self._stats.setdefault((provider, model), {
+            "requests": 0, "queued": 0, "wait_seconds": 0.0,
+            "retries": 0, "rate_limited": 0, "tokens": 0,
+        })
+
+    # ==================== 取得額度 ====================
+
+    def reserve(self, provider: str, model: Optional[str], tokens: float = 0) -> float:
+        """預留一個請求和 tokens 個 token，返回需要等待的秒數"""
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._all_buckets(provider, model)
+            wait = 0.0
+            for kind, bucket in buckets:
+                wait = max(wait, bucket.reserve(1 if kind == "rpm" else tokens, now))
+            stat = self._stat(provider, model)
+            stat["requests"] += 1
+            if self.max_wait is not None and wait > self.max_wait:
+                # 不排隊就退回預留的額度
+                for kind, bucket in buckets:
+                    bucket.adjust(-(1 if kind == "rpm" else tokens), now)
+                raise RateLimitExceeded(provider, model, wait)
+            if wait > 0:
+                stat["queued"] += 1
+                stat["wait_seconds"] += wait
+        return wait
+
+    def acquire(self, provider: str, model: Optional[str], tokens: float = 0):
+        """取得額度，不足時在當前線程中排隊等待"""
+        wait = self.reserve(provider, model, tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, provider: str, model: Optional[str], tokens: float = 0):
+        """取得額度，不足時異步排隊等待"""
+        wait = self.reserve(provider, model, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # ==================== 反饋 ====================
+
+    def record_usage(self, provider: str, model: Optional[str], estimated: float, actual: Optional[float]):
+        """用響應中的 usage 校正 TPM 桶（預留時用的是估算值）"""
+        if actual is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for kind, bucket in self._all_buckets(provider, model):
+                if kind == "tpm":
+                    bucket.adjust(actual - estimated, now)
+            self._stat(provider, model)["tokens"] += actual
+
+    def update_from_headers(self, provider: str, model: Optional[str], headers):
+        """
+        按 OpenAI 的 x-ratelimit-* 響應頭校正模型的令牌桶
+
+        limit-* 是賬號在該模型上的實際限額，remaining-* 是服務端看到的剩餘額度。
+        """
+        if headers is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._bucket_set(provider, model)
+            for kind, suffix in (("rpm", "requests"), ("tpm", "tokens")):
+                remaining = _header(headers, f"x-ratelimit-remaining-{suffix}")
+                if remaining is None:
+                    continue
+                try:
+                    remaining = float(remaining)
+                    limit = float(_header(headers, f"x-ratelimit-limit-{suffix}") or 0) or None
+                except ValueError:
+                    continue
+                bucket = buckets.get(kind)
+                if bucket is None and limit:
+                    bucket = buckets[kind] = TokenBucket(limit)
+                if bucket is None:
+                    continue
+                bucket.sync(remaining, now, limit)
+                if remaining <= 0:
+                    reset = parse_duration(_header(headers, f"x-ratelimit-reset-{suffix}"))
+                    if reset:
+                        bucket.block(now + reset)
+
+    def backoff(self, provider: str, model: Optional[str], error: Exception, attempt: int) -> float:
+        """
+        計算重試前的等待秒數
+
+        服務端給出 Retry-After 時照做（加少量抖動，避免所有等待者同時醒來），
+        否則使用 full jitter 指數退避。速率限制錯誤會讓該模型的所有請求一起暫停。
+        """
+        suggested = retry_after(error)
+        if suggested is not None:
+            delay = min(self.max_delay, suggested) * random.uniform(1.0, 1.1)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+        with self._lock:
+            stat = self._stat(provider, model)
+            stat["retries"] += 1
+            if classify_error(error) == "rate_limit":
+                stat["rate_limited"] += 1
+                until = time.monotonic() + delay
+                for bucket in self._bucket_set(provider, model).values():
+                    bucket.block(until)
+        return delay
+
+    # ==================== 帶重試的調用 ====================
+
+    def call(self, provider: str, model: Optional[str], tokens: float, fn: Callable[[], Any]) -> Any:
+        """
+        在限速內調用 fn，可重試錯誤按退避重試，重試用盡或不可重試時拋出原異常
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(provider, model, tokens)
+            try:
+                return fn()
+            except Exception as e:
+                if classify_error(e) not in RETRYABLE_ERRORS or attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff(provider, model, e, attempt))
+
+    async def call_async(self,
+                         provider: str,
+                         model: Optional[str],
+                         tokens: float,
+                         make_call: Callable[[], Awaitable]) -> Any:
+        """call 的異步版本；make_call 每次重試都會重新調用"""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(provider, model, tokens)
+            try:
+                return await make_call()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if classify_error(e) not in RETRYABLE_ERRORS or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff(provider, model, e, attempt))
+
+    def stats(self) -> Dict[str, Dict]:
+        """各服務/模型的請求數、排隊次數、等待時間、重試和 429 次數，以及當前限額"""
+        with self._lock:
+            result = {}
+            for (provider, model), stat in self._stats.items():
+                buckets = self._buckets.get((provider, model), {})
+                result[f"{provider}/{model or '*'}"] = dict(
+                    stat,
+                    limits={kind: bucket.per_minute for kind, bucket in buckets.items()},
+                )
+            return result
+
+
+def _text_of(contents) -> str:
+    """取出請求內容中的文本（OpenAI messages、Gemini contents 或純字符串），跳過圖片數據"""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return "".join(_text_of(contents.get(field)) for field in ("content", "parts", "text"))
+    if isinstance(contents, (list, tuple)):
+        return "".join(_text_of(item) for item in contents)
+    return ""
+
+
+def estimate_request_tokens(contents, max_tokens: Optional[int] = None) -> int:
+    """
+    估算一次請求計入 TPM 的 token 數：輸入加上預留的輸出長度
+
+    OpenAI 按 max_tokens 預扣輸出額度，因此輸出部分使用 max_tokens。
+    """
+    return estimate_tokens(_text_of(contents)) + (max_tokens or DEFAULT_OUTPUT_TOKENS)
+
+
+# ==================== 進程級共享限制器 ====================
+
+_default_rate_limiter: Optional[RateLimiter] = None
+_default_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """獲取進程內共享的速率限制器（配額按 API key 計算，同一進程內所有會話共享）"""
+    global _default_rate_limiter
+    with _default_rate_limiter_lock:
+        if _default_rate_limiter is None:
+            _default_rate_limiter = RateLimiter()
+        return _default_rate_limiter
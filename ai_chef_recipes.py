@@ -0,0 +1,367 @@
+"""
+AI 廚師顧問 - 菜譜庫模組
+AI Chef Advisor - Recipe Store Module
+
+持久保存生成過的菜譜：相同請求直接從本地返回，並支持對 菜名/步驟/烹飪技巧
+的全文檢索，以及按現有食材覆蓋率排序的「用這些食材能做什麼」查詢
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from ai_chef_cache import make_cache_key
+from ai_chef_parsing import is_complete_result
+from ai_chef_ingredients import clean_name, normalize_ingredients
+
+
+DEFAULT_RECIPE_DB_PATH = os.getenv(
+    "AI_CHEF_RECIPE_DB_PATH",
+    str(Path(__file__).parent / ".cache" / "ai_chef_recipes.sqlite3")
+)
+
+# 幾乎每道菜都用、家裡通常都有的調味料，不計入食材覆蓋率
+PANTRY_STAPLES = frozenset({"鹽", "糖", "水", "食用油", "醬油", "黑胡椒", "米酒", "太白粉", "雞粉"})
+
+
+def _segment(text: str) -> str:
+    """
+    把文本拆成以空格分隔的單字，供 FTS5 索引
+
+    unicode61 分詞器會把一整段連續的中文當成一個詞；逐字索引後，
+    查詢時用短語匹配連續的字，等同於子串檢索。
+    """
+    return " ".join(ch for ch in text if not ch.isspace())
+
+
+def _as_text(value) -> str:
+    if isinstance(value, list):
+        return "\n".join(str(item) for item in value)
+    if isinstance(value, dict):
+        return "\n".join(f"{k} {v}" for k, v in value.items())
+    return str(value or "")
+
+
+def _recipe_ingredients(recipe: Dict) -> List[str]:
+    """菜譜 材料 欄位中的標準食材名稱"""
+    materials = recipe.get("材料")
+    if isinstance(materials, dict):
+        names = list(materials.keys())
+    elif isinstance(materials, list):
+        names = [str(item) for item in materials]
+    else:
+        names = []
+    return normalize_ingredients(names) or []
+
+
+def recipe_request_key(dish_name: str,
+                       difficulty: str = "medium",
+                       servings: int = 2,
+                       available_ingredients: Optional[List[str]] = None,
+                       cooking_time_limit: Optional[int] = None) -> str:
+    """菜譜請求的鍵；與服務和模型無關，任何模型生成的菜譜都可復用"""
+    return make_cache_key(
+        "recipe_store", "", "",
+        dish_name=clean_name(dish_name),
+        difficulty=difficulty,
+        servings=servings,
+        available_ingredients=normalize_ingredients(available_ingredients) or [],
+        cooking_time_limit=cooking_time_limit
+    )
+
+
+class RecipeStore:
+    """SQLite 菜譜庫：FTS5 全文索引 + 食材倒排索引"""
+
+    def __init__(self, path: Optional[str] = DEFAULT_RECIPE_DB_PATH):
+        """
+        初始化菜譜庫
+
+        Parameters:
+        -----------
+        path : str, optional
+            SQLite 文件路徑；為 None 時僅使用記憶體
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS recipes (
+                   id INTEGER PRIMARY KEY,
+                   request_key TEXT UNIQUE,
+                   name TEXT NOT NULL,
+                   data TEXT NOT NULL,
+                   ingredient_count INTEGER NOT NULL,
+                   created_at REAL NOT NULL,
+                   hits INTEGER NOT NULL DEFAULT 0
+               );
+               CREATE TABLE IF NOT EXISTS recipe_ingredients (
+                   ingredient TEXT NOT NULL,
+                   recipe_id INTEGER NOT NULL,
+                   staple INTEGER NOT NULL DEFAULT 0,
+                   PRIMARY KEY (ingredient, recipe_id)
+               ) WITHOUT ROWID;
+               CREATE INDEX IF NOT EXISTS recipe_ingredients_by_recipe
+                   ON recipe_ingredients (recipe_id);"""
+        )
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(name, steps, tips)"
+            )
+            self.full_text = True
+        except sqlite3.OperationalError:
+            # SQLite 未編譯 FTS5 時退回 LIKE 查詢
+            self.full_text = False
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+
+    # ==================== 寫入 ====================
+
+    def add(self,
+            recipe: Dict,
+            dish_name: Optional[str] = None,
+            difficulty: str = "medium",
+            servings: int = 2,
+            available_ingredients: Optional[List[str]] = None,
+            cooking_time_limit: Optional[int] = None) -> Optional[int]:
+        """
+        保存菜譜
+
+        Parameters:
+        -----------
+        recipe : dict
+            generate_recipe 返回的菜譜；錯誤和未完整解析的結果不保存
+        dish_name, difficulty, servings, available_ingredients, cooking_time_limit
+            生成該菜譜的請求參數，用於 get 精確查找；dish_name 為 None 時
+            只加入檢索索引
+
+        Returns:
+        --------
+        int or None
+            菜譜編號
+        """
+        if not is_complete_result(recipe):
+            return None
+        name = str(recipe.get("菜名") or dish_name or "")
+        request_key = recipe_request_key(
+            dish_name, difficulty, servings, available_ingredients, cooking_time_limit
+        ) if dish_name else None
+        ingredients = _recipe_ingredients(recipe)
+
+        with self._lock:
+            if request_key:
+                # 同一請求重新生成時以新菜譜取代舊菜譜
+                row = self._conn.execute(
+                    "SELECT id FROM recipes WHERE request_key = ?", (request_key,)
+                ).fetchone()
+                if row:
+                    self._delete(row[0])
+            cursor = self._conn.execute(
+                "INSERT INTO recipes (request_key, name, data, ingredient_count, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (request_key, name, json.dumps(recipe, ensure_ascii=False),
+                 sum(1 for i in ingredients if i not in PANTRY_STAPLES), time.time())
+            )
+            recipe_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO recipe_ingredients (ingredient, recipe_id, staple) VALUES (?, ?, ?)",
+                [(i, recipe_id, int(i in PANTRY_STAPLES)) for i in ingredients]
+            )
+            if self.full_text:
+                self._conn.execute(
+                    "INSERT INTO recipes_fts (rowid, name, steps, tips) VALUES (?, ?, ?, ?)",
+                    (recipe_id, _segment(name), _segment(_as_text(recipe.get("步驟"))),
+                     _segment(_as_text(recipe.get("烹飪技巧"))))
+                )
+            self._conn.commit()
+        return recipe_id
+
+    def delete(self, recipe_id: int):
+        """刪除菜譜"""
+        with self._lock:
+            self._delete(recipe_id)
+            self._conn.commit()
+
+    def clear(self):
+        """清空菜譜庫和計數器"""
+        with self._lock:
+            self._conn.execute("DELETE FROM recipes")
+            self._conn.execute("DELETE FROM recipe_ingredients")
+            if self.full_text:
+                self._conn.execute("DELETE FROM recipes_fts")
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    # ==================== 查詢 ====================
+
+    def get(self,
+            dish_name: str,
+            difficulty: str = "medium",
+            servings: int = 2,
+            available_ingredients: Optional[List[str]] = None,
+            cooking_time_limit: Optional[int] = None) -> Optional[Dict]:
+        """按請求參數精確查找之前生成的菜譜，沒有時返回 None"""
+        request_key = recipe_request_key(
+            dish_name, difficulty, servings, available_ingredients, cooking_time_limit
+        )
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, data FROM recipes WHERE request_key = ?", (request_key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE recipes SET hits = hits + 1 WHERE id = ?", (row[0],))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[1])
+
+    def get_recipe(self, recipe_id: int) -> Optional[Dict]:
+        """按編號讀取菜譜"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        全文檢索 菜名/步驟/烹飪技巧
+
+        Parameters:
+        -----------
+        query : str
+            關鍵詞，空格分隔的多個詞需同時出現
+        limit : int
+            最多返回的菜譜數
+
+        Returns:
+        --------
+        list
+            [{"id": ..., "菜名": ..., "菜譜": {...}}, ...]，按相關度排序（菜名命中權重最高）
+        """
+        terms = [t for t in query.split() if t]
+        if not terms:
+            return []
+        with self._lock:
+            if self.full_text:
+                match = " AND ".join('"{}"'.format(_segment(t).replace('"', '""')) for t in terms)
+                rows = self._conn.execute(
+                    "SELECT r.id, r.name, r.data FROM recipes_fts f JOIN recipes r ON r.id = f.rowid "
+                    "WHERE recipes_fts MATCH ? ORDER BY bm25(recipes_fts, 10.0, 1.0, 2.0) LIMIT ?",
+                    (match, limit)
+                ).fetchall()
+            else:
+                condition = " AND ".join(["data LIKE ?"] * len(terms))
+                rows = self._conn.execute(
+                    f"SELECT id, name, data FROM recipes WHERE {condition} ORDER BY created_at DESC LIMIT ?",
+                    [f"%{t}%" for t in terms] + [limit]
+                ).fetchall()
+        return [{"id": i, "菜名": name, "菜譜": json.loads(data)} for i, name, data in rows]
+
+    def find_by_ingredients(self,
+                            ingredients: Iterable[str],
+                            limit: int = 10,
+                            min_coverage: float = 0.0) -> List[Dict]:
+        """
+        用現有食材能做的菜：按食材覆蓋率排序
+
+        覆蓋率 = 現有食材覆蓋的菜譜食材數 / 菜譜食材數（均不含 PANTRY_STAPLES 中的調味料）。
+
+        Parameters:
+        -----------
+        ingredients : iterable
+            現有食材，名稱會先規整為標準名
+        limit : int
+            最多返回的菜譜數
+        min_coverage : float
+            最低覆蓋率（0-1）
+
+        Returns:
+        --------
+        list
+            [{"id", "菜名", "覆蓋率", "已有食材", "缺少食材", "菜譜"}, ...]
+        """
+        available = [i for i in (normalize_ingredients(list(ingredients)) or []) if i not in PANTRY_STAPLES]
+        if not available:
+            return []
+        placeholders = ",".join("?" * len(available))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT r.id, r.name, r.data, COUNT(*) AS matched,
+                           CAST(COUNT(*) AS REAL) / MAX(r.ingredient_count, 1) AS coverage
+                    FROM recipe_ingredients ri JOIN recipes r ON r.id = ri.recipe_id
+                    WHERE ri.ingredient IN ({placeholders}) AND ri.staple = 0
+                    GROUP BY r.id
+                    HAVING coverage >= ?
+                    ORDER BY coverage DESC, matched DESC, r.hits DESC
+                    LIMIT ?""",
+                available + [min_coverage, limit]
+            ).fetchall()
+            needed = {}
+            for recipe_id, *_ in rows:
+                needed[recipe_id] = [
+                    ingredient for (ingredient,) in self._conn.execute(
+                        "SELECT ingredient FROM recipe_ingredients WHERE recipe_id = ? AND staple = 0",
+                        (recipe_id,)
+                    )
+                ]
+
+        have = set(available)
+        return [
+            {
+                "id": recipe_id,
+                "菜名": name,
+                "覆蓋率": round(coverage, 3),
+                "已有食材": [i for i in needed[recipe_id] if i in have],
+                "缺少食材": [i for i in needed[recipe_id] if i not in have],
+                "菜譜": json.loads(data),
+            }
+            for recipe_id, name, data, _, coverage in rows
+        ]
+
+    def stats(self) -> Dict:
+        """返回菜譜數和命中統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "recipes": len(self),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "full_text": self.full_text,
+            }
+
+    # ==================== 內部方法 ====================
+
+    def _delete(self, recipe_id: int):
+        self._conn.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
+        self._conn.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
+        if self.full_text:
+            self._conn.execute("DELETE FROM recipes_fts WHERE rowid = ?", (recipe_id,))
+
+
+# ==================== 進程級共享菜譜庫 ====================
+
+_default_store: Optional[RecipeStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_recipe_store() -> RecipeStore:
+    """獲取進程內共享的菜譜庫"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = RecipeStore()
+        return _default_store
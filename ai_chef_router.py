@@ -0,0 +1,325 @@
+"""
+AI 廚師顧問 - 模型路由模組
+AI Chef Advisor - Model Router Module
+
+記錄每個模型的健康狀況（錯誤類型、延遲 EWMA、熔斷器狀態），
+把請求直接發送到最佳的健康模型，而不是每次都從列表第一個開始試
+"""
+
+import re
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+
+# 熔斷器狀態
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# 消息中的 HTTP 狀態碼只在開頭或冒號後（"429 Quota exceeded"）、或緊跟 status/code 字樣時才算數，
+# 避免把消息裡碰巧出現的數字（模型名、請求編號、token 數）當作狀態碼
+_STATUS_IN_MESSAGE_RE = re.compile(r"(?:^|[:：]\s*|\b(?:status(?:[_ ]code)?|code|http)\b[\s:=-]*)([45]\d\d)\b")
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """異常攜帶的 HTTP 狀態碼（OpenAI 的 status_code、Google 的 code、響應對象的 status_code）"""
+    for status in (getattr(error, "status_code", None),
+                   getattr(error, "code", None),
+                   getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(status, int) and not isinstance(status, bool):
+            return status
+    return None
+
+
+def classify_error(error: Exception) -> str:
+    """
+    把異常歸類為錯誤類型
+
+    依次按異常攜帶的狀態碼、異常類型名稱判斷，都沒有時才看消息文本
+    （例如調用指標從錯誤字符串重建的異常）。
+
+    Returns:
+    --------
+    str
+        "rate_limit", "not_found", "auth", "timeout", "server" 或 "other"
+    """
+    status = _status_code(error)
+    if status is not None:
+        kind = _classify_status(status)
+        if kind is not None:
+            return kind
+
+    name = type(error).__name__.lower()
+    if "resourceexhausted" in name or "ratelimit" in name:
+        return "rate_limit"
+    if "notfound" in name:
+        return "not_found"
+    if "permission" in name or "unauthenticated" in name or "authentication" in name:
+        return "auth"
+    if "timeout" in name or "deadline" in name:
+        return "timeout"
+    if "unavailable" in name or "internalservererror" in name:
+        return "server"
+
+    message = str(error).lower()
+    match = _STATUS_IN_MESSAGE_RE.search(message)
+    kind = _classify_status(int(match.group(1))) if match else None
+    if kind is not None:
+        return kind
+    if "quota" in message or "rate limit" in message:
+        return "rate_limit"
+    if "not found" in message:
+        return "not_found"
+    if "api key" in message or "api_key" in message:
+        return "auth"
+    if "timed out" in message:
+        return "timeout"
+    return "other"
+
+
+def _classify_status(status: int) -> Optional[str]:
+    if status == 429:
+        return "rate_limit"
+    if status == 404:
+        return "not_found"
+    if status in (401, 403):
+        return "auth"
+    if status in (408, 504):
+        return "timeout"
+    if status >= 500:
+        return "server"
+    return None
+
+
+class ModelHealth:
+    """單個模型的健康記錄"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.state = CLOSED
+        self.latency_ewma: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.recent_errors = deque(maxlen=10)
+        self.opened_at: Optional[float] = None
+        self.cooldown = 0.0
+        self.probing_since: Optional[float] = None
+
+    def probing(self, now: float, probe_timeout: float) -> bool:
+        """是否有半開探測正在進行（超時未回報的探測視為已結束）"""
+        return self.probing_since is not None and now - self.probing_since < probe_timeout
+
+    def retry_at(self) -> float:
+        """熔斷器允許半開探測的時間點"""
+        return (self.opened_at or 0.0) + self.cooldown
+
+    def to_dict(self) -> Dict:
+        return {
+            "state": self.state,
+            "latency_ewma": self.latency_ewma,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "recent_errors": [
+                {"time": ts, "type": kind} for ts, kind in self.recent_errors
+            ],
+            "retry_in": max(0.0, self.retry_at() - time.time()) if self.state == OPEN else 0.0,
+        }
+
+
+class ModelRouter:
+    """基於熔斷器和延遲 EWMA 的模型路由器"""
+
+    # 各錯誤類型觸發熔斷所需的連續失敗次數
+    # 速率限制（None）不觸發熔斷：限速器已按 Retry-After 暫停該模型的請求，
+    # 熔斷只會讓模型在配額恢復後仍被跳過
+    TRIP_AFTER = {
+        "rate_limit": None,
+        "not_found": 1,
+        "auth": 1,
+        "timeout": 2,
+        "server": 2,
+        "other": 3,
+    }
+
+    def __init__(self,
+                 base_cooldown: float = 30.0,
+                 max_cooldown: float = 600.0,
+                 ewma_alpha: float = 0.3,
+                 slow_factor: float = 2.0,
+                 probe_timeout: float = 60.0):
+        """
+        初始化模型路由器
+
+        Parameters:
+        -----------
+        base_cooldown : float
+            首次熔斷後等待半開探測的秒數
+        max_cooldown : float
+            熔斷等待時間上限（秒），模型不存在時直接使用此值
+        ewma_alpha : float
+            延遲 EWMA 的平滑係數
+        slow_factor : float
+            延遲超過最快健康模型的此倍數時降低優先級
+        probe_timeout : float
+            半開探測名額的最長佔用時間（秒）；探測模型排在健康模型之後，
+            可能根本沒被嘗試，超時後名額自動釋放
+        """
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.ewma_alpha = ewma_alpha
+        self.slow_factor = slow_factor
+        self.probe_timeout = probe_timeout
+
+        self._health: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, model: str) -> ModelHealth:
+        health = self._health.get(model)
+        if health is None:
+            health = self._health[model] = ModelHealth(model)
+        return health
+
+    # ==================== 路由 ====================
+
+    def plan(self, candidates: List[str]) -> List[str]:
+        """
+        按健康狀況排列候選模型
+
+        熔斷中的模型被跳過；冷卻結束的模型作為半開探測放在健康模型之後
+        （同一時間只放行一個探測請求）。健康模型保持配置的優先順序，
+        但明顯偏慢的模型會被排到後面。
+
+        Parameters:
+        -----------
+        candidates : list
+            按偏好排列的模型名稱
+
+        Returns:
+        --------
+        list
+            本次請求應依次嘗試的模型
+        """
+        now = time.time()
+        with self._lock:
+            healthy, probes, blocked = [], [], []
+            for index, model in enumerate(candidates):
+                health = self._get(model)
+                if health.state == CLOSED:
+                    healthy.append((index, health))
+                elif health.state == OPEN and now >= health.retry_at():
+                    health.state = HALF_OPEN
+                    health.probing_since = now
+                    probes.append(model)
+                elif health.state == HALF_OPEN and not health.probing(now, self.probe_timeout):
+                    health.probing_since = now
+                    probes.append(model)
+                else:
+                    blocked.append(health)
+
+            latencies = [h.latency_ewma for _, h in healthy if h.latency_ewma is not None]
+            fastest = min(latencies) if latencies else None
+
+            def sort_key(item):
+                index, health = item
+                slow = (fastest is not None and health.latency_ewma is not None
+                        and health.latency_ewma > fastest * self.slow_factor)
+                return (slow, index)
+
+            ordered = [h.model for _, h in sorted(healthy, key=sort_key)] + probes
+
+            # 全部熔斷時，仍嘗試最早恢復的那個，避免直接失敗
+            if not ordered and blocked:
+                ordered = [min(blocked, key=lambda h: h.retry_at()).model]
+            return ordered
+
+    # ==================== 反饋 ====================
+
+    def record_success(self, model: str, latency: float):
+        """記錄一次成功調用及其延遲（秒）"""
+        with self._lock:
+            health = self._get(model)
+            if health.latency_ewma is None:
+                health.latency_ewma = latency
+            else:
+                health.latency_ewma += self.ewma_alpha * (latency - health.latency_ewma)
+            health.successes += 1
+            health.consecutive_failures = 0
+            health.state = CLOSED
+            health.probing_since = None
+            health.opened_at = None
+            health.cooldown = 0.0
+
+    def record_failure(self, model: str, error: Exception) -> str:
+        """
+        記錄一次失敗調用
+
+        Returns:
+        --------
+        str
+            錯誤類型
+        """
+        kind = classify_error(error)
+        with self._lock:
+            health = self._get(model)
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.recent_errors.append((time.time(), kind))
+
+            trip_after = self.TRIP_AFTER.get(kind, 3)
+            if trip_after is None:
+                # 模型本身可用，只是暫時超出配額：歸還探測名額，不改變熔斷狀態
+                health.probing_since = None
+            elif health.state == HALF_OPEN:
+                # 探測失敗，加倍冷卻時間
+                self._trip(health, min(self.max_cooldown, max(self.base_cooldown, health.cooldown * 2)))
+            elif health.consecutive_failures >= trip_after:
+                cooldown = self.max_cooldown if kind == "not_found" else self.base_cooldown
+                self._trip(health, cooldown)
+        return kind
+
+    def release(self, model: str):
+        """未得出結果的半開探測（例如調用被取消）歸還探測名額"""
+        with self._lock:
+            health = self._get(model)
+            health.probing_since = None
+
+    def _trip(self, health: ModelHealth, cooldown: float):
+        health.state = OPEN
+        health.opened_at = time.time()
+        health.cooldown = cooldown
+        health.probing_since = None
+
+    # ==================== 檢視 ====================
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """返回每個模型的健康狀況"""
+        with self._lock:
+            return {model: health.to_dict() for model, health in self._health.items()}
+
+    def reset(self, model: Optional[str] = None):
+        """重置某個模型（或全部模型）的健康記錄"""
+        with self._lock:
+            if model is None:
+                self._health.clear()
+            else:
+                self._health.pop(model, None)
+
+
+# ==================== 進程級共享路由器 ====================
+
+_default_router: Optional[ModelRouter] = None
+_default_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    """獲取進程內共享的模型路由器"""
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = ModelRouter()
+        return _default_router
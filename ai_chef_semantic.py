@@ -0,0 +1,284 @@
+"""
+AI 廚師顧問 - 語義緩存模組
+AI Chef Advisor - Semantic Cache Module
+
+用雜湊字符 n-gram 向量表示請求文本，在 NumPy 矩陣中按餘弦相似度查找
+近似重複的請求（"番茄炒蛋" / "番茄炒雞蛋"、"How to make tomato and egg
+stir-fry?" / "tomato egg stir fry recipe"），相似度超過閾值時直接返回緩存的回應
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ai_chef_ingredients import to_traditional, get_ingredient_index
+
+
+DEFAULT_SEMANTIC_THRESHOLD = float(os.getenv("AI_CHEF_SEMANTIC_THRESHOLD", "0.85"))
+DEFAULT_SEMANTIC_ENTRIES = 2048
+DEFAULT_SEMANTIC_TTL = 24 * 3600
+EMBEDDING_DIM = 1024
+# 食材名稱決定一道菜是什麼，權重高於其他字；英文字符三元組只用於容錯
+INGREDIENT_WEIGHT = 2.0
+TRIGRAM_WEIGHT = 0.3
+
+# 只表達「怎麼做」這類意圖、不區分具體請求的詞
+_STOPWORDS = frozenset("""
+a an the and or of for to with in on how what make making cook cooking recipe recipes
+please can could you i me my is are do does tips way best easy
+""".split())
+_STOP_PHRASES = ("怎麼做", "如何做", "怎麼煮", "做法", "食譜", "菜譜", "請問", "教我", "一下", "的")
+
+_CJK_RE = re.compile(r"[㐀-鿿]+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+# ==================== 向量化 ====================
+
+def _normalize_text(text: str) -> str:
+    text = to_traditional(str(text)).casefold()
+    for phrase in _STOP_PHRASES:
+        text = text.replace(phrase, " ")
+    return text
+
+
+def normalized_key(text: str) -> str:
+    """去掉意圖詞、標點和空白並轉為繁體的文本，用於只接受「寫法不同、內容相同」的精確命中"""
+    return "".join(ch for ch in _normalize_text(text) if ch.isalnum())
+
+
+def _stem(word: str) -> str:
+    """極簡英文詞幹：去掉常見複數和動詞詞尾"""
+    for suffix in ("ies", "es", "ing", "ed", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def _features(text: str) -> List[Tuple[str, float]]:
+    """
+    提取 (特徵, 權重)
+
+    中文先按食材名稱切分：食材統一為標準名（"蛋"、"雞蛋" 都是 雞蛋），
+    作為高權重特徵，其餘逐字；再加上相鄰片段組成的二元組。
+    切分只認繁簡寫法和真正的同義詞，營養相近的食材（牛腩/牛肉）保持不同；
+    單字名稱只在獨立成詞時替換（鴨蛋 不是 雞蛋，見 IngredientIndex.segment）。
+    緊貼在食材前的字組成的二元組（炒|麵條、煮|麵條）與食材同權重，避免只差一個字的不同菜被當成相同。
+    英文取詞幹和詞內字符三元組。
+    """
+    text = _normalize_text(text)
+    index = get_ingredient_index()
+    features = []
+    for run in _CJK_RE.findall(text):
+        pieces = index.segment(run)
+        for piece, is_ingredient in pieces:
+            features.append((f"i:{piece}", INGREDIENT_WEIGHT) if is_ingredient else (piece, 1.0))
+        features.extend(
+            (f"{a}|{b}", INGREDIENT_WEIGHT if is_ingredient and not a_is_ingredient else 1.0)
+            for (a, a_is_ingredient), (b, is_ingredient) in zip(pieces, pieces[1:])
+        )
+    for word in _WORD_RE.findall(text):
+        if word in _STOPWORDS:
+            continue
+        word = _stem(word)
+        features.append((f"w:{word}", 1.0))
+        padded = f"<{word}>"
+        features.extend((padded[i:i + 3], TRIGRAM_WEIGHT) for i in range(len(padded) - 2))
+    return features
+
+
+def embed_text(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    把文本映射為 L2 歸一化的 float32 向量（特徵雜湊 + 隨機符號）
+
+    Returns:
+    --------
+    numpy.ndarray
+        形狀為 (dim,) 的向量；沒有任何特徵時為全零
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += weight if (h >> 31) & 1 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# ==================== 語義緩存 ====================
+
+class SemanticCache:
+    """
+    按餘弦相似度命中的響應緩存
+
+    所有條目的向量放在一個 (容量, 維度) 的矩陣中，查詢是一次矩陣向量乘法；
+    只在同一命名空間（服務、模型和其他請求參數都相同）內比較。
+    滿了之後淘汰最久未用的條目。
+    """
+
+    def __init__(self,
+                 max_entries: int = DEFAULT_SEMANTIC_ENTRIES,
+                 threshold: float = DEFAULT_SEMANTIC_THRESHOLD,
+                 default_ttl: Optional[int] = DEFAULT_SEMANTIC_TTL,
+                 dim: int = EMBEDDING_DIM):
+        """
+        初始化語義緩存
+
+        Parameters:
+        -----------
+        max_entries : int
+            最大條目數
+        threshold : float
+            視為同一請求的最低餘弦相似度
+        default_ttl : int, optional
+            有效期（秒）；為 None 時永不過期
+        dim : int
+            向量維度
+        """
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.default_ttl = default_ttl
+        self.dim = dim
+
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._namespaces = np.full(max_entries, -1, dtype=np.int64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._expires = np.full(max_entries, np.inf, dtype=np.float64)
+        self._values: List[Optional[str]] = [None] * max_entries
+        self._texts: List[Optional[str]] = [None] * max_entries
+        self._keys: List[Optional[str]] = [None] * max_entries
+        self._namespace_ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_similarity = 0.0
+
+    def _namespace_id(self, namespace: str) -> int:
+        return self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+
+    # ==================== 讀寫 ====================
+
+    def get(self, namespace: str, text: str, exact: bool = False) -> Optional[Dict]:
+        """
+        查找語義相近的請求的緩存回應
+
+        Parameters:
+        -----------
+        namespace : str
+            服務、模型和除 text 外的請求參數的標識
+        text : str
+            請求文本
+        exact : bool
+            只接受規整後文本完全相同的條目（見 normalized_key）；用於對話這類
+            差一個詞意思就不同的請求（"怎樣保持翠綠" / "怎樣保持脆"）
+
+        Returns:
+        --------
+        dict or None
+            相似度最高且超過閾值的緩存值
+        """
+        vector = embed_text(text, self.dim)
+        now = time.time()
+        with self._lock:
+            namespace_id = self._namespace_ids.get(namespace)
+            if namespace_id is None or not vector.any():
+                self.misses += 1
+                return None
+            similarities = self._vectors @ vector
+            valid = (self._namespaces == namespace_id) & (self._expires > now)
+            if exact:
+                key = normalized_key(text)
+                valid &= np.array([k == key for k in self._keys])
+            similarities = np.where(valid, similarities, -1.0)
+            slot = int(np.argmax(similarities))
+            similarity = float(similarities[slot])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[slot] = now
+            self.hits += 1
+            self._hit_similarity += similarity
+            return json.loads(self._values[slot])
+
+    def set(self, namespace: str, text: str, value: Dict, ttl: Optional[int] = None):
+        """寫入回應；相同命名空間下的相同文本會覆蓋舊條目"""
+        vector = embed_text(text, self.dim)
+        if not vector.any():
+            return
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        raw = json.dumps(value, ensure_ascii=False)
+
+        with self._lock:
+            namespace_id = self._namespace_id(namespace)
+            same = np.flatnonzero(self._namespaces == namespace_id)
+            existing = [int(s) for s in same if self._texts[s] == text]
+            if existing:
+                slot = existing[0]
+            else:
+                free = np.flatnonzero(self._namespaces < 0)
+                if len(free):
+                    slot = int(free[0])
+                else:
+                    # 已過期的條目優先淘汰，其次是最久未用的
+                    expired = np.flatnonzero(self._expires <= now)
+                    slot = int(expired[0]) if len(expired) else int(np.argmin(self._last_used))
+                    self.evictions += 1
+
+            self._vectors[slot] = vector
+            self._namespaces[slot] = namespace_id
+            self._last_used[slot] = now
+            self._expires[slot] = now + ttl if ttl else np.inf
+            self._values[slot] = raw
+            self._texts[slot] = text
+            self._keys[slot] = normalized_key(text)
+
+    def clear(self):
+        """清空全部條目和計數器"""
+        with self._lock:
+            self._vectors[:] = 0
+            self._namespaces[:] = -1
+            self._last_used[:] = 0
+            self._expires[:] = np.inf
+            self._values = [None] * self.max_entries
+            self._texts = [None] * self.max_entries
+            self._keys = [None] * self.max_entries
+            self._namespace_ids.clear()
+            self.hits = self.misses = self.evictions = 0
+            self._hit_similarity = 0.0
+
+    def stats(self) -> Dict:
+        """返回命中統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "mean_hit_similarity": self._hit_similarity / self.hits if self.hits else 0.0,
+                "size": int((self._namespaces >= 0).sum()),
+                "threshold": self.threshold,
+            }
+
+
+# ==================== 進程級共享緩存 ====================
+
+_default_semantic_cache: Optional[SemanticCache] = None
+_default_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """獲取進程內共享的語義緩存"""
+    global _default_semantic_cache
+    with _default_semantic_cache_lock:
+        if _default_semantic_cache is None:
+            _default_semantic_cache = SemanticCache()
+        return _default_semantic_cache
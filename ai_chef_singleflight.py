@@ -0,0 +1,258 @@
+"""
+AI 廚師顧問 - 請求合併模組
+AI Chef Advisor - Request Coalescing (Single-Flight) Module
+
+同一時刻完全相同的上游請求（相同的提示詞、模型和參數）只發出一次，
+所有等待者共享同一個結果；流式請求由後台線程拉取，所有訂閱者從頭重放
+已收到的片段並繼續接收後續片段
+"""
+
+import json
+import asyncio
+import hashlib
+import threading
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+
+def _normalize(value: Any) -> Any:
+    """正規化請求內容：字符串折疊空白，二進制內容（圖片）取雜湊；保留列表順序"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, (bytes, bytearray)):
+        return "sha256:" + hashlib.sha256(value).hexdigest()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return repr(value)
+
+
+def flight_key(*parts, **params) -> str:
+    """
+    生成請求合併的鍵
+
+    與 make_cache_key 不同，消息列表的順序是有意義的，這裡不排序。
+    """
+    raw = json.dumps([_normalize(parts), _normalize(params)],
+                     ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class _SharedStream:
+    __slots__ = ("chunks", "finished", "error", "condition")
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.condition = threading.Condition()
+
+
+class SingleFlight:
+    """線程間的請求合併（Streamlit 每個會話在各自的線程中運行）"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self._lock = threading.Lock()
+
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        執行 fn；已有相同 key 的調用進行中時等待並共享其結果（或異常）
+
+        Parameters:
+        -----------
+        key : str
+            flight_key 生成的鍵
+        fn : callable
+            實際發出上游請求的函數
+
+        Returns:
+        --------
+        Any
+            fn 的返回值；返回值被所有等待者共享，應為不可變對象
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def stream(self, key: str, factory: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """
+        共享的流式請求
+
+        第一個請求者啟動後台線程拉取 factory() 的片段；每個訂閱者（包括第一個）
+        都從緩衝區讀取，因此某個訂閱者停止讀取不會阻塞其他訂閱者。
+        上游出錯時，所有訂閱者在讀完已收到的片段後收到同一個異常。
+        """
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = self._streams[key] = _SharedStream()
+                self.executions += 1
+                # 後台線程沿用發起者的上下文（調用指標記錄在發起者的請求上）
+                threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(self._pump, key, shared, factory),
+                    daemon=True
+                ).start()
+            else:
+                self.coalesced += 1
+        return self._subscribe(shared)
+
+    def stats(self) -> Dict:
+        """返回合併統計"""
+        with self._lock:
+            total = self.executions + self.coalesced
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalesce_rate": self.coalesced / total if total else 0.0,
+                "in_flight": len(self._calls) + len(self._streams),
+            }
+
+    # ==================== 內部方法 ====================
+
+    def _pump(self, key: str, shared: _SharedStream, factory: Callable[[], Iterator[str]]):
+        try:
+            for chunk in factory():
+                with shared.condition:
+                    shared.chunks.append(chunk)
+                    shared.condition.notify_all()
+        except BaseException as e:
+            shared.error = e
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+            with shared.condition:
+                shared.finished = True
+                shared.condition.notify_all()
+
+    @staticmethod
+    def _subscribe(shared: _SharedStream) -> Iterator[str]:
+        position = 0
+        while True:
+            with shared.condition:
+                while position >= len(shared.chunks) and not shared.finished:
+                    shared.condition.wait()
+                if position < len(shared.chunks):
+                    chunk = shared.chunks[position]
+                elif shared.error is not None:
+                    raise shared.error
+                else:
+                    return
+            position += 1
+            yield chunk
+
+
+class _AsyncFlight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    同一事件循環內的請求合併
+
+    上游請求在獨立的任務中執行，等待者通過 asyncio.shield 等待，
+    某個等待者被取消不會影響其他等待者；最後一個等待者被取消（或超時）時
+    不再有人需要結果，共享的請求隨之取消，釋放並發名額和配額。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _AsyncFlight] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, make_call: Callable[[], Awaitable]) -> Any:
+        """執行 make_call()；已有相同 key 的調用進行中時共享其結果（或異常）"""
+        flight = self._calls.get(key)
+        if flight is None:
+            flight = self._calls[key] = _AsyncFlight(asyncio.ensure_future(make_call()))
+            self.executions += 1
+
+            def _forget(done, key=key, flight=flight):
+                if self._calls.get(key) is flight:
+                    del self._calls[key]
+                if not done.cancelled():
+                    # 沒有等待者時也要取走異常，避免 "exception was never retrieved"
+                    done.exception()
+
+            flight.task.add_done_callback(_forget)
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                flight.task.cancel()
+                # 立即登出，之後的相同請求發起新的調用，而不是等待已取消的這一個
+                if self._calls.get(key) is flight:
+                    del self._calls[key]
+
+    def stats(self) -> Dict:
+        """返回合併統計"""
+        total = self.executions + self.coalesced
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesce_rate": self.coalesced / total if total else 0.0,
+            "in_flight": len(self._calls),
+        }
+
+
+# ==================== 進程級共享實例 ====================
+
+_default_single_flight: Optional[SingleFlight] = None
+_default_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """獲取進程內共享的請求合併器"""
+    global _default_single_flight
+    with _default_single_flight_lock:
+        if _default_single_flight is None:
+            _default_single_flight = SingleFlight()
+        return _default_single_flight
@@ -0,0 +1,111 @@
+"""
+AI 廚師顧問 - 流式輸出模組
+AI Chef Advisor - Streaming Module
+
+流式 JSON 菜譜的增量解析：頂層欄位（如 材料、步驟）一旦完整就立即可用
+"""
+
+import json
+from typing import Dict, Optional
+
+from ai_chef_parsing import parse_structured
+
+
+class RecipeStreamParser:
+    """
+    增量解析流式返回的菜譜 JSON
+
+    逐字掃描模型輸出，跟蹤字符串和括號嵌套深度；每當一個頂層成員
+    （"鍵": 值）結束，就單獨解析這一段並返回，無需等待整個 JSON 完成。
+    JSON 之前的說明文字或代碼圍欄會被忽略。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict = {}
+        self.finished = False
+        # 整段輸出的最終結果（見 finish）；直接給出完整結果的一方（例如緩存命中）可以預先設置
+        self.final: Optional[Dict] = None
+
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start: Optional[int] = None
+
+    def feed(self, delta: str) -> Dict:
+        """
+        輸入一段增量文本
+
+        Parameters:
+        -----------
+        delta : str
+            模型輸出的新片段
+
+        Returns:
+        --------
+        dict
+            本次新完成的頂層欄位
+        """
+        self.text += delta
+        completed = {}
+
+        text = self.text
+        while self._pos < len(text) and not self.finished:
+            ch = text[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._member_start is None:
+                # 尚未進入 JSON 對象
+                if ch == "{":
+                    self._depth = 1
+                    self._member_start = self._pos + 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_member(self._pos, completed)
+                    self.finished = True
+            elif ch == "," and self._depth == 1:
+                self._complete_member(self._pos, completed)
+                self._member_start = self._pos + 1
+
+            self._pos += 1
+
+        return completed
+
+    def _complete_member(self, end: int, completed: Dict):
+        segment = self.text[self._member_start:end].strip()
+        if not segment:
+            return
+        try:
+            member = json.loads("{" + segment + "}")
+        except ValueError:
+            # 模型輸出了不合法的成員（例如保留了 "..."），跳過
+            return
+        self.fields.update(member)
+        completed.update(member)
+
+    def result(self) -> Optional[Dict]:
+        """返回目前已解析出的欄位；沒有任何欄位時返回 None（未經結構校驗，只用於顯示進度）"""
+        return dict(self.fields) if self.fields else None
+
+    def finish(self, task_type: str = "recipe") -> Dict:
+        """
+        輸出結束後的最終結果
+
+        對全文做 parse_structured（JSON 提取和結構校驗，並記錄解析統計），只計算一次；
+        被截斷的輸出即使已有部分欄位，也會帶上 schema_errors 而不被當作完整結果。
+        """
+        if self.final is None:
+            self.final = parse_structured(self.text, task_type)
+        return self.final
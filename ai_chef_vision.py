@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 廚師顧問 - 本地菜品識別模組
+AI Chef Advisor - Local Dish Recognition Module
+
+離線、僅用 CPU 的菜品識別：從縮略圖計算 HSV/Lab 顏色直方圖和梯度紋理描述子，
+在預先構建的參考索引中做向量化的最近鄰搜索，返回排序後的菜名和置信度
+
+構建索引（目錄結構為 <根目錄>/<菜名>/*.jpg）:
+    python ai_chef_vision.py build reference_images/ -o data/dish_index.npz
+"""
+
+import os
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+# 特徵版本：特徵計算方式改變時遞增，舊索引需要重建
+FEATURE_VERSION = 1
+
+DEFAULT_INDEX_PATH = os.getenv(
+    "AI_CHEF_VISION_INDEX",
+    str(Path(__file__).parent / "data" / "dish_index.npz")
+)
+
+THUMBNAIL_SIZE = 64
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+# 直方圖分箱數
+HSV_BINS = (8, 4, 4)
+LAB_BINS = 6
+ORIENTATION_BINS = 8
+
+# 各特徵塊的權重（每塊先各自歸一化）
+BLOCK_WEIGHTS = {"hsv": 1.0, "lab": 1.0, "lab_stats": 0.5, "texture": 0.7}
+
+# 最近鄰投票的鄰居數和溫度
+NEIGHBOURS = 10
+VOTE_TEMPERATURE = 0.1
+
+
+# ==================== 特徵提取 ====================
+
+def load_thumbnail(image_path: str, size: int = THUMBNAIL_SIZE) -> np.ndarray:
+    """
+    讀取擺正後的 RGB 縮略圖
+
+    JPEG 使用 draft 模式直接在解碼時縮小，大圖也只需解碼很小一部分。
+
+    Returns:
+    --------
+    np.ndarray
+        形狀 (size, size, 3) 的 uint8 陣列
+    """
+    with Image.open(image_path) as image:
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image.resize((size, size), Image.BILINEAR), dtype=np.uint8)
+
+
+def _rgb_to_hsv(rgb: np.ndarray) -> np.ndarray:
+    """RGB (0-1) 轉 HSV (0-1)"""
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    delta = maxc - minc
+    safe = np.where(delta == 0, 1.0, delta)
+
+    hue = np.where(maxc == r, (g - b) / safe,
+          np.where(maxc == g, 2.0 + (b - r) / safe, 4.0 + (r - g) / safe))
+    hue = np.where(delta == 0, 0.0, (hue / 6.0) % 1.0)
+    saturation = np.where(maxc == 0, 0.0, delta / np.where(maxc == 0, 1.0, maxc))
+    return np.stack([hue, saturation, maxc], axis=-1)
+
+
+def _rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """sRGB (0-1) 轉 CIE Lab（D65）"""
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    matrix = np.array([[0.4124, 0.3576, 0.1805],
+                       [0.2126, 0.7152, 0.0722],
+                       [0.0193, 0.1192, 0.9505]])
+    xyz = linear @ matrix.T / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    lightness = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack([lightness, a, b], axis=-1)
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _texture_descriptor(gray: np.ndarray) -> np.ndarray:
+    """梯度方向直方圖（按幅值加權）加上邊緣密度和平均梯度"""
+    gy, gx = np.gradient(gray)
+    magnitude = np.hypot(gx, gy)
+    # 方向取 0-π，忽略梯度正負號
+    orientation = np.mod(np.arctan2(gy, gx), np.pi)
+    bins = np.minimum((orientation / np.pi * ORIENTATION_BINS).astype(int), ORIENTATION_BINS - 1)
+    histogram = np.bincount(bins.ravel(), weights=magnitude.ravel(), minlength=ORIENTATION_BINS)
+    histogram = histogram / (histogram.sum() or 1.0)
+    edge_density = float((magnitude > 0.1).mean())
+    return np.concatenate([histogram, [edge_density, float(magnitude.mean())]])
+
+
+def compute_features(pixels: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    從 RGB 縮略圖計算各特徵塊
+
+    Parameters:
+    -----------
+    pixels : np.ndarray
+        (H, W, 3) 的 uint8 陣列
+
+    Returns:
+    --------
+    dict
+        hsv, lab, lab_stats, texture 四個特徵塊
+    """
+    rgb = pixels.reshape(-1, 3).astype(np.float64) / 255.0
+
+    hsv = _rgb_to_hsv(rgb)
+    hsv_index = [np.minimum((hsv[:, i] * n).astype(int), n - 1) for i, n in enumerate(HSV_BINS)]
+    flat = np.ravel_multi_index(hsv_index, HSV_BINS)
+    hsv_hist = np.bincount(flat, minlength=int(np.prod(HSV_BINS))).astype(np.float64)
+
+    lab = _rgb_to_lab(rgb)
+    # a、b 通道在食物照片中大致落在 [-60, 80]
+    ab_index = np.clip(((lab[:, 1:] + 60) / 140 * LAB_BINS).astype(int), 0, LAB_BINS - 1)
+    lab_hist = np.bincount(ab_index[:, 0] * LAB_BINS + ab_index[:, 1],
+                           minlength=LAB_BINS * LAB_BINS).astype(np.float64)
+    lab_stats = np.concatenate([lab.mean(axis=0), lab.std(axis=0)]) / np.array([100, 128, 128, 50, 64, 64])
+
+    gray = rgb.reshape(pixels.shape).mean(axis=-1)
+    return {
+        "hsv": hsv_hist / hsv_hist.sum(),
+        "lab": lab_hist / lab_hist.sum(),
+        "lab_stats": lab_stats,
+        "texture": _texture_descriptor(gray),
+    }
+
+
+def feature_vector(pixels: np.ndarray) -> np.ndarray:
+    """
+    計算用於最近鄰搜索的特徵向量
+
+    每個特徵塊先各自 L2 歸一化並加權，整體再歸一化，
+    兩個向量的內積即為余弦相似度。
+    """
+    blocks = compute_features(pixels)
+    # 直方圖取平方根（Hellinger 核），避免少數大分箱主導相似度
+    for name in ("hsv", "lab"):
+        blocks[name] = np.sqrt(blocks[name])
+    vector = np.concatenate([
+        _normalize(block) * BLOCK_WEIGHTS[name] for name, block in blocks.items()
+    ])
+    return _normalize(vector).astype(np.float32)
+
+
+# 主要顏色的色相區間（HSV 色相 0-1）
+_COLOR_NAMES = [(0.04, "紅色"), (0.11, "橙色"), (0.18, "黃色"), (0.45, "綠色"),
+                (0.70, "藍色"), (0.92, "紫色"), (1.01, "紅色")]
+
+
+def dominant_color_names(pixels: np.ndarray, top: int = 3) -> List[str]:
+    """按像素佔比返回縮略圖中的主要顏色名稱"""
+    hsv = _rgb_to_hsv(pixels.reshape(-1, 3).astype(np.float64) / 255.0)
+    hue, saturation, value = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+    bounds = np.array([bound for bound, _ in _COLOR_NAMES])
+    names = np.array([name for _, name in _COLOR_NAMES], dtype=object)[np.searchsorted(bounds, hue)]
+    # 低飽和度和低亮度的像素按明暗歸類；偏暗的暖色是醬色/焦色
+    names = np.where((names != "藍色") & (names != "綠色") & (value < 0.55) & (saturation > 0.3),
+                     "棕色", names)
+    names = np.where(saturation < 0.18, np.where(value > 0.75, "白色", "灰色"), names)
+    names = np.where(value < 0.15, "黑色", names)
+    labels, counts = np.unique(names.astype(str), return_counts=True)
+    return [str(labels[i]) for i in np.argsort(-counts)[:top]]
+
+
+def _vector_for_path(image_path: str) -> Optional[np.ndarray]:
+    try:
+        return feature_vector(load_thumbnail(image_path))
+    except Exception:
+        return None
+
+
+# ==================== 參考索引 ====================
+
+class DishIndex:
+    """已標註參考圖片的特徵索引，支持向量化的最近鄰搜索"""
+
+    def __init__(self, vectors: np.ndarray, labels: np.ndarray):
+        if len(vectors) != len(labels):
+            raise ValueError("特徵數量與標籤數量不一致")
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.labels = np.asarray(labels)
+        self.names, self._label_ids = np.unique(self.labels, return_inverse=True)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @classmethod
+    def load(cls, path: str) -> "DishIndex":
+        """從 .npz 文件載入索引"""
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data["feature_version"]) if "feature_version" in data else 0
+            if version != FEATURE_VERSION:
+                raise ValueError(f"索引特徵版本 {version} 與當前版本 {FEATURE_VERSION} 不符，請重建索引")
+            return cls(data["vectors"], data["labels"])
+
+    def save(self, path: str):
+        """保存索引為 .npz 文件"""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, vectors=self.vectors, labels=self.labels.astype(str),
+                            feature_version=FEATURE_VERSION)
+
+    def search(self,
+               vector: np.ndarray,
+               top_k: int = 3,
+               min_confidence: float = 0.01) -> List[Tuple[str, float, float]]:
+        """
+        查找最相似的菜品
+
+        取最近的若干個參考圖片，按相似度的指數權重投票，
+        得票比例即為置信度。
+
+        Returns:
+        --------
+        list
+            [(菜名, 置信度, 最高相似度), ...]，按置信度從高到低排序
+        """
+        if not len(self):
+            return []
+        similarities = self.vectors @ vector.astype(np.float32)
+        k = min(NEIGHBOURS, len(similarities))
+        nearest = np.argpartition(-similarities, k - 1)[:k]
+
+        weights = np.exp((similarities[nearest] - 1.0) / VOTE_TEMPERATURE)
+        label_ids = self._label_ids[nearest]
+        votes = np.bincount(label_ids, weights=weights, minlength=len(self.names))
+        best = np.full(len(self.names), -1.0)
+        np.maximum.at(best, label_ids, similarities[nearest])
+
+        confidence = votes / votes.sum()
+        ranked = np.argsort(-confidence)[:top_k]
+        return [(str(self.names[i]), float(confidence[i]), float(best[i]))
+                for i in ranked if confidence[i] >= min_confidence]
+
+
+def build_index(image_dir: str, workers: Optional[int] = None) -> DishIndex:
+    """
+    從 <根目錄>/<菜名>/*.jpg 結構的圖片目錄構建索引
+
+    特徵提取在進程池中並行執行。
+    """
+    root = Path(image_dir)
+    paths, labels = [], []
+    for dish_dir in sorted(p for p in root.iterdir() if p.is_dir()):
+        for image_path in sorted(dish_dir.rglob("*")):
+            if image_path.suffix.lower() in IMAGE_EXTENSIONS:
+                paths.append(str(image_path))
+                labels.append(dish_dir.name)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        vectors = list(executor.map(_vector_for_path, paths, chunksize=16))
+
+    keep = [i for i, v in enumerate(vectors) if v is not None]
+    if not keep:
+        raise ValueError(f"在 {image_dir} 中沒有找到可用的參考圖片")
+    return DishIndex(np.stack([vectors[i] for i in keep]), np.array([labels[i] for i in keep]))
+
+
+_default_index: Optional[DishIndex] = None
+_default_index_path: Optional[str] = None
+_default_index_lock = threading.Lock()
+
+
+def get_dish_index(path: Optional[str] = None) -> Optional[DishIndex]:
+    """獲取進程內共享的參考索引；索引文件不存在時返回 None"""
+    global _default_index, _default_index_path
+    path = path or DEFAULT_INDEX_PATH
+    with _default_index_lock:
+        if _default_index_path != path:
+            _default_index = DishIndex.load(path) if os.path.exists(path) else None
+            _default_index_path = path
+        return _default_index
+
+
+# ==================== 命令行 ====================
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="AI Chef Assistant 本地菜品識別工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="從標註圖片目錄構建參考索引")
+    build.add_argument("image_dir", help="圖片目錄，每個子目錄名即菜名")
+    build.add_argument("-o", "--output", default=DEFAULT_INDEX_PATH, help="索引輸出路徑 (.npz)")
+    build.add_argument("--workers", type=int, default=None, help="特徵提取進程數")
+
+    identify = subparsers.add_parser("identify", help="用參考索引識別圖片")
+    identify.add_argument("images", nargs="+", help="圖片文件")
+    identify.add_argument("--index", default=DEFAULT_INDEX_PATH, help="索引路徑 (.npz)")
+    identify.add_argument("--top-k", type=int, default=3)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        index = build_index(args.image_dir, workers=args.workers)
+        index.save(args.output)
+        print(f"✅ 已索引 {len(index)} 張圖片、{len(index.names)} 道菜品 → {args.output}")
+    elif args.command == "identify":
+        index = DishIndex.load(args.index)
+        for image_path in args.images:
+            matches = index.search(feature_vector(load_thumbnail(image_path)), args.top_k)
+            ranked = ", ".join(f"{name} ({confidence:.0%})" for name, confidence, _ in matches)
+            print(f"{image_path}: {ranked}")
+
+
+if __name__ == "__main__":
+    main()
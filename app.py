@@ -3,24 +3,397 @@ import os
 from datetime import datetime
 from dotenv import load_dotenv
 
-# 加載 .env 文件 (強制重新加載)
-load_dotenv(override=True)
+
+@st.cache_resource(show_spinner=False)
+def load_environment():
+    """加載 .env 文件（每個進程只加載一次：AI 模組在導入時讀取配置，修改 .env 後需重啟應用）"""
+    load_dotenv(override=True)
+
+
+load_environment()
 
 # 導入 AI 模組
 try:
-    from ai_chef_functions import init_ai_chef
+    from ai_chef_functions import init_ai_chef, detect_service
+    from ai_chef_pool import get_client_pool
+    from ai_chef_streaming import RecipeStreamParser
+    from ai_chef_ingredients import split_ingredient_text
+    from ai_chef_metrics import get_metrics
+    from ai_chef_ratelimit import GEMINI_TIER
     AI_AVAILABLE = True
 except ImportError:
     AI_AVAILABLE = False
 
-# 檢查 API Key 是否配置 (優先檢查 Gemini)
+# API Key 狀態（調試面板顯示；是否啟用 AI 功能由 active_service 決定，本地模型不需要 Key）
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-HAS_API_KEY = bool(GEMINI_API_KEY or OPENAI_API_KEY)
 
 # 調試：在側邊欄顯示 API Key 狀態
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
 
+# 菜譜結果在 Streamlit 數據緩存中保留的時間和條目數（底層響應緩存和菜譜庫另有各自的期限）
+RECIPE_CACHE_TTL = 3600
+RECIPE_CACHE_ENTRIES = 256
+
+CHAT_AVATARS = {"user": "👤", "assistant": "👨‍🍳"}
+
+
+@st.cache_resource(show_spinner=False)
+def shared_client_pool():
+    """所有會話共用的客戶端連接池"""
+    return get_client_pool()
+
+
+@st.cache_resource(show_spinner=False)
+def shared_ai_chef():
+    """所有會話共用的 AI 廚師（服務檢測、對沖配置和客戶端在進程中只建立一次）"""
+    return init_ai_chef()
+
+
+@st.cache_resource(show_spinner=False)
+def active_service():
+    """
+    可用的 AI 服務（與 init_ai_chef 的自動檢測相同）
+
+    雲端 API Key、本地模型服務（AI_CHEF_LOCAL_SERVER_URL）或本地模型文件
+    （AI_CHEF_LOCAL_MODEL_PATH）任一可用即可；都沒有時為 "local"。
+    """
+    return detect_service()
+
+
+def get_ai_chef():
+    """獲取當前會話的 AI 廚師（與其他會話共用緩存和客戶端，只有對話記憶屬於本會話）"""
+    if "ai_chef" not in st.session_state:
+        st.session_state.ai_chef = shared_ai_chef().for_session()
+    return st.session_state.ai_chef
+
+
+@st.cache_data(ttl=RECIPE_CACHE_TTL, max_entries=RECIPE_CACHE_ENTRIES, show_spinner=False)
+def cached_recipe(dish_name, difficulty, servings, ingredients, cooking_time):
+    """
+    按輸入查找之前生成過的菜譜（不調用模型）
+
+    找不到時拋出 LookupError：異常不會進入 Streamlit 緩存，生成後再次查找即可命中。
+    """
+    recipe = shared_ai_chef().lookup_recipe(
+        dish_name, difficulty, servings, list(ingredients) or None, cooking_time
+    )
+    if recipe is None:
+        raise LookupError(dish_name)
+    return recipe
+
+
+def render_debug_panel():
+    """調試面板：API Key 狀態和每類 AI 調用的耗時、token、費用、緩存命中"""
+    st.markdown("### 🛠️ 調試信息")
+    st.write(f"**OpenAI Key**: {'✅' if OPENAI_API_KEY else '❌'}　**Gemini Key**: {'✅' if GEMINI_API_KEY else '❌'}")
+    if not AI_AVAILABLE:
+        return
+    st.write(f"**使用服務**: {active_service()}")
+    
+    pool = shared_client_pool().stats()
+    st.write(f"**連接池**: {pool['size']} 個客戶端　新建 {pool['created']} 次　複用 {pool['reused']} 次")
+    
+    limits = shared_ai_chef().rate_limiter.stats()
+    gemini_queued = sum(stat["queued"] for key, stat in limits.items() if key.startswith("gemini/"))
+    if gemini_queued and GEMINI_TIER == "free" and not os.getenv("AI_CHEF_GEMINI_RPM"):
+        # Gemini 沒有限額響應頭，排隊多半是免費層的預設限額造成的
+        st.warning(f"Gemini 請求因免費層預設限額（每模型 15 RPM）排隊 {gemini_queued} 次；"
+                   "付費賬號請設置 AI_CHEF_GEMINI_TIER=paid 或 AI_CHEF_GEMINI_RPM")
+    if limits:
+        with st.expander("速率限制"):
+            st.dataframe([dict(model=key, **stat) for key, stat in limits.items()],
+                         use_container_width=True, hide_index=True)
+    
+    memory = get_metrics().memory
+    summary = memory.summary() if memory is not None else []
+    if not summary:
+        st.caption("尚無 AI 調用記錄")
+        return
+    
+    total_cost = sum(row["cost_usd"] for row in summary)
+    total_tokens = sum(row["prompt_tokens"] + row["completion_tokens"] for row in summary)
+    st.write(f"**調用**: {sum(row['calls'] for row in summary)} 次　**Token**: {total_tokens}　**估算費用**: ${total_cost:.4f}")
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+    with st.expander("最近的調用"):
+        st.dataframe(memory.recent()[:50], use_container_width=True, hide_index=True)
+    with st.expander("Prometheus 格式"):
+        st.code(memory.prometheus_text(), language="text")
+
+
+def render_chat_message(msg):
+    """渲染一條對話消息（內容按 Markdown 顯示）"""
+    with st.chat_message(msg["role"], avatar=CHAT_AVATARS[msg["role"]]):
+        st.markdown(msg["content"])
+
+
+def send_chat_message(message, container):
+    """發送消息並把 AI 回應逐字渲染到對話框中，完成後只重新運行對話面板"""
+    st.session_state.ai_chat_history.append({"role": "user", "content": message})
+    
+    with container:
+        render_chat_message({"role": "user", "content": message})
+        with st.chat_message("assistant", avatar=CHAT_AVATARS["assistant"]):
+            placeholder = st.empty()
+    
+    placeholder.markdown("💬 AI Chef Assistant 🤖🤖🤖 Thinking... 🤖🤖🤖")
+    response = ""
+    try:
+        ai_chef = get_ai_chef()
+        for delta in ai_chef.chat_stream(message):
+            response += delta
+            placeholder.markdown(response + " ▌")
+    except Exception as e:
+        response = f"❌ 對話出錯: {str(e)}"
+    
+    st.session_state.ai_chat_history.append({"role": "assistant", "content": response})
+    st.rerun(scope="fragment")
+
+
+def render_recipe(recipe, dish_name, difficulty, servings, cooking_time):
+    """顯示菜譜（流式生成期間會隨著欄位完成反覆調用）"""
+    # Extract key information
+    st.markdown(f"### 🍳 {recipe.get('菜名', dish_name)}")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("難度", recipe.get('難度', difficulty))
+    with col2:
+        st.metric("烹飪時間", recipe.get('烹飪時間', f'{cooking_time}分鐘'))
+    with col3:
+        st.metric("份量", recipe.get('份量', f'{servings}人份'))
+    with col4:
+        st.metric("分類", recipe.get('分類', '其他'))
+    
+    st.divider()
+    
+    # Ingredients
+    if '材料' in recipe:
+        st.markdown("#### 📦 材料準備")
+        if isinstance(recipe['材料'], dict):
+            for material, amount in recipe['材料'].items():
+                st.write(f"- **{material}**: {amount}")
+        else:
+            st.write(recipe['材料'])
+    
+    # Steps
+    if '步驟' in recipe:
+        st.markdown("#### 👨‍🍳 烹飪步驟")
+        if isinstance(recipe['步驟'], list):
+            for step in recipe['步驟']:
+                st.write(f"{step}")
+        else:
+            st.write(recipe['步驟'])
+    
+    # Tips
+    if '烹飪技巧' in recipe:
+        st.markdown("#### 🔥 烹飪技巧")
+        if isinstance(recipe['烹飪技巧'], list):
+            for tip in recipe['烹飪技巧']:
+                st.markdown(f"- {tip}")
+        else:
+            st.write(recipe['烹飪技巧'])
+
+
+@st.fragment
+def render_chat_panel():
+    """對話面板（發送消息時只重新運行這個片段，不重跑整個頁面）"""
+    st.markdown("### 💬 Chat with AI Chef")
+    st.write("Ask any cooking-related questions, and the AI chef will answer for you")
+    
+    # 初始化對話歷史
+    if "ai_chat_history" not in st.session_state:
+        st.session_state.ai_chat_history = []
+    
+    # Chat History
+    st.markdown("#### 📝 對話記錄")
+    chat_container = st.container(height=350, border=True)
+    
+    with chat_container:
+        if not st.session_state.ai_chat_history:
+            st.info("👋 歡迎使用 AI Chef Assistant！\n\n💡 可以詢問：\n- 怎樣做某某菜\n- 烹飪技巧\n- 食材搭配\n- 營養信息等")
+        else:
+            for msg in st.session_state.ai_chat_history:
+                render_chat_message(msg)
+    
+    st.divider()
+    
+    # Input Area
+    col1, col2, col3 = st.columns([5, 1, 1])
+    
+    with col1:
+        user_input = st.text_input(
+            "你的問題",
+            placeholder="例如：怎樣做番茄炒雞蛋？",
+            label_visibility="collapsed",
+            key="chat_input"
+        )
+    
+    with col2:
+        send_btn = st.button("📤 發送", use_container_width=True, key="send_btn")
+    
+    with col3:
+        clear_btn = st.button("🗑️ 清空", use_container_width=True, key="clear_btn")
+    
+    # Handle Send
+    if send_btn and user_input:
+        send_chat_message(user_input, chat_container)
+    
+    # Handle Clear
+    if clear_btn:
+        st.session_state.ai_chat_history = []
+        if "ai_chef" in st.session_state:
+            st.session_state.ai_chef.clear_conversation()
+        st.rerun(scope="fragment")
+    
+    # Quick Tips Buttons
+    st.divider()
+    st.markdown("#### ⚡ 快速提示")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        if st.button("🍳 How to make tomato and egg stir-fry?", use_container_width=True, key="quick1"):
+            send_chat_message("How to make tomato and egg stir-fry?", chat_container)
+    
+    with col2:
+        if st.button("🔥 Cooking Heat Techniques", use_container_width=True, key="quick2"):
+            send_chat_message("Tell me about cooking heat control techniques", chat_container)
+    
+    with col3:
+        if st.button("🥗 Nutrition Pairing Tips", use_container_width=True, key="quick3"):
+            send_chat_message("Give me some nutrition pairing suggestions", chat_container)
+
+
+@st.fragment
+def render_recipe_generator():
+    """菜譜生成面板（按鈕只重新運行這個片段）"""
+    st.markdown("### ✨ AI Smart Recipe Generator")
+    st.write("Enter a dish name and cooking parameters, AI will auto-generate a complete recipe")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        dish_name = st.text_input(
+            "菜名",
+            placeholder="例如：番茄湯、宮保雞丁...",
+            label_visibility="collapsed",
+            key="dish_name"
+        )
+        difficulty = st.select_slider(
+            "難度",
+            options=["簡單", "中等", "困難"],
+            value="中等",
+            key="difficulty"
+        )
+        servings = st.number_input(
+            "份量",
+            min_value=1,
+            max_value=10,
+            value=2,
+            step=1,
+            key="servings"
+        )
+    
+    with col2:
+        cooking_time = st.number_input(
+            "烹飪時間 (分鐘)",
+            min_value=5,
+            max_value=180,
+            value=30,
+            step=5,
+            key="cooking_time"
+        )
+        ingredients_text = st.text_area(
+            "可用食材 (每行一個)",
+            placeholder="例如：\n雞蛋\n番茄\n油\n鹽",
+            height=100,
+            label_visibility="collapsed",
+            key="ingredients"
+        )
+    
+    if st.button("🚀 生成食譜", use_container_width=True, type="primary", key="generate_btn"):
+        if not dish_name:
+            st.error("❌ 請輸入菜名")
+        else:
+            status = st.empty()
+            live = st.empty()
+            status.info("✨ Recipe Generator 🤖🤖🤖 Creating recipe... 🤖🤖🤖")
+            try:
+                ai_chef = get_ai_chef()
+                ingredients = split_ingredient_text(ingredients_text)
+                
+                # 之前生成過相同請求的菜譜時直接顯示，不再調用模型
+                try:
+                    recipe = cached_recipe(dish_name, difficulty, servings, tuple(ingredients or ()), cooking_time)
+                    from_store = True
+                except LookupError:
+                    from_store = False
+                
+                if not from_store:
+                    # 流式生成：材料、步驟等欄位一完整就立即顯示
+                    parser = RecipeStreamParser()
+                    shown = 0
+                    for _ in ai_chef.generate_recipe_stream(
+                        dish_name=dish_name,
+                        difficulty=difficulty,
+                        servings=servings,
+                        available_ingredients=ingredients if ingredients else None,
+                        cooking_time_limit=cooking_time,
+                        parser=parser
+                    ):
+                        if len(parser.fields) > shown and "error" not in parser.fields:
+                            shown = len(parser.fields)
+                            with live.container():
+                                render_recipe(parser.fields, dish_name, difficulty, servings, cooking_time)
+                    
+                    # 與顧問緩存的結果一致：按全文做過結構校驗
+                    recipe = parser.finish()
+                
+                if "error" in recipe:
+                    live.empty()
+                    status.error(f"❌ 生成失敗: {recipe['error']}")
+                elif "raw_response" in recipe:
+                    live.empty()
+                    status.error(f"❌ 生成失敗: {recipe['parse_error']}")
+                else:
+                    if "schema_errors" in recipe:
+                        status.warning(f"⚠️ 食譜不完整（{'；'.join(recipe['schema_errors'])}），可以重新生成")
+                    else:
+                        status.success("📚 已從菜譜庫載入" if from_store else "✅ 食譜生成成功！")
+                    
+                    # Display the generated recipe
+                    with live.container():
+                        render_recipe(recipe, dish_name, difficulty, servings, cooking_time)
+                        
+                        st.divider()
+                        
+                        # Full JSON
+                        with st.expander("📊 查看完整食譜 (JSON 格式)"):
+                            st.json(recipe)
+            
+            except Exception as e:
+                status.error(f"❌ 生成出錯: {str(e)}")
+    
+    # 用現有食材在菜譜庫中查找做過的菜
+    if st.button("📚 用這些食材能做什麼？", use_container_width=True, key="pantry_btn"):
+        available = split_ingredient_text(ingredients_text)
+        store = get_ai_chef().recipe_store
+        if not available:
+            st.warning("⚠️ 請先在上方輸入可用食材")
+        elif store is None:
+            st.info("菜譜庫未啟用")
+        else:
+            matches = store.find_by_ingredients(available, limit=5)
+            if not matches:
+                st.info("菜譜庫中還沒有用到這些食材的菜譜")
+            for match in matches:
+                with st.expander(f"🍽️ {match['菜名']} — 食材覆蓋 {match['覆蓋率']:.0%}"):
+                    if match["缺少食材"]:
+                        st.write(f"還需要: {'、'.join(match['缺少食材'])}")
+                    render_recipe(match["菜譜"], match["菜名"], difficulty, servings, cooking_time)
+
+
 # 設置頁面配置
 st.set_page_config(
     page_title="🤖 AI Chef Assistant",
@@ -42,20 +415,6 @@ st.markdown("""
         font-weight: bold;
         margin-bottom: 20px;
     }
-    .chat-message-user {
-        background-color: #E3F2FD;
-        padding: 12px;
-        border-radius: 8px;
-        margin: 8px 0;
-        border-left: 4px solid #2196F3;
-    }
-    .chat-message-assistant {
-        background-color: #FFF3E0;
-        padding: 12px;
-        border-radius: 8px;
-        margin: 8px 0;
-        border-left: 4px solid #FF9800;
-    }
     .recipe-card {
         background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
         color: white;
@@ -111,15 +470,19 @@ with st.sidebar:
     - **Recipe Generator**: Enter a dish name to auto-generate a complete recipe
     - Can ask about techniques, ingredient combinations, nutrition info, etc.
     """)
+    
+    if DEBUG_MODE:
+        st.divider()
+        render_debug_panel()
 
 # 主要功能
 if not AI_AVAILABLE:
     st.error("❌ AI 模組加載失敗")
     st.info("請確保 ai_chef_functions.py 在同一目錄中")
-elif not HAS_API_KEY:
-    st.error("❌ AI 功能未啟用 - 缺少 API Key")
+elif active_service() == "local":
+    st.error("❌ AI 功能未啟用 - 未配置 API Key 或本地模型")
     st.warning("""
-    ### 設置 API Key 步驟：
+    ### 設置 AI 服務步驟：
     
     **方式 1: 使用 Google Gemini API (推薦免費)**
     1. 訪問 https://ai.google.dev/
@@ -133,6 +496,11 @@ elif not HAS_API_KEY:
     2. 複製 API Key
     3. 在 `.env` 文件中添加：`OPENAI_API_KEY=your_key_here`
     4. 重啟 Streamlit 應用
+    
+    **方式 3: 使用本地模型 (不需要 API Key)**
+    1. 啟動 OpenAI 兼容的本地服務（如 llama.cpp server），在 `.env` 文件中添加：`AI_CHEF_LOCAL_SERVER_URL=http://localhost:8080/v1`
+    2. 或下載 GGUF 模型文件並安裝 llama-cpp-python，在 `.env` 文件中添加：`AI_CHEF_LOCAL_MODEL_PATH=/path/to/model.gguf`
+    3. 重啟 Streamlit 應用
     """)
 else:
     # 使用 Tabs 將兩個功能並排顯示
@@ -140,233 +508,11 @@ else:
     
     # ==================== Tab 1: AI 廚師助手 ====================
     with tab1:
-        st.markdown("### 💬 Chat with AI Chef")
-        st.write("Ask any cooking-related questions, and the AI chef will answer for you")
-        
-        # 初始化對話歷史
-        if "ai_chat_history" not in st.session_state:
-            st.session_state.ai_chat_history = []
-        
-        # Chat History
-        st.markdown("#### 📝 對話記錄")
-        chat_container = st.container(height=350, border=True)
-        
-        with chat_container:
-            if not st.session_state.ai_chat_history:
-                st.info("👋 歡迎使用 AI Chef Assistant！\n\n💡 可以詢問：\n- 怎樣做某某菜\n- 烹飪技巧\n- 食材搭配\n- 營養信息等")
-            else:
-                for msg in st.session_state.ai_chat_history:
-                    if msg["role"] == "user":
-                        st.markdown(f'<div class="chat-message-user">👤 <b>你</b>: {msg["content"]}</div>', unsafe_allow_html=True)
-                    else:
-                        st.markdown(f'<div class="chat-message-assistant">👨‍🍳 <b>AI 廚師</b>: {msg["content"]}</div>', unsafe_allow_html=True)
-        
-        st.divider()
-        
-        # Input Area
-        col1, col2, col3 = st.columns([5, 1, 1])
-        
-        with col1:
-            user_input = st.text_input(
-                "你的問題",
-                placeholder="例如：怎樣做番茄炒雞蛋？",
-                label_visibility="collapsed",
-                key="chat_input"
-            )
-        
-        with col2:
-            send_btn = st.button("📤 發送", use_container_width=True, key="send_btn")
-        
-        with col3:
-            clear_btn = st.button("🗑️ 清空", use_container_width=True, key="clear_btn")
-        
-        # Handle Send
-        if send_btn and user_input:
-            st.session_state.ai_chat_history.append({"role": "user", "content": user_input})
-            
-            with st.spinner("💬 AI Chef Assistant\n🤖🤖🤖 Thinking... 🤖🤖🤖"):
-                try:
-                    ai_chef = init_ai_chef()
-                    response = ai_chef.chat(user_input)
-                    st.session_state.ai_chat_history.append({"role": "assistant", "content": response})
-                except Exception as e:
-                    error_msg = f"❌ 對話出錯: {str(e)}"
-                    st.session_state.ai_chat_history.append({"role": "assistant", "content": error_msg})
-            
-            st.rerun()
-        
-        # Handle Clear
-        if clear_btn:
-            st.session_state.ai_chat_history = []
-            st.rerun()
-        
-        # Quick Tips Buttons
-        st.divider()
-        st.markdown("#### ⚡ 快速提示")
-        
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            if st.button("🍳 How to make tomato and egg stir-fry?", use_container_width=True, key="quick1"):
-                st.session_state.ai_chat_history.append({"role": "user", "content": "How to make tomato and egg stir-fry?"})
-                with st.spinner("💬 AI Chef Assistant\n🤖🤖🤖 Thinking... 🤖🤖🤖"):
-                    try:
-                        ai_chef = init_ai_chef()
-                        response = ai_chef.chat("How to make tomato and egg stir-fry?")
-                        st.session_state.ai_chat_history.append({"role": "assistant", "content": response})
-                    except Exception as e:
-                        error_msg = f"❌ 對話出錯: {str(e)}"
-                        st.session_state.ai_chat_history.append({"role": "assistant", "content": error_msg})
-                st.rerun()
-        
-        with col2:
-            if st.button("🔥 Cooking Heat Techniques", use_container_width=True, key="quick2"):
-                st.session_state.ai_chat_history.append({"role": "user", "content": "Tell me about cooking heat control techniques"})
-                with st.spinner("💬 AI Chef Assistant\n🤖🤖🤖 Thinking... 🤖🤖🤖"):
-                    try:
-                        ai_chef = init_ai_chef()
-                        response = ai_chef.chat("Tell me about cooking heat control techniques")
-                        st.session_state.ai_chat_history.append({"role": "assistant", "content": response})
-                    except Exception as e:
-                        error_msg = f"❌ 對話出錯: {str(e)}"
-                        st.session_state.ai_chat_history.append({"role": "assistant", "content": error_msg})
-                st.rerun()
-        
-        with col3:
-            if st.button("🥗 Nutrition Pairing Tips", use_container_width=True, key="quick3"):
-                st.session_state.ai_chat_history.append({"role": "user", "content": "Give me some nutrition pairing suggestions"})
-                with st.spinner("💬 AI Chef Assistant\n🤖🤖🤖 Thinking... 🤖🤖🤖"):
-                    try:
-                        ai_chef = init_ai_chef()
-                        response = ai_chef.chat("Give me some nutrition pairing suggestions")
-                        st.session_state.ai_chat_history.append({"role": "assistant", "content": response})
-                    except Exception as e:
-                        error_msg = f"❌ 對話出錯: {str(e)}"
-                        st.session_state.ai_chat_history.append({"role": "assistant", "content": error_msg})
-                st.rerun()
+        render_chat_panel()
     
     # ==================== Tab 2: Recipe Generator ====================
     with tab2:
-        st.markdown("### ✨ AI Smart Recipe Generator")
-        st.write("Enter a dish name and cooking parameters, AI will auto-generate a complete recipe")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            dish_name = st.text_input(
-                "菜名",
-                placeholder="例如：番茄湯、宮保雞丁...",
-                label_visibility="collapsed",
-                key="dish_name"
-            )
-            difficulty = st.select_slider(
-                "難度",
-                options=["簡單", "中等", "困難"],
-                value="中等",
-                key="difficulty"
-            )
-            servings = st.number_input(
-                "份量",
-                min_value=1,
-                max_value=10,
-                value=2,
-                step=1,
-                key="servings"
-            )
-        
-        with col2:
-            cooking_time = st.number_input(
-                "烹飪時間 (分鐘)",
-                min_value=5,
-                max_value=180,
-                value=30,
-                step=5,
-                key="cooking_time"
-            )
-            ingredients_text = st.text_area(
-                "可用食材 (每行一個)",
-                placeholder="例如：\n雞蛋\n番茄\n油\n鹽",
-                height=100,
-                label_visibility="collapsed",
-                key="ingredients"
-            )
-        
-        if st.button("🚀 生成食譜", use_container_width=True, type="primary", key="generate_btn"):
-            if not dish_name:
-                st.error("❌ 請輸入菜名")
-            else:
-                with st.spinner("✨ Recipe Generator\n🤖🤖🤖 Creating recipe... 🤖🤖🤖"):
-                    try:
-                        ai_chef = init_ai_chef()
-                        ingredients = [ing.strip() for ing in ingredients_text.split('\n') if ing.strip()]
-                        
-                        recipe = ai_chef.generate_recipe(
-                            dish_name=dish_name,
-                            difficulty=difficulty,
-                            servings=servings,
-                            available_ingredients=ingredients if ingredients else None,
-                            cooking_time_limit=cooking_time
-                        )
-                        
-                        if "error" in recipe:
-                            st.error(f"❌ 生成失敗: {recipe['error']}")
-                        else:
-                            st.success("✅ 食譜生成成功！")
-                            
-                            # Display the generated recipe
-                            if isinstance(recipe, dict):
-                                # Extract key information
-                                st.markdown(f"### 🍳 {recipe.get('菜名', dish_name)}")
-                                
-                                col1, col2, col3, col4 = st.columns(4)
-                                with col1:
-                                    st.metric("難度", recipe.get('難度', difficulty))
-                                with col2:
-                                    st.metric("烹飪時間", recipe.get('烹飪時間', f'{cooking_time}分鐘'))
-                                with col3:
-                                    st.metric("份量", recipe.get('份量', f'{servings}人份'))
-                                with col4:
-                                    st.metric("分類", recipe.get('分類', '其他'))
-                                
-                                st.divider()
-                                
-                                # Ingredients
-                                if '材料' in recipe:
-                                    st.markdown("#### 📦 材料準備")
-                                    if isinstance(recipe['材料'], dict):
-                                        for material, amount in recipe['材料'].items():
-                                            st.write(f"- **{material}**: {amount}")
-                                    else:
-                                        st.write(recipe['材料'])
-                                
-                                # Steps
-                                if '步驟' in recipe:
-                                    st.markdown("#### 👨‍🍳 烹飪步驟")
-                                    if isinstance(recipe['步驟'], list):
-                                        for step in recipe['步驟']:
-                                            st.write(f"{step}")
-                                    else:
-                                        st.write(recipe['步驟'])
-                                
-                                # Tips
-                                if '烹飪技巧' in recipe:
-                                    st.markdown("#### 🔥 烹飪技巧")
-                                    if isinstance(recipe['烹飪技巧'], list):
-                                        for tip in recipe['烹飪技巧']:
-                                            st.markdown(f"- {tip}")
-                                    else:
-                                        st.write(recipe['烹飪技巧'])
-                                
-                                st.divider()
-                                
-                                # Full JSON
-                                with st.expander("📊 查看完整食譜 (JSON 格式)"):
-                                    st.json(recipe)
-                            else:
-                                st.json(recipe)
-                    
-                    except Exception as e:
-                        st.error(f"❌ 生成出錯: {str(e)}")
+        render_recipe_generator()
 
 # Footer
 st.divider()
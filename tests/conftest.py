@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 模組都在倉庫根目錄下（不是安裝的包）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
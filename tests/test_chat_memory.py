@@ -0,0 +1,88 @@
+import asyncio
+
+from ai_chef_async import AsyncAIChefAdvisor
+from ai_chef_backends import STREAMING, TEXT
+from ai_chef_functions import AIChefAdvisor
+
+
+class FakeBackend:
+    name = "fake"
+    label = "Fake"
+
+    def __init__(self, replies, streaming=False):
+        self.replies = list(replies)
+        self.streaming = streaming
+        self.requests = []
+
+    def supports(self, capability):
+        return capability == TEXT or (capability == STREAMING and self.streaming)
+
+    def _next(self, request):
+        self.requests.append([dict(m) for m in request.memory.messages])
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def complete(self, advisor, request):
+        return self._next(request)
+
+    async def complete_async(self, advisor, request):
+        return self._next(request)
+
+    def stream(self, advisor, request):
+        reply = self._next(request)
+        yield reply[:2]
+        raise RuntimeError("connection reset")
+
+
+def _advisor(backend):
+    advisor = AIChefAdvisor(use_service="local", use_cache=False)
+    advisor._backend = lambda: backend
+    advisor._local_backend = lambda exclude=None: None
+    return advisor
+
+
+def _roles(advisor):
+    return [m["role"] for m in advisor.memory]
+
+
+def test_failed_reply_leaves_no_user_turn():
+    backend = FakeBackend([RuntimeError("boom"), "多放點油"])
+    advisor = _advisor(backend)
+
+    assert advisor.chat("怎樣炒青菜？").startswith("❌")
+    assert len(advisor.memory) == 0
+
+    assert advisor.chat("怎樣炒青菜？") == "多放點油"
+    assert _roles(advisor) == ["user", "assistant"]
+    # 請求中包含本輪的用戶消息
+    assert backend.requests[-1] == [{"role": "user", "content": "怎樣炒青菜？"}]
+
+
+def test_unconfigured_service_leaves_memory_empty():
+    advisor = _advisor(None)
+    advisor.chat("你好")
+    assert len(advisor.memory) == 0
+
+
+def test_interrupted_stream_leaves_no_user_turn():
+    advisor = _advisor(FakeBackend(["大火快炒"], streaming=True))
+    assert "".join(advisor.chat_stream("怎樣炒青菜？")).endswith("connection reset")
+    assert len(advisor.memory) == 0
+
+
+def test_async_failed_reply_leaves_no_user_turn():
+    backend = FakeBackend([RuntimeError("boom"), "多放點油"])
+    advisor = AsyncAIChefAdvisor(use_service="local", use_cache=False)
+    advisor._advisor._backend = lambda: backend
+    advisor._advisor._local_backend = lambda exclude=None: None
+
+    async def main():
+        first = await advisor.chat("怎樣炒青菜？")
+        assert len(advisor._advisor.memory) == 0
+        return first, await advisor.chat("怎樣炒青菜？")
+
+    first, second = asyncio.run(main())
+    assert first.startswith("❌") and second == "多放點油"
+    assert _roles(advisor._advisor) == ["user", "assistant"]
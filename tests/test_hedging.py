@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+from ai_chef_async import AsyncAIChefAdvisor
+from ai_chef_hedging import Hedger, HedgeBudget
+
+
+def _hedger():
+    hedger = Hedger(min_samples=1, min_delay=0.01)
+    hedger.tracker.record("primary", 0.01)
+    return hedger
+
+
+def test_async_loser_upstream_call_is_cancelled():
+    hedger = _hedger()
+    advisor = AsyncAIChefAdvisor(use_service="local", max_concurrency=1, use_cache=False)
+    events = []
+
+    async def slow_upstream():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            events.append("primary cancelled")
+            raise
+        return {"ok": "primary"}
+
+    async def primary():
+        # 與後端相同的調用鏈：請求合併 → 並發名額 → 上游請求
+        return await advisor.flights.do("k", lambda: advisor._bounded(slow_upstream))
+
+    async def secondary():
+        return {"ok": "secondary"}
+
+    async def main():
+        result = await hedger.run_async(("primary", primary), ("secondary", secondary), lambda r: "ok" in r)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert events == ["primary cancelled"]
+        assert not advisor._tasks
+        assert not advisor._limiter().locked()
+        assert advisor.flights.stats()["in_flight"] == 0
+        return result
+
+    assert asyncio.run(main()) == {"ok": "secondary"}
+    assert hedger.stats()["hedge_wins"] == 1
+
+
+def test_sync_loser_is_counted_as_abandoned_until_it_finishes():
+    hedger = _hedger()
+    release = threading.Event()
+
+    def primary():
+        release.wait(5)
+        return {"ok": "primary"}
+
+    result = hedger.run(("primary", primary), ("secondary", lambda: {"ok": "secondary"}), lambda r: "ok" in r)
+    assert result == {"ok": "secondary"}
+    assert hedger.stats()["abandoned"] == 1
+
+    release.set()
+    deadline = time.time() + 2
+    while hedger.stats()["abandoned"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert hedger.stats()["abandoned"] == 0
+
+
+def test_abandoned_sync_requests_block_further_hedges():
+    hedger = _hedger()
+    hedger.budget = HedgeBudget(ratio=1.0, burst=1.0)
+    release = threading.Event()
+
+    def primary():
+        release.wait(5)
+        return {"ok": "primary"}
+
+    def fast():
+        return {"ok": "secondary"}
+
+    try:
+        assert hedger.run(("primary", primary), ("secondary", fast), lambda r: "ok" in r) == {"ok": "secondary"}
+        started = time.perf_counter()
+        threading.Timer(0.1, release.set).start()
+        # 上一個落敗請求仍在跑，預算已滿：這次不對沖，等主請求返回
+        assert hedger.run(("primary", primary), ("secondary", fast), lambda r: "ok" in r) == {"ok": "primary"}
+        assert time.perf_counter() - started >= 0.05
+        assert hedger.stats()["budget_denied"] == 1
+    finally:
+        release.set()
@@ -0,0 +1,31 @@
+import pytest
+
+from ai_chef_ingredients import get_ingredient_index, normalize_ingredients
+from ai_chef_nutrition import get_food_table
+
+
+@pytest.mark.parametrize("typo, expected", [
+    ("雞旦", "雞蛋"),
+    ("番加", "番茄"),
+    ("青交", "青椒"),
+    ("菠采", "菠菜"),
+    ("馬玲薯", "馬鈴薯"),
+    ("高麗彩", "高麗菜"),
+])
+def test_short_typos_are_corrected(typo, expected):
+    assert get_ingredient_index().match(typo) == expected
+
+
+@pytest.mark.parametrize("name", ["羊排骨", "牛排骨", "鴨蛋", "牛腩", "烏醋"])
+def test_different_ingredients_are_not_merged(name):
+    assert get_ingredient_index().match(name) is None
+
+
+def test_normalize_keeps_similar_ingredients_apart():
+    assert normalize_ingredients(["西红柿", "蛋", "羊排骨", "牛腩"]) == ["番茄", "雞蛋", "羊排骨", "牛腩"]
+
+
+def test_nutrition_still_groups_similar_ingredients():
+    table = get_food_table()
+    assert table.match("牛腩") == table.match("牛肉")
+    assert table.match("羊排骨") == table.match("排骨")
@@ -0,0 +1,49 @@
+import pytest
+
+from ai_chef_ingredients import get_ingredient_index
+from ai_chef_semantic import DEFAULT_SEMANTIC_THRESHOLD, SemanticCache, embed_text
+
+
+def _similarity(a, b):
+    return float(embed_text(a) @ embed_text(b))
+
+
+@pytest.mark.parametrize("a, b", [
+    ("番茄炒蛋", "番茄炒雞蛋"),
+    ("西红柿炒鸡蛋", "番茄炒蛋"),
+    ("蛋炒飯", "雞蛋炒飯"),
+    ("紅燒魚", "紅燒魚的做法"),
+])
+def test_equivalent_dish_names_match(a, b):
+    assert _similarity(a, b) >= DEFAULT_SEMANTIC_THRESHOLD
+
+
+@pytest.mark.parametrize("a, b", [
+    ("雞蛋炒飯", "鴨蛋炒飯"),
+    ("紅燒牛腩", "紅燒牛肉"),
+    ("烏醋炒麵", "白醋炒麵"),
+])
+def test_different_dishes_do_not_match(a, b):
+    assert _similarity(a, b) < DEFAULT_SEMANTIC_THRESHOLD
+
+
+def test_single_character_name_inside_a_word_is_not_expanded():
+    index = get_ingredient_index()
+    assert ("雞蛋", True) not in index.segment("鴨蛋炒飯")
+    assert index.segment("番茄炒蛋") == [("番茄", True), ("炒", False), ("雞蛋", True)]
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("炒青菜怎樣才能保持翠綠？", "炒青菜怎樣才能保持脆？"),
+    ("米飯煮得太軟怎麼辦", "米飯煮得太硬怎麼辦"),
+])
+def test_exact_lookup_rejects_different_questions(cached, asked):
+    cache = SemanticCache(max_entries=8)
+    cache.set("chat", cached, {"content": "answer"})
+    assert cache.get("chat", asked, exact=True) is None
+
+
+def test_exact_lookup_ignores_script_and_punctuation():
+    cache = SemanticCache(max_entries=8)
+    cache.set("chat", "炒青菜怎樣才能保持翠綠？", {"content": "answer"})
+    assert cache.get("chat", "炒青菜怎样才能保持翠绿", exact=True) == {"content": "answer"}
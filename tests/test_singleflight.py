@@ -0,0 +1,97 @@
+import asyncio
+
+from ai_chef_async import AsyncAIChefAdvisor
+from ai_chef_singleflight import AsyncSingleFlight
+
+
+def test_coalesced_waiters_share_one_call():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def main():
+        return await asyncio.gather(*(flights.do("k", upstream) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["ok", "ok", "ok"]
+    assert len(calls) == 1
+    assert flights.stats()["coalesced"] == 2
+
+
+def test_cancelling_one_of_two_waiters_keeps_the_call():
+    flights = AsyncSingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def main():
+        first = asyncio.ensure_future(flights.do("k", upstream))
+        second = asyncio.ensure_future(flights.do("k", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_cancelling_sole_waiter_cancels_upstream_and_frees_slot():
+    advisor = AsyncAIChefAdvisor(use_service="local", max_concurrency=1, use_cache=False)
+    flights = advisor.flights
+    events = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+        return "slow"
+
+    async def fast():
+        return "fast"
+
+    async def main():
+        waiter = asyncio.ensure_future(flights.do("k", lambda: advisor._bounded(slow)))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0)
+
+        assert flights.stats()["in_flight"] == 0
+        assert not advisor._tasks
+        assert not advisor._limiter().locked()
+        # 並發名額已釋放：下一個請求不用等待被放棄的調用
+        return await asyncio.wait_for(flights.do("k", lambda: advisor._bounded(fast)), 1)
+
+    assert asyncio.run(main()) == "fast"
+    assert events == ["cancelled"]
+
+
+def test_waiter_timeout_cancels_upstream():
+    flights = AsyncSingleFlight()
+    events = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+
+    async def main():
+        try:
+            await asyncio.wait_for(flights.do("k", slow), 0.05)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0)
+        assert events == ["cancelled"]
+        assert flights.stats()["in_flight"] == 0
+
+    asyncio.run(main())
@@ -0,0 +1,18 @@
+from ai_chef_bench import BenchEnvironment, FakeLLM
+
+
+def _usage(env, operation):
+    rows = [row for row in env.metrics.memory.summary() if row["operation"] == operation]
+    return sum(row["prompt_tokens"] for row in rows), sum(row["completion_tokens"] for row in rows)
+
+
+def test_streamed_openai_chat_records_usage(tmp_path):
+    env = BenchEnvironment(FakeLLM(time_scale=0.0), str(tmp_path), "openai", use_cache=False)
+    advisor = env.advisor()
+
+    reply = "".join(advisor.chat_stream("炒青菜怎樣才能保持翠綠？"))
+
+    assert reply
+    prompt_tokens, completion_tokens = _usage(env, "chat_stream")
+    assert prompt_tokens > 0
+    assert completion_tokens == env.llm.stats()["completion_tokens"]